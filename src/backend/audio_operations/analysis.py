@@ -0,0 +1,404 @@
+import hashlib
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np           # needs pip install (installed with soundfile)
+import soundfile as sf      # needs pip install
+from cache import FingerprintCache
+from helpers import get_ffmpeg
+from peaks import PeakBuilder, missing_peaks_builder, store_peaks
+from supervisor import run_supervised, job_timeout, inputs_duration
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Bump when the analysis changes, so that old cached results are ignored
+ANALYSIS_VERSION = 1
+
+# Bump when the content hash changes
+CONTENT_HASH_VERSION = 1
+
+# Bump when the loudness measurement changes
+LOUDNESS_VERSION = 1
+
+# Approximate number of frames read from disk at a time
+BLOCK_FRAMES = 262144
+
+
+# Convert a linear amplitude to dBFS
+def to_db(value: float) -> Optional[float]:
+    """Convert a linear amplitude (1.0 = full scale) to dBFS.
+
+    Returns
+    -------
+    float or None
+        The level in dBFS, rounded to 2 decimals, or None for digital silence.
+    """
+    if value <= 0:
+        return None
+    return round(20 * math.log10(value), 2)
+
+
+# Stream an audio file and measure each channel
+def analyze_audio(file_path: Path, *,
+                  silence_threshold: float = -60.0,
+                  min_silence: float = 0.5,
+                  clip_threshold: float = 0.999,
+                  window: float = 0.05,
+                  channel_names: Optional[List[str]] = None,
+                  peak_builder: Optional[PeakBuilder] = None) -> Dict[str, Any]:
+    """Measure peak, RMS, DC offset, clipping and silent regions of every channel.
+
+    The file is streamed in blocks of about `BLOCK_FRAMES` frames with `soundfile`, and every
+    measurement is computed per block with NumPy, so memory use doesn't depend on the file's length.
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the audio file.
+    silence_threshold : float, optional
+        Windows with an RMS level at or below this level (dBFS) count as silent (default is -60.0).
+    min_silence : float, optional
+        The shortest silent region reported, in seconds (default is 0.5).
+    clip_threshold : float, optional
+        Samples at or above this absolute level (1.0 = full scale) count as clipped (default is 0.999).
+    window : float, optional
+        The length of the windows used to find silent regions, in seconds (default is 0.05).
+    channel_names : List[str], optional
+        Names for the channels in the report, e.g. ['L', 'R'] (default is None, which uses '1', '2', ...).
+    peak_builder : PeakBuilder, optional
+        Also fed every block, to build the file's waveform overview in the same pass (default is None).
+
+    Returns
+    -------
+    Dict[str, Any]
+        A JSON-ready dictionary with the file's 'samplerate', 'channels', 'frames', 'duration' and
+        a 'per_channel' list. Each channel has:
+        - 'name': The channel's name.
+        - 'peak', 'peak_db': Sample peak (linear, dBFS).
+        - 'rms', 'rms_db': RMS level over the whole file (linear, dBFS).
+        - 'dc_offset': Mean sample value.
+        - 'clipped': Number of clipped samples.
+        - 'silent': True if the whole channel is at or below `silence_threshold`.
+        - 'silent_regions': [start, end] pairs in seconds.
+    """
+    info = sf.info(file_path)
+    samplerate, channels = int(info.samplerate), int(info.channels)
+
+    # Blocks hold a whole number of windows, so windows never straddle two blocks
+    win = max(1, int(round(samplerate * window)))
+    block = win * max(1, BLOCK_FRAMES // win)
+    threshold_sq = (10 ** (silence_threshold / 20)) ** 2
+
+    peak = np.zeros(channels)
+    sum_sq = np.zeros(channels)
+    total = np.zeros(channels)
+    clipped = np.zeros(channels, dtype=np.int64)
+    regions = [[] for _ in range(channels)]
+    run_start = [None] * channels   # window index where the current silent run started
+    frames = 0
+    win_index = 0
+
+    with sf.SoundFile(file_path) as f:
+        for data in f.blocks(blocksize=block, dtype='float32', always_2d=True):
+            n = data.shape[0]
+            frames += n
+            if peak_builder is not None:
+                peak_builder.update(data)
+
+            # Level measurements
+            magnitude = np.abs(data)
+            peak = np.maximum(peak, magnitude.max(axis=0))
+            clipped += np.count_nonzero(magnitude >= clip_threshold, axis=0)
+
+            # Energy per window (the last window of the file may be shorter)
+            num_windows = -(-n // win)
+            padded = np.zeros((num_windows * win, channels))
+            padded[:n] = data
+            total += padded.sum(axis=0)
+            energy = (padded.reshape(num_windows, win, channels) ** 2).sum(axis=1)
+            sum_sq += energy.sum(axis=0)
+
+            counts = np.full(num_windows, win)
+            counts[-1] = n - (num_windows - 1) * win
+            silent = energy / counts[:, None] <= threshold_sq
+
+            # Turn silent windows into runs, continuing runs from the previous block
+            for ch in range(channels):
+                prev = 1 if run_start[ch] is not None else 0
+                edges = np.diff(np.concatenate(([prev], silent[:, ch].astype(np.int8))))
+                for i in np.nonzero(edges)[0]:
+                    if edges[i] > 0:
+                        run_start[ch] = win_index + i
+                    else:
+                        regions[ch].append((run_start[ch], win_index + i))
+                        run_start[ch] = None
+
+            win_index += num_windows
+
+    # Close runs that last until the end of the file
+    for ch in range(channels):
+        if run_start[ch] is not None:
+            regions[ch].append((run_start[ch], win_index))
+
+    # Build report
+    names = channel_names if channel_names and len(channel_names) == channels else [str(i + 1) for i in range(channels)]
+    per_channel = []
+    for ch in range(channels):
+        rms = math.sqrt(sum_sq[ch] / frames) if frames else 0.0
+        silent_regions = []
+        for start, end in regions[ch]:
+            start_s = start * win / samplerate
+            end_s = min(end * win, frames) / samplerate
+            if end_s - start_s >= min_silence:
+                silent_regions.append([round(start_s, 3), round(end_s, 3)])
+
+        per_channel.append({
+            'name': names[ch],
+            'peak': float(peak[ch]),
+            'peak_db': to_db(float(peak[ch])),
+            'rms': rms,
+            'rms_db': to_db(rms),
+            'dc_offset': float(total[ch] / frames) if frames else 0.0,
+            'clipped': int(clipped[ch]),
+            'silent': bool(peak[ch] ** 2 <= threshold_sq),
+            'silent_regions': silent_regions,
+        })
+
+    return {
+        'samplerate': samplerate,
+        'channels': channels,
+        'frames': frames,
+        'duration': frames / samplerate if samplerate else 0.0,
+        'silence_threshold': silence_threshold,
+        'per_channel': per_channel,
+    }
+
+
+# Find channels that never rise above a level
+def find_silent_channels(file_path: Path, *, threshold: Optional[float] = None) -> List[int]:
+    """Find the channels of a file that are silent from start to end.
+
+    The file is streamed in blocks and the peak of every channel is tracked with NumPy.
+    Reading stops as soon as every channel has been heard, so for a file without silent
+    channels usually only the first block is read.
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the audio file.
+    threshold : float, optional
+        Channels whose sample peak never exceeds this level (dBFS) are silent
+        (default is None, which only matches digital silence - all-zero channels).
+
+    Returns
+    -------
+    List[int]
+        The indices of the silent channels.
+    """
+    limit = 0.0 if threshold is None else 10 ** (float(threshold) / 20)
+
+    with sf.SoundFile(file_path) as f:
+        silent = np.ones(f.channels, dtype=bool)
+        for data in f.blocks(blocksize=BLOCK_FRAMES, dtype='float32', always_2d=True):
+            silent &= np.abs(data).max(axis=0) <= limit
+            if not silent.any():
+                break
+    return [int(i) for i in np.nonzero(silent)[0]]
+
+
+# Get the QC analysis of a file, from the cache if possible
+def get_qc_report(file_path: Path, *, use_cache: bool = True, **params) -> Tuple[Dict[str, Any], bool]:
+    """Get the `analyze_audio()` report of a file, reusing the cached result if the file hasn't changed.
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the audio file.
+    use_cache : bool, optional
+        If False, always analyze the file (the result is still stored) (default is True).
+    **params
+        Keyword arguments for `analyze_audio()`.
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], bool]
+        The report, and True if it came from the cache.
+    """
+    cache = FingerprintCache('qc')
+    key_params = {'version': ANALYSIS_VERSION, **params}
+    if use_cache:
+        report = cache.get(file_path, key_params)
+        if report is not None:
+            return report, True
+
+    # Build the waveform overview in the same pass if it isn't cached yet
+    builder = missing_peaks_builder(file_path)
+    report = cache.set(file_path, analyze_audio(file_path, peak_builder=builder, **params), key_params)
+    if builder is not None:
+        store_peaks(file_path, builder)
+    return report, False
+
+
+# Hash the decoded audio of a file (not its headers)
+def content_hash(file_path: Path, *, peak_builder: Optional[PeakBuilder] = None) -> str:
+    """Hash the audio content of a file, ignoring its container, headers and metadata.
+
+    The samples are streamed in blocks (as integers for PCM files, so the hash is exact) and
+    fed to BLAKE2b together with the sample rate, channel count and sample format. Two files
+    with the same hash hold the same audio, even if their names, tags or chunks differ.
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the audio file.
+    peak_builder : PeakBuilder, optional
+        Also fed every block, to build the file's waveform overview in the same pass (default is None).
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    with sf.SoundFile(file_path) as f:
+        dtype = 'int32' if f.subtype.startswith('PCM') else 'float64'
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{f.samplerate}|{f.channels}|{f.subtype}|".encode())
+        for data in f.blocks(blocksize=BLOCK_FRAMES, dtype=dtype, always_2d=True):
+            digest.update(np.ascontiguousarray(data).tobytes())
+            if peak_builder is not None:
+                peak_builder.update(data)
+    return digest.hexdigest()
+
+
+# Get the content hash of a file, from the cache if possible
+def get_content_hash(file_path: Path, *, use_cache: bool = True) -> str:
+    """Get `content_hash()` of a file, reusing the cached value if the file hasn't changed."""
+    cache = FingerprintCache('content_hash')
+    params = {'version': CONTENT_HASH_VERSION}
+    if use_cache:
+        value = cache.get(file_path, params)
+        if value is not None:
+            return value
+
+    # Build the waveform overview in the same pass if it isn't cached yet
+    builder = missing_peaks_builder(file_path)
+    value = cache.set(file_path, content_hash(file_path, peak_builder=builder), params)
+    if builder is not None:
+        store_peaks(file_path, builder)
+    return value
+
+
+# Group files that hold the same audio
+def group_duplicates(file_paths: List[Path], *, workers: int = 2) -> Dict[str, List[str]]:
+    """Group files with the same audio content (and extension).
+
+    Parameters
+    ----------
+    file_paths : List[Path]
+        The paths to the audio files.
+    workers : int, optional
+        The number of files hashed at once (default is 2). Hashing is bound by disk throughput.
+
+    Returns
+    -------
+    Dict[str, List[str]]
+        Maps the first file of each group (in the order given) to the other files of the group.
+        Files that could not be hashed are their own group.
+    """
+    def safe_hash(path):
+        try:
+            return get_content_hash(path)
+        except Exception as e:
+            print(f"NOTE: '{os.path.basename(path)}' could not be hashed. ({e})")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        hashes = list(pool.map(safe_hash, file_paths))
+
+    groups, firsts = {}, {}
+    for path, digest in zip(file_paths, hashes):
+        # The extension is part of the key, as operations name their outputs after it
+        key = None if digest is None else (digest, os.path.splitext(path)[1].lower())
+        if key is not None and key in firsts:
+            groups[firsts[key]].append(path)
+        else:
+            groups[path] = []
+            if key is not None:
+                firsts[key] = path
+    return groups
+
+
+# Measure the loudness of a file (first pass of 'normalize')
+def measure_loudness(file_path: Path) -> Dict[str, Optional[float]]:
+    """Measure the integrated loudness, loudness range and true peak of a file (ITU-R BS.1770 / EBU R128).
+
+    The file is decoded once by ffmpeg's 'ebur128' filter (with 4x oversampled true peak), and the
+    summary it logs is parsed. Channels are weighted by the file's layout (the LFE is left out).
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the audio file.
+
+    Returns
+    -------
+    Dict[str, Optional[float]]
+        A JSON-ready dictionary with:
+        - 'integrated': Integrated loudness (LUFS).
+        - 'threshold': Relative gating threshold of the integrated loudness (LUFS).
+        - 'lra': Loudness range (LU).
+        - 'true_peak': Highest true peak of all channels (dBTP), or None for digital silence.
+
+    Raises
+    ------
+    ValueError
+        If ffmpeg's output has no loudness summary.
+    supervisor.SupervisorError
+        If ffmpeg failed.
+    """
+    cmd = get_ffmpeg()['-nostdin', '-hide_banner', '-i', file_path, '-map', '0:a:0',
+                       '-af', 'ebur128=peak=true:framelog=quiet', '-f', 'null', '-']
+    log = run_supervised([str(arg) for arg in cmd.formulate()], timeout=job_timeout(inputs_duration([file_path])),
+                         label=str(file_path), capture_stderr=True)
+
+    # The summary is the last thing the filter logs
+    summary = log[log.rfind('Summary:'):]
+    values = {}
+    for key, pattern in (('integrated', r'I:\s+(\S+) LUFS'), ('threshold', r'Threshold:\s+(\S+) LUFS'),
+                         ('lra', r'LRA:\s+(\S+) LU'), ('true_peak', r'Peak:\s+(\S+) dBFS')):
+        match = re.search(pattern, summary)
+        if match is None:
+            raise ValueError(f"No loudness summary for '{os.path.basename(file_path)}' in ffmpeg's output.")
+        value = float(match.group(1))
+        values[key] = value if math.isfinite(value) else None
+    return values
+
+
+# Get the loudness of a file, from the cache if possible
+def get_loudness(file_path: Path, *, use_cache: bool = True) -> Tuple[Dict[str, Optional[float]], bool]:
+    """Get `measure_loudness()` of a file, reusing the cached measurement of the same audio.
+
+    Measurements are keyed by `get_content_hash()` (the decoded samples), so a re-delivered copy
+    (another path, name or modification time) skips the ebur128 pass. Hashing streams the file
+    once without filtering, and is itself cached by file fingerprint. Files that `soundfile`
+    can't decode are keyed by their fingerprint instead.
+
+    Returns
+    -------
+    Tuple[Dict[str, Optional[float]], bool]
+        The measurement, and True if it came from the cache.
+    """
+    cache = FingerprintCache('loudness')
+    try:
+        key = hashlib.sha1(f"{get_content_hash(file_path)}|{LOUDNESS_VERSION}".encode()).hexdigest()
+    except (RuntimeError, OSError, ValueError):
+        key = cache.key(file_path, {'version': LOUDNESS_VERSION})
+    if key is None:
+        return measure_loudness(file_path), False
+    if use_cache:
+        value = cache.load(key)
+        if value is not None:
+            return value, True
+    return cache.store(key, measure_loudness(file_path)), False
@@ -0,0 +1,361 @@
+import asyncio
+import inspect
+import os
+import time
+from helpers import SoundFilesUtils, FFMPEG_THREADS
+from scheduler import estimate_cost
+from tasks import Task
+from supervisor import run_supervised_async
+from cancellation import CancelToken, cancellable
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, List, Dict, Tuple, Union
+
+
+class FileResult:
+    """The result of one task (usually one input file) of an operation.
+
+    Attributes
+    ----------
+    inputs : List[str]
+        The paths to the task's input files.
+    outputs : List[str]
+        The paths to the files written (empty if the task failed).
+    method : str or None
+        How the outputs were produced ('ffmpeg' or a fast path method such as 'reflink').
+    argv : List[str] or None
+        The ffmpeg command that was run (None for Python actions).
+    error : str or None
+        The error message if the task failed.
+    reason : str or None
+        Why the task failed, e.g. 'timeout', 'stalled' or 'invalid_input' (see `supervisor.SupervisorError`).
+    info : Dict[str, List[Any]]
+        Extra details reported by the task (e.g. 'skipped_channels').
+    started : float
+        The time the task started (`time.time()`).
+    elapsed : float
+        Wall-clock time the task took, in seconds.
+    """
+
+    def __init__(self, inputs: List[str], *, outputs: Optional[List[str]] = None, method: Optional[str] = None,
+                 argv: Optional[List[str]] = None, error: Optional[str] = None) -> None:
+        self.inputs = list(inputs)
+        self.outputs = list(outputs or [])
+        self.method = method
+        self.argv = argv
+        self.error = error
+        self.reason = None if error is None else 'error'
+        self.info = {}
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """bool: True if the task succeeded."""
+        return self.error is None
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the result to a JSON-ready dictionary."""
+        return {
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "method": self.method,
+            "argv": self.argv,
+            "error": self.error,
+            "reason": self.reason,
+            **self.info,
+            "started": self.started,
+            "elapsed": self.elapsed,
+        }
+
+    def __repr__(self) -> str:
+        status = 'ok' if self.ok else f'error={self.error!r}'
+        return f"FileResult({[os.path.basename(path) for path in self.inputs]}, {status}, {self.elapsed:.2f}s)"
+
+
+class RunResult:
+    """The result of `run()`.
+
+    Attributes
+    ----------
+    operation : str
+        The operation that was run.
+    out_dir : str
+        The output directory.
+    files : List[FileResult]
+        One result per task (tasks that failed while planning are included, with their error).
+    elapsed : float
+        Wall-clock time of the whole run, in seconds.
+    """
+
+    def __init__(self, operation: str, out_dir: str) -> None:
+        self.operation = operation
+        self.out_dir = out_dir
+        self.files = []
+        self.elapsed = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """bool: True if every task succeeded."""
+        return all(result.ok for result in self.files)
+
+    @property
+    def outputs(self) -> List[str]:
+        """List[str]: All the files written."""
+        return [output for result in self.files for output in result.outputs]
+
+    @property
+    def errors(self) -> List[FileResult]:
+        """List[FileResult]: The results of the tasks that failed."""
+        return [result for result in self.files if not result.ok]
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the result to a JSON-ready dictionary."""
+        return {
+            "operation": self.operation,
+            "out_dir": self.out_dir,
+            "ok": self.ok,
+            "elapsed": self.elapsed,
+            "files": [result.to_json() for result in self.files],
+        }
+
+
+# Run a Python action in a worker thread that stops when the asyncio task is cancelled
+async def run_action(task: Task) -> None:
+    """Run `task.run()` in a worker thread.
+
+    A thread can't be interrupted, so cancelling the asyncio task cancels a `CancelToken`
+    that the action checks (e.g. `pcm_engine.transcode()` checks it between blocks), then waits
+    for the thread to stop, so that the partial outputs can be deleted safely.
+    """
+    token = CancelToken()
+
+    def run() -> None:
+        with cancellable(token):
+            task.run()
+
+    thread = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        await asyncio.shield(thread)
+    except asyncio.CancelledError:
+        token.cancel()
+        try:
+            await thread
+        except Exception:
+            pass
+        raise
+
+
+# Run one task without blocking the event loop
+async def run_task(task: Task) -> FileResult:
+    """Run a task, using an asyncio subprocess for ffmpeg commands.
+
+    Parameters
+    ----------
+    task : Task
+        The task to run.
+
+    Returns
+    -------
+    FileResult
+        The result of the task. Errors are stored in the result, not raised.
+
+    Raises
+    ------
+    asyncio.CancelledError
+        If the run is cancelled. The ffmpeg process group is killed and the task's partial outputs are deleted.
+
+    Notes
+    -----
+    ffmpeg runs under `supervisor.run_supervised_async()`: it is killed if it times out or stalls,
+    and retried after transient failures.
+    """
+    result = FileResult(task.inputs, argv=task.argv)
+    start = time.perf_counter()
+    try:
+        task.prepare()
+        if task.cmd is not None:
+            timeout = await asyncio.to_thread(lambda: task.timeout)
+            await run_supervised_async(task.run_argv, timeout=timeout, label=task.inputs[0] if task.inputs else None,
+                                       on_retry=task.prepare)
+            task.commit()
+        else:
+            await run_action(task)
+
+        result.outputs = task.outputs
+        result.method = task.method
+        result.info = task.info
+
+    except asyncio.CancelledError:
+        task.clean()
+        raise
+
+    except Exception as e:
+        result.error = str(e)
+        result.reason = getattr(e, 'reason', 'error')
+        await asyncio.to_thread(task.clean)
+
+    finally:
+        result.elapsed = time.perf_counter() - start
+    return result
+
+
+# Run an operation from Python code
+async def run(op: str, inputs: Union[Path, List[Path]], out: Path, *,
+              concurrency: Optional[int] = None,
+              threads: Optional[int] = None,
+              semaphore: Optional[asyncio.Semaphore] = None,
+              on_event: Optional[Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]] = None,
+              cancel: Optional[CancelToken] = None,
+              **opts) -> RunResult:
+    """Run an operation and return structured results, without a subprocess per job.
+
+    All ffmpeg processes are started as asyncio subprocesses, so a single event loop can drive
+    hundreds of concurrent jobs. Probing and planning run in worker threads.
+
+    Parameters
+    ----------
+    op : str
+        The operation to run (a key of `audio_operations.FUNC_TYPE`, e.g. 'split').
+    inputs : Path or List[Path]
+        An audio file, a folder of audio files, or a list of them.
+    out : Path
+        The output directory (created if it doesn't exist). Unlike `main()`, no 'out_*' sub-folder is created.
+    concurrency : int, optional
+        The maximum number of tasks running at once (default is None, which uses `os.cpu_count()`).
+    threads : int, optional
+        The number of threads each ffmpeg process may use (default is None, which uses ffmpeg's default).
+    semaphore : asyncio.Semaphore, optional
+        A semaphore shared with other runs, to bound the tasks of all of them together
+        (default is None, which creates one from `concurrency`).
+    on_event : Callable[[Dict[str, Any]], None], optional
+        Called (or awaited, if it is a coroutine function) with a dictionary for every task event.
+        The dictionary has an 'event' key ('planned', 'started', 'finished' or 'failed') and
+        the keys of `FileResult.to_json()` that are known at that point.
+    cancel : CancelToken, optional
+        A token that cancels the run from any thread (default is None). Tasks that haven't started are
+        not started, running ffmpeg processes are killed and their partial outputs deleted; these tasks
+        are returned with the reason 'cancelled'.
+    **opts
+        Keyword arguments for the operation function (e.g. `link=True` for 'convert').
+
+    Returns
+    -------
+    RunResult
+        The outputs, timings and errors of every task.
+
+    Raises
+    ------
+    ValueError
+        If the operation is not supported or an option is not accepted by the operation.
+
+    Example
+    -------
+    >>> result = await run('split', '/path/to/multitracks', '/path/to/out')
+    >>> result.ok, result.outputs
+    (True, ['/path/to/out/track/track.L.wav', ...])
+    """
+    from audio_operations import FUNC_TYPE, split_options
+
+    if op not in FUNC_TYPE:
+        raise ValueError(f"Operation Type incorrect: '{op}'")
+    func, repeat, list_type, job_kind, plan = FUNC_TYPE[op][:5]
+    opts, _ = split_options(opts, func)
+
+    start = time.perf_counter()
+    out_dir = os.path.abspath(out)
+    os.makedirs(out_dir, exist_ok=True)
+    run_result = RunResult(op, out_dir)
+    threads_token = FFMPEG_THREADS.set(threads)
+    try:
+        async def emit(event: str, result: FileResult) -> None:
+            if on_event is None:
+                return
+            payload = {'event': event, **result.to_json()}
+            outcome = on_event(payload)
+            if inspect.isawaitable(outcome):
+                await outcome
+
+        # Resolve inputs (one per file for repeated operations)
+        paths = [inputs] if isinstance(inputs, (str, os.PathLike)) else list(inputs)
+        resolved = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if repeat and os.path.isdir(path):
+                sfu = await asyncio.to_thread(SoundFilesUtils, path)
+                resolved.extend(os.path.join(path, sfile) for sfile in sfu.list_by_type(list_type))
+            else:
+                resolved.append(path)
+
+        # Longest files first
+        costs = await asyncio.gather(*[asyncio.to_thread(estimate_cost, path) for path in resolved])
+        resolved = [path for _, path in sorted(zip(costs, resolved), key=lambda pair: -pair[0])]
+
+        # Plan every input in worker threads (probing blocks)
+        async def plan_input(path: str) -> List[Task]:
+            try:
+                return await asyncio.to_thread(plan, path, out_dir, **opts)
+            except Exception as e:
+                result = FileResult([path], error=str(e))
+                run_result.files.append(result)
+                await emit('failed', result)
+                return []
+
+        planned = await asyncio.gather(*[plan_input(path) for path in resolved])
+        tasks = [task for task_list in planned for task in task_list]
+
+        # Run tasks with bounded concurrency
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+
+        async def run_bounded(task: Task) -> FileResult:
+            await emit('planned', FileResult(task.inputs, argv=task.argv))
+            async with semaphore:
+                await emit('started', FileResult(task.inputs, argv=task.argv))
+                result = await run_task(task)
+            await emit('finished' if result.ok else 'failed', result)
+            return result
+
+        running = [asyncio.ensure_future(run_bounded(task)) for task in tasks]
+
+        # Cancel the tasks that are still running or waiting when the token is cancelled
+        def cancel_running() -> None:
+            for future in running:
+                future.cancel()
+
+        loop = asyncio.get_running_loop()
+        remove = cancel.on_cancel(lambda: loop.call_soon_threadsafe(cancel_running)) if cancel else None
+        try:
+            results = await asyncio.gather(*running, return_exceptions=True)
+        finally:
+            if remove:
+                remove()
+
+        for task, result in zip(tasks, results):
+            if isinstance(result, asyncio.CancelledError):
+                result = FileResult(task.inputs, argv=task.argv, error="Cancelled.")
+                result.reason = 'cancelled'
+            elif isinstance(result, BaseException):
+                raise result
+            run_result.files.append(result)
+        run_result.elapsed = time.perf_counter() - start
+        return run_result
+    finally:
+        # Don't leave the caller's context capped (or uncapped) for later work
+        FFMPEG_THREADS.reset(threads_token)
+
+
+# Blocking wrapper for scripts that don't have an event loop
+def run_blocking(op: str, inputs: Union[Path, List[Path]], out: Path, **kwargs) -> RunResult:
+    """Run `run()` in a new event loop and wait for it to finish.
+
+    Parameters
+    ----------
+    op, inputs, out, **kwargs
+        See `run()`.
+
+    Returns
+    -------
+    RunResult
+        The outputs, timings and errors of every task.
+    """
+    return asyncio.run(run(op, inputs, out, **kwargs))
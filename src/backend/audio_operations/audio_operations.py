@@ -1,12 +1,35 @@
 import os
+import json
 import sys
 import shutil
-from core_functions import split_multi_sf, mono_to_multi, sf_to_mov, repeat_operation, convert_to_audio
-from helpers import create_outfldr
+import time
+import inspect
+import multiprocessing
+from functools import partial
+from core_functions import split_multi_sf, mono_to_multi, sf_to_mov, repeat_operation, convert_to_audio, qc_audio, package_to_mov, qc_video, remap_channels, concat_files, downmix_channels, normalize_loudness
+from core_functions import plan_split_multi_sf, plan_mono_to_multi, plan_sf_to_mov, plan_convert_to_audio, plan_qc_audio, plan_package_to_mov, plan_qc_video, plan_remap_channels, plan_concat_files, plan_downmix_channels, plan_normalize_loudness
+from helpers import SoundFilesUtils, create_outfldr, parse_options
+from history import resolve_history_path, recording, record_result, stage
+from cancellation import CancelToken, CancelledError, cancellable, current_token, install_signal_handlers, watch_stdin
 from pathlib import Path
 from typing import Callable, Optional, List, Dict, Tuple, Union
 
 
+# Supported operations - operation: [function, repeat, list_type, job_kind, plan_function]
+FUNC_TYPE = {
+    "split": [split_multi_sf, True, 'multi', 'io', plan_split_multi_sf],
+    "merge": [mono_to_multi, False, 'mono', 'cpu', plan_mono_to_multi],
+    "conform": [sf_to_mov, True, 'multi', 'io', plan_sf_to_mov],
+    "convert": [convert_to_audio, True, 'all', 'cpu', plan_convert_to_audio],
+    "qc": [qc_audio, True, 'all', 'cpu', plan_qc_audio],
+    "package": [package_to_mov, False, 'all', 'io', plan_package_to_mov],
+    "qc_video": [qc_video, True, 'video', 'io', plan_qc_video],
+    "remap": [remap_channels, True, 'multi', 'io', plan_remap_channels],
+    "concat": [concat_files, False, 'all', 'io', plan_concat_files],
+    "downmix": [downmix_channels, True, 'multi', 'cpu', plan_downmix_channels],
+    "normalize": [normalize_loudness, True, 'all', 'cpu', plan_normalize_loudness],
+}
+
 
 def main() -> None:
     """Main entry point of the audio processing tool.
@@ -16,7 +39,7 @@ def main() -> None:
     converting audio formats, and more.
 
     Usage:
-    python main.py [input_path] [output_path] [operation_type]
+    python main.py [input_path] [output_path] [operation_type] [--option=value ...]
 
     NOTE: This program is made to be used with electron's child process. If you want to use it elsewhere,
     make sure you have changed the sys.executable in get_root_folder() with the appropriate path to the bin files.
@@ -27,6 +50,8 @@ def main() -> None:
     - input_path: Path to a file or folder that includes audio files
     - output_path: Path to an output directory that processed files will be stored
     - operation_type: str, the type of operation the program will execute (check the keys of FUNC_TYPE)
+    - options (optional): '--key=value' or '--flag' arguments, passed as keyword arguments to the operation
+      function (e.g. '--link' for 'convert')
 
     Returns
     -------
@@ -36,33 +61,46 @@ def main() -> None:
     Notes
     -----
     - This script relies on core_functions and helpers modules for operation implementations.
-    - The operation type should be one of: "split", "merge", "conform", or "convert".
+    - The operation type should be one of: "split", "merge", "conform", "convert", "qc", "package", "qc_video", "remap", "concat", "downmix" or "normalize".
     - Refer to the core_functions module for specific operation details.
+    - SIGINT/SIGTERM or a 'cancel' line on stdin cancel the run: finished outputs are kept, running ffmpeg
+      processes are killed, partial outputs are deleted and the script exits with code 4.
 
     Examples
     --------
     Command line usage:
     python main.py input_audio.wav output_dir split
+    python main.py input_dir output_dir convert --link
+    python main.py input_dir output_dir split --plan=split_plan.json
+    python main.py input_dir output_dir convert --history
     """
 
-    FUNC_TYPE = {
-    "split": [split_multi_sf, True, 'multi'],
-    "merge": [mono_to_multi, False, 'mono'],
-    "conform": [sf_to_mov, True, 'multi'],
-    "convert": [convert_to_audio, True, 'all'],
-    }
-
 
     # ARGS: Get input / output absolute paths
     num_args = len(sys.argv) - 1
-    if not num_args == 3:
-        print("User did not provide necessary args. Usage: [inPath] [outPath] [operationType]")
+    if num_args < 3:
+        print("User did not provide necessary args. Usage: [inPath] [outPath] [operationType] [--option=value ...]")
         sys.exit(3)    
     else:
          in_path: Path = os.path.normpath(os.path.abspath(sys.argv[1]))
          out_dir: Path = os.path.normpath(os.path.abspath(sys.argv[2]))
          operation: str = sys.argv[3]
 
+    # ARGS: Get optional arguments
+    try:
+        options = parse_options(sys.argv[4:])
+    except ValueError as e:
+        print(e)
+        sys.exit(3)
+
+    # '--plan' or '--plan=plan.json' writes the execution plan instead of running the operation
+    plan_path = options.pop('plan', False)
+    if plan_path:
+        return write_plan(in_path, out_dir, operation, options, plan_path)
+
+    # '--history' or '--history=runs.sqlite' records the run (see `history.py`)
+    history = resolve_history_path(options.pop('history', False))
+
     # Print out that operation has started
     print(f"{operation.upper()} OPERATION STARTED...\n")
 
@@ -75,6 +113,7 @@ def main() -> None:
         func1 = FUNC_TYPE[operation][0]
         repeat = FUNC_TYPE[operation][1]
         list_type = FUNC_TYPE[operation][2]
+        job_kind = FUNC_TYPE[operation][3]
     except Exception as e:
         print(f"Operation Type incorrect: '{operation}'")
         print(e)
@@ -84,13 +123,36 @@ def main() -> None:
     if repeat == True:
         repeat: Callable = repeat_operation
 
+    # Split options between the operation function and the batch (repeat) function
+    batch_options = {'job_kind': job_kind} if repeat else {}
+    try:
+        options, batch = split_options(options, func1, repeat)
+        batch_options.update(batch)
+    except ValueError as e:
+        print(f"{e} ('{operation}' operation)")
+        sys.exit(2)
+
+    # SIGINT/SIGTERM or a 'cancel' line on stdin cancel the run
+    cancel = CancelToken()
+    install_signal_handlers(cancel)
+    watch_stdin(cancel)
+
     # Run operation and print message
     try:
-        output = run_operation(func1, in_path, out_dir, out_name=op_type, list_type=list_type, repeat_func=repeat)
+        output = run_operation(func1, in_path, out_dir, out_name=op_type, list_type=list_type, repeat_func=repeat,
+                               options=options, batch_options=batch_options, history=history, cancel=cancel)
+        # run_operation() prints the error and returns None if the operation failed
+        if output is None:
+            print(f"Failed to execute {op_type} operation.")
+            sys.exit(1)
         success_message = f"\n{op_type.upper()} OPERATION FINISHED. \n -> Output folder: {output}"
         print(success_message)
         sys.exit(0)
 
+    except CancelledError as e:
+        print(f"\n{op_type.upper()} OPERATION CANCELLED. ({e})")
+        sys.exit(4)
+
     except Exception as e:
         error_message = f"Failed to execute {op_type} operation."
         print(error_message)
@@ -101,9 +163,67 @@ def main() -> None:
 
 # **MAIN'S HELPER FUNCTIONS**
 
+def write_plan(in_path: Path, out_dir: Path, operation: str, options: Dict[str, Union[str, bool]],
+               plan_path: Union[str, bool] = True) -> None:
+    """Build the execution plan of an operation and save it as JSON, without running anything.
+
+    The plan can be reviewed, then run unchanged with `python planner.py run [plan.json]`.
+
+    Parameters
+    ----------
+    in_path : Path
+        The path to the input audio file or directory of files.
+    out_dir : Path
+        The output directory the operation would create its 'out_*' folder in.
+    operation : str
+        The operation (a key of FUNC_TYPE).
+    options : Dict[str, Union[str, bool]]
+        The operation's options (as returned by `helpers.parse_options()`, without 'plan').
+    plan_path : str or bool, optional
+        Where to save the plan (default is True, which saves '<out_dir>/<operation>_plan.json').
+    """
+    from planner import build_plan
+
+    print(f"{operation.upper()} PLAN STARTED...\n")
+    if operation not in FUNC_TYPE:
+        print(f"Operation Type incorrect: '{operation}'")
+        sys.exit(2)
+    func, repeat = FUNC_TYPE[operation][:2]
+    try:
+        options, batch_options = split_options(options, func, repeat_operation if repeat else False)
+    except ValueError as e:
+        print(f"{e} ('{operation}' operation)")
+        sys.exit(2)
+
+    try:
+        plan = build_plan(operation, in_path, out_dir, options=options, batch_options=batch_options)
+        if plan_path is True:
+            plan_path = os.path.join(out_dir, f"{operation}_plan.json")
+        with open(plan_path, 'w') as f:
+            json.dump(plan, f, indent=4)
+    except Exception as e:
+        print(f"Failed to plan {operation} operation.")
+        print(e)
+        sys.exit(1)
+
+    # Summary
+    estimate = plan['estimate']
+    for name, reason in plan['skipped'].items():
+        print(f"SKIPPED: '{name}' ({reason})")
+    print(f"{len(plan['tasks'])} task(s), ~{estimate['output_bytes'] / 1e6:.1f} MB written, "
+          f"~{estimate['wall_seconds']:.1f}s on {estimate['slots']} slot(s)"
+          f"{'' if estimate['calibrated'] else ' (uncalibrated model)'}.")
+    print(f"\n{operation.upper()} PLAN FINISHED. \n -> Plan: {os.path.abspath(plan_path)}")
+    sys.exit(0)
+
+
 def run_operation(func: Callable, in_path: Path, out_path: Optional[Path] = None, *,
                   out_name: str = 'files', list_type: str = 'all',
-                  repeat_func: Callable = repeat_operation) -> Optional[Path]:
+                  repeat_func: Callable = repeat_operation,
+                  options: Optional[Dict[str, Union[str, bool]]] = None,
+                  batch_options: Optional[Dict[str, Union[str, bool]]] = None,
+                  history: Optional[Path] = None,
+                  cancel: Optional[CancelToken] = None) -> Optional[Path]:
     """Run the specified audio processing operation on input files.
 
     Parameters
@@ -120,6 +240,15 @@ def run_operation(func: Callable, in_path: Path, out_path: Optional[Path] = None
         The type of list to pass to the operation function ('all', 'multi', 'mono').
     repeat_func : Callable, optional
         The function to use for repeating the operation on multiple files.
+    options : Dict[str, Union[str, bool]], optional
+        Keyword arguments passed to `func` on every call.
+    batch_options : Dict[str, Union[str, bool]], optional
+        Keyword arguments passed to `repeat_func` (e.g. 'jobs', 'cores').
+    history : Path, optional
+        A run history database to append a record of this run to (default is None, which doesn't record it).
+        See `history.RunRecord` for what is recorded.
+    cancel : CancelToken, optional
+        A token that cancels the run (default is None, which uses the current token, if any).
 
     Returns
     -------
@@ -130,47 +259,179 @@ def run_operation(func: Callable, in_path: Path, out_path: Optional[Path] = None
     -----
     - This function creates an output folder for processed files.
     - Depending on the operation and list_type, it repeats the operation on multiple files if needed.
-    - Errors during the operation lead to folder deletion and None return value.
+    - Errors during the operation, or an operation function returning None, lead to folder deletion and None return value.
+    - A cancelled run keeps the outputs that were finished, deletes the partial ones and raises `CancelledError`.
+
+    Raises
+    ------
+    CancelledError
+        If `cancel` was cancelled before the run finished.
     """
-    # Create out folder and store its absolute path
-    try:
-        out_dir = create_outfldr(out_name, out_dir=out_path)
-    except Exception:
-        raise OSError("Could not create out_folder.")
+    # Record the run in the history database
+    if history:
+        return run_recorded(func, in_path, out_path, history=history, out_name=out_name, list_type=list_type,
+                            repeat_func=repeat_func, options=options, batch_options=batch_options, cancel=cancel)
+
+    # Make the cancel token current for everything the run starts (see `cancellation.py`)
+    with cancellable(cancel or current_token()) as cancel:
 
-    if repeat_func == False:
+        # Create out folder and store its absolute path
         try:
-            func(in_path, out_dir)
-            return out_dir
-        except Exception as e:
-            shutil.rmtree(out_dir, ignore_errors=True) # Deletes folder
-            print(str(e))       
-    else:
-        # Check if path is dir or file    
-        if os.path.isdir(in_path):
+            with stage('setup'):
+                out_dir = create_outfldr(out_name, out_dir=out_path)
+        except Exception:
+            raise OSError("Could not create out_folder.")
+
+        # Bind optional keyword arguments to the operation function
+        if options:
+            func = partial(func, **options)
+
+        if repeat_func == False or not os.path.isdir(in_path):
             try:
-                repeat_func(in_path, out_dir, list_type=list_type, func=func)
+                cancel.check()
+                with stage('process'):
+                    result = func(in_path, out_dir)
+                # Operation functions report their errors instead of raising them, and return None
+                cancel.check()
+                record_result(os.path.basename(in_path), result)
+                if result is None:
+                    shutil.rmtree(out_dir, ignore_errors=True) # Deletes folder
+                    return None
                 return out_dir
+            except CancelledError as e:
+                record_result(os.path.basename(in_path), error=e)
+                remove_if_empty(out_dir)
+                raise
             except Exception as e:
+                record_result(os.path.basename(in_path), error=e)
                 shutil.rmtree(out_dir, ignore_errors=True) # Deletes folder
                 print(str(e))
-        else:      
+        else:
             try:
-                func(in_path, out_dir)
+                repeat_func(in_path, out_dir, list_type=list_type, func=func, **(batch_options or {}))
+                cancel.check()
                 return out_dir
+            except CancelledError:
+                # Finished outputs are kept, unfinished ones were deleted by their tasks
+                remove_if_empty(out_dir)
+                raise
             except Exception as e:
                 shutil.rmtree(out_dir, ignore_errors=True) # Deletes folder
                 print(str(e))
 
 
+def remove_if_empty(folder: Path) -> None:
+    """Delete `folder` and its empty sub-folders, but only if no file is left in it."""
+    for root, dirs, files in os.walk(folder, topdown=False):
+        if files:
+            return
+        try:
+            os.rmdir(root)
+        except OSError:
+            return
+
+
+def run_recorded(func: Callable, in_path: Path, out_path: Optional[Path] = None, *, history: Path,
+                 out_name: str = 'files', list_type: str = 'all', **kwargs) -> Optional[Path]:
+    """Run `run_operation()` and append a record of the run to a history database.
+
+    Parameters
+    ----------
+    func, in_path, out_path, out_name, list_type, **kwargs
+        See `run_operation()`.
+    history : Path
+        The path to the history database (created if it doesn't exist).
+
+    Returns
+    -------
+    Path or None
+        The value returned by `run_operation()`.
+
+    Notes
+    -----
+    A history that can't be written is reported, but doesn't fail the run.
+    """
+    import sqlite3
+    from history import save_run, ffmpeg_version
+
+    # Input files (probed before the run, so that probing isn't timed)
+    if os.path.isdir(in_path):
+        sfu = SoundFilesUtils(user_path=in_path)
+        inputs = [os.path.join(sfu.user_dir, sfile) for sfile in sfu.list_by_type(list_type)]
+    else:
+        inputs = [in_path]
+
+    with recording(out_name, options=kwargs.get('options')) as record:
+        record.measure_inputs(inputs)
+        record.started = time.time()
+        start = time.perf_counter()
+        try:
+            output = run_operation(func, in_path, out_path, out_name=out_name, list_type=list_type, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+
+    # Serial runs don't report their task time
+    record.elapsed = elapsed
+    record.task_seconds = record.task_seconds or record.stages.get('process', 0.0)
+    # A run that failed as a whole processed none of its inputs
+    if output is None:
+        reason = record.failures.pop(os.path.basename(in_path), None) or next(iter(record.failures.values()), 'error')
+        for path in inputs:
+            record.failures.setdefault(os.path.basename(path), reason)
+    record.measure_outputs(output)
+    record.ffmpeg = ffmpeg_version()
+
+    try:
+        save_run(record, history)
+    except (OSError, sqlite3.Error) as e:
+        print(f"NOTE: The run could not be saved to the history '{history}'. ({e})")
+    return output
+
+
+def split_options(options: Dict[str, Union[str, bool]], func: Callable,
+                  repeat_func: Union[Callable, bool] = False) -> Tuple[Dict, Dict]:
+    """Split command-line options between an operation function and its repeat function.
+
+    Parameters
+    ----------
+    options : Dict[str, Union[str, bool]]
+        The options returned by `helpers.parse_options()`.
+    func : Callable
+        The operation function.
+    repeat_func : Callable or bool, optional
+        The repeat function, or False if the operation is not repeated (default is False).
+
+    Returns
+    -------
+    Tuple[Dict, Dict]
+        The keyword arguments for `func` and the keyword arguments for `repeat_func`.
+        Numeric strings are converted to int for `repeat_func`.
+
+    Raises
+    ------
+    ValueError
+        If an option is accepted by neither function.
+    """
+    func_params = inspect.signature(func).parameters
+    repeat_params = inspect.signature(repeat_func).parameters if callable(repeat_func) else {}
+    reserved = ('in_dir', 'out_dir', 'list_type', 'func')  # Set by run_operation()
+
+    func_options, repeat_options = {}, {}
+    for key, value in options.items():
+        if key in func_params and func_params[key].kind == inspect.Parameter.KEYWORD_ONLY:
+            func_options[key] = value
+        elif key in repeat_params and key not in reserved:
+            repeat_options[key] = int(value) if isinstance(value, str) and value.isdigit() else value
+        else:
+            raise ValueError(f"Option '--{key}' is not supported")
+    return func_options, repeat_options
 
 
 if __name__ == "__main__":
+    # Needed by the native engine's process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     main()
 
 
 # FUTURE OPERATIONS:
-# QC video (Takes 1 mov and 1 audio file and combines them)
 # Convert to DX... / mp4.. (converts videos to ProTools/QC likeable formats)
-# Put files in .mov container as separate streams (digital team)
-# Remap (5.1) files (problem when time stretching 5.1 files - they get unmapped and need remapping)
\ No newline at end of file
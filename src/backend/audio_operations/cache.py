@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import uuid
+from helpers import file_fingerprint
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Environment variable that overrides the default cache folder
+CACHE_DIR_ENV = "AUDIO_OPERATIONS_CACHE"
+
+
+# Get the root folder of all caches
+def get_cache_dir() -> str:
+    """Get the root folder of the on-disk caches.
+
+    Returns
+    -------
+    str
+        The value of the `AUDIO_OPERATIONS_CACHE` environment variable if set,
+        otherwise '~/.audio_operations/cache'.
+    """
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".audio_operations", "cache")
+
+
+class FingerprintCache:
+    """An on-disk cache of JSON results, keyed by file fingerprint.
+
+    Each entry is stored as '<cache_dir>/<namespace>/<key[:2]>/<key>.json'. Keys are built from
+    `helpers.file_fingerprint()` (path, size and modification time), so an entry is automatically
+    ignored once the file changes. Entries are written atomically, so several processes can share
+    a cache folder.
+
+    Parameters
+    ----------
+    namespace : str
+        The name of the cache (e.g. 'qc').
+    cache_dir : Path, optional
+        The root folder of the caches (default is None, which uses `get_cache_dir()`).
+
+    Examples
+    --------
+    >>> cache = FingerprintCache('qc')
+    >>> result = cache.get("path/to/file.wav")
+    >>> if result is None:
+    ...     result = cache.set("path/to/file.wav", analyze(...))
+    """
+
+    def __init__(self, namespace: str, cache_dir: Optional[Path] = None) -> None:
+        self.namespace = namespace
+        self.cache_dir = os.path.join(cache_dir or get_cache_dir(), namespace)
+
+    def key(self, file_path: Path, params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Get the cache key of a file (and of the parameters its result depends on).
+
+        Parameters
+        ----------
+        file_path : Path
+            The path to the file.
+        params : Dict[str, Any], optional
+            Parameters that change the result (default is None).
+
+        Returns
+        -------
+        str or None
+            The key, or None if the file can't be accessed.
+        """
+        fingerprint = file_fingerprint(file_path)
+        if fingerprint is None:
+            return None
+        if params:
+            fingerprint += json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+    def path(self, key: str, suffix: str = ".json") -> str:
+        """Get the path of an entry (or of a companion file with another suffix)."""
+        return os.path.join(self.cache_dir, key[:2], f"{key}{suffix}")
+
+    def get(self, file_path: Path, params: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """Get the cached result of a file, or None if there is none for its current version."""
+        key = self.key(file_path, params)
+        return None if key is None else self.load(key)
+
+    def set(self, file_path: Path, value: Any, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Store the result of a file and return it.
+
+        Errors while writing are ignored (the cache is an optimisation only).
+        """
+        key = self.key(file_path, params)
+        return value if key is None else self.store(key, value)
+
+    def load(self, key: str) -> Optional[Any]:
+        """Get the entry stored under a key (e.g. one built from a content hash instead of `key()`), or None."""
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key: str, value: Any) -> Any:
+        """Store an entry under a key and return it (errors while writing are ignored)."""
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"NOTE: Could not write to cache '{self.namespace}'. ({e})")
+        return value
+
+    def get_or_compute(self, file_path: Path, compute: Callable[[], Any],
+                       params: Optional[Dict[str, Any]] = None) -> Any:
+        """Get the cached result of a file, computing and storing it if needed.
+
+        Parameters
+        ----------
+        file_path : Path
+            The path to the file.
+        compute : Callable[[], Any]
+            Computes the result (must be JSON-serializable).
+        params : Dict[str, Any], optional
+            Parameters that change the result (default is None).
+
+        Returns
+        -------
+        Any
+            The result.
+        """
+        value = self.get(file_path, params)
+        if value is None:
+            value = self.set(file_path, compute(), params)
+        return value
@@ -0,0 +1,177 @@
+import signal
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional, List, Dict, Tuple, Union
+
+
+# The stdin line that cancels the run (see `watch_stdin()`)
+CANCEL_COMMAND = "cancel"
+
+# The token of the run in the current context (set by `cancellable()` and by `scheduler.Scheduler` in its threads)
+CANCEL_TOKEN: ContextVar[Optional['CancelToken']] = ContextVar('CANCEL_TOKEN', default=None)
+
+
+class CancelledError(RuntimeError):
+    """The run was cancelled before the work was done.
+
+    Attributes
+    ----------
+    reason : str
+        Always 'cancelled' (the failure reason used in reports, see `supervisor.SupervisorError`).
+    """
+
+    reason = 'cancelled'
+
+
+class CancelToken:
+    """A flag that cancels a run, shared by everything the run started.
+
+    Calling `cancel()` from any thread (a signal handler, the stdin watcher, an API call):
+    - stops `scheduler.Scheduler` from starting new jobs,
+    - makes `supervisor.run_supervised()` kill the ffmpeg process groups that are running,
+    - makes `pcm_engine.transcode()` stop at its next block,
+    and every interrupted task deletes its partial outputs.
+
+    Examples
+    --------
+    >>> token = CancelToken()
+    >>> threading.Timer(5, token.cancel).start()
+    >>> run_operation(split_multi_sf, in_path, out_path, cancel=token)
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.source = None
+
+    @property
+    def cancelled(self) -> bool:
+        """bool: True once `cancel()` has been called."""
+        return self._event.is_set()
+
+    def __call__(self) -> bool:
+        """Return `cancelled`, so that the token can be passed as a `cancel` check (see `supervisor.run_supervised()`)."""
+        return self._event.is_set()
+
+    def cancel(self, source: str = 'api') -> None:
+        """Cancel the run (only the first call has an effect).
+
+        Parameters
+        ----------
+        source : str, optional
+            What cancelled the run, e.g. 'signal', 'stdin' or 'api' (default is 'api').
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.source = source
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error while cancelling: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Call `callback` when the run is cancelled (at once if it already is).
+
+        Returns
+        -------
+        Callable[[], None]
+            A function that removes the callback.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Sleep until the run is cancelled or `timeout` seconds have passed. Returns `cancelled`."""
+        return self._event.wait(timeout)
+
+    def check(self) -> None:
+        """Raise `CancelledError` if the run was cancelled."""
+        if self._event.is_set():
+            raise CancelledError(f"Cancelled ({self.source}).")
+
+    def __repr__(self) -> str:
+        return f"CancelToken({'cancelled by ' + self.source if self.cancelled else 'active'})"
+
+
+def current_token() -> Optional[CancelToken]:
+    """Get the token of the run in the current context, or None."""
+    return CANCEL_TOKEN.get()
+
+
+def is_cancelled() -> bool:
+    """Check whether the run in the current context was cancelled."""
+    token = CANCEL_TOKEN.get()
+    return token is not None and token.cancelled
+
+
+@contextmanager
+def cancellable(token: Optional[CancelToken] = None) -> Iterator[CancelToken]:
+    """Make `token` (or a new token) the current token while the block runs."""
+    token = token or CancelToken()
+    reset = CANCEL_TOKEN.set(token)
+    try:
+        yield token
+    finally:
+        CANCEL_TOKEN.reset(reset)
+
+
+# TRIGGERS
+
+def install_signal_handlers(token: CancelToken) -> None:
+    """Cancel the run on SIGINT/SIGTERM (and SIGBREAK on Windows).
+
+    The first signal cancels the run cleanly. The handlers are then reset, so a second signal
+    stops the process at once. Must be called from the main thread.
+    """
+    signals = [getattr(signal, name) for name in ('SIGINT', 'SIGTERM', 'SIGBREAK') if hasattr(signal, name)]
+
+    def handler(signum, frame):
+        for sig in signals:
+            signal.signal(sig, signal.SIG_DFL)
+        print(f"\nCANCELLING ({signal.Signals(signum).name})...")
+        token.cancel('signal')
+
+    for sig in signals:
+        signal.signal(sig, handler)
+
+
+def watch_stdin(token: CancelToken, *, command: str = CANCEL_COMMAND) -> threading.Thread:
+    """Cancel the run when `command` (e.g. 'cancel') is written as a line on stdin.
+
+    This lets a parent process (e.g. Electron's child_process) cancel without signals, which
+    Windows doesn't deliver to child processes. The watcher is a daemon thread and stops at EOF.
+
+    Returns
+    -------
+    threading.Thread
+        The watcher thread (already started).
+    """
+    def watch():
+        try:
+            for line in sys.stdin:
+                if line.strip().lower() == command:
+                    print("\nCANCELLING (stdin)...")
+                    token.cancel('stdin')
+                    return
+        except (OSError, ValueError):
+            pass
+
+    thread = threading.Thread(target=watch, name='stdin-cancel', daemon=True)
+    thread.start()
+    return thread
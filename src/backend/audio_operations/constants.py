@@ -24,7 +24,9 @@ CH_LAYOUT = [
     'WR',
     'SDL',
     'SDR',
-    'LFE2'
+    'LFE2',
+    'TSL',
+    'TSR'
 ]
 
 # Channel Layout that corresponds to multi-mono track extension names
@@ -53,7 +55,9 @@ CH_SMPTE = [
     'WR',
     'SDL',
     'SDR',
-    'LFE2'
+    'LFE2',
+    'Ltm',
+    'Rtm'
 ]
 
 
@@ -109,10 +113,10 @@ CH_LAYOUT_COMP = {
     '4.0': get_layout(CH_LAYOUT, 0, 1, 2, 8),
     'quad': get_layout(CH_LAYOUT, 0, 1, 4, 5),
     'quad(side)': get_layout(CH_LAYOUT, 0, 1, 9, 10),
-    '3.1': get_layout(CH_LAYOUT, 0, 1, 2, 3, 8),
+    '3.1': get_layout(CH_LAYOUT, 0, 1, 2, 3),
     '5.0': get_layout(CH_LAYOUT, 0, 1, 2, 4, 5),
     '5.0(side)': get_layout(CH_LAYOUT, 0, 1, 2, 9, 10),
-    '4.1': get_layout(CH_LAYOUT, 0, 1, 2, 3, 8, 5),
+    '4.1': get_layout(CH_LAYOUT, 0, 1, 2, 3, 8),
     '5.1': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5),
     '5.1(side)': get_layout(CH_LAYOUT, 0, 1, 2, 3, 9, 10),
     '6.0': get_layout(CH_LAYOUT, 0, 1, 2, 8, 9, 10),
@@ -126,7 +130,15 @@ CH_LAYOUT_COMP = {
     '7.1(wide)': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 6, 7),
     '7.1(wide-side)': get_layout(CH_LAYOUT, 0, 1, 2, 3, 6, 7, 9, 10),
     'octagonal': get_layout(CH_LAYOUT, 0, 1, 2, 4, 5, 8, 9, 10),
-    'downmix': get_layout(CH_LAYOUT, 18, 19)
+    'downmix': get_layout(CH_LAYOUT, 18, 19),
+    # Immersive (Dolby Atmos bed) layouts
+    '3.1.2': get_layout(CH_LAYOUT, 0, 1, 2, 3, 12, 14),
+    '5.1.2': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 12, 14),
+    '5.1.4': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 12, 14, 15, 17),
+    '7.1.2': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 9, 10, 12, 14),
+    '7.1.4': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 9, 10, 12, 14, 15, 17),
+    '9.1.4': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 12, 14, 15, 17),
+    '9.1.6': get_layout(CH_LAYOUT, 0, 1, 2, 3, 4, 5, 9, 10, 12, 14, 15, 17, 20, 21, 25, 26)
 }
 
 CH_SMPTE_COMP = {
@@ -139,10 +151,10 @@ CH_SMPTE_COMP = {
     '4.0': get_layout(CH_SMPTE, 0, 1, 2, 8),
     'quad': get_layout(CH_SMPTE, 0, 1, 4, 5),
     'quad(side)': get_layout(CH_SMPTE, 0, 1, 9, 10),
-    '3.1': get_layout(CH_SMPTE, 0, 1, 2, 3, 8),
+    '3.1': get_layout(CH_SMPTE, 0, 1, 2, 3),
     '5.0': get_layout(CH_SMPTE, 0, 1, 2, 4, 5),
     '5.0(side)': get_layout(CH_SMPTE, 0, 1, 2, 9, 10),
-    '4.1': get_layout(CH_SMPTE, 0, 1, 2, 3, 8, 5),
+    '4.1': get_layout(CH_SMPTE, 0, 1, 2, 3, 8),
     '5.1': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5),
     '5.1(side)': get_layout(CH_SMPTE, 0, 1, 2, 3, 9, 10),
     '6.0': get_layout(CH_SMPTE, 0, 1, 2, 8, 9, 10),
@@ -156,7 +168,55 @@ CH_SMPTE_COMP = {
     '7.1(wide)': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 6, 7),
     '7.1(wide-side)': get_layout(CH_SMPTE, 0, 1, 2, 3, 6, 7, 9, 10),
     'octagonal': get_layout(CH_SMPTE, 0, 1, 2, 4, 5, 8, 9, 10),
-    'downmix': get_layout(CH_SMPTE, 18, 19)
+    'downmix': get_layout(CH_SMPTE, 18, 19),
+    # Immersive (Dolby Atmos bed) layouts
+    '3.1.2': get_layout(CH_SMPTE, 0, 1, 2, 3, 12, 14),
+    '5.1.2': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 12, 14),
+    '5.1.4': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 12, 14, 15, 17),
+    '7.1.2': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 9, 10, 12, 14),
+    '7.1.4': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 9, 10, 12, 14, 15, 17),
+    '9.1.4': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 12, 14, 15, 17),
+    '9.1.6': get_layout(CH_SMPTE, 0, 1, 2, 3, 4, 5, 9, 10, 12, 14, 15, 17, 20, 21, 25, 26)
+}
+
+
+
+# Layouts that ffmpeg doesn't know by name - commands use their channels instead (e.g. 'FL+FR+...')
+CUSTOM_LAYOUTS = ('9.1.6',)
+
+# Layout assumed when a file's layout can't be read, by number of channels
+DEFAULT_LAYOUTS = {
+    1: 'mono',
+    2: 'stereo',
+    6: '5.1',
+    7: '7.0',
+    8: '7.1',
+    10: '7.1.2',
+    12: '7.1.4',
+    14: '9.1.4',
+    16: '9.1.6',
+}
+
+# WAVE_FORMAT_EXTENSIBLE speaker position bits (dwChannelMask) of the ffmpeg channel names
+CH_MASK_BITS = {
+    'FL': 0x1,
+    'FR': 0x2,
+    'FC': 0x4,
+    'LFE': 0x8,
+    'BL': 0x10,
+    'BR': 0x20,
+    'FLC': 0x40,
+    'FRC': 0x80,
+    'BC': 0x100,
+    'SL': 0x200,
+    'SR': 0x400,
+    'TC': 0x800,
+    'TFL': 0x1000,
+    'TFC': 0x2000,
+    'TFR': 0x4000,
+    'TBL': 0x8000,
+    'TBC': 0x10000,
+    'TBR': 0x20000,
 }
 
 
@@ -167,6 +227,55 @@ CH_SMPTE_COMP = {
 # Accepted formats of files that can be analyzed by soundfile (and ffprobe)
 AUDIO_FORMATS = ['wav', 'flac', 'ogg', 'aiff', 'aifc', 'mp3', 'aac']
 
+# Accepted video formats (picture files of the 'qc_video' operation)
+VIDEO_FORMATS = ['mov', 'mp4', 'm4v', 'mxf', 'mkv']
+
+# Audio codec used by 'qc_video' for each video container (containers that can hold PCM get 24-bit PCM)
+VIDEO_AUDIO_CODECS = {
+    '.mov': 'pcm_s24le',
+    '.mxf': 'pcm_s24le',
+    '.mkv': 'pcm_s24le',
+    '.mp4': 'aac',
+    '.m4v': 'aac',
+}
+
+# ffmpeg encoder used by 'concat' to convert files to the format of the first file, for formats that aren't PCM or FLAC
+CONCAT_ENCODERS = {
+    '.mp3': 'libmp3lame',
+    '.ogg': 'libvorbis',
+    '.aac': 'aac',
+}
+
+# Coefficient matrices of 'downmix', by name and source layout: output channel -> {input channel: gain}
+# (channels are multi-mono extensions, see `CH_SMPTE_COMP`). The LFE is dropped, centre and surrounds are mixed at -3 dB.
+# 'ltrt' is a matrix-encoded (Dolby Surround compatible) downmix: surrounds are summed out of phase into Lt and in phase into Rt.
+# 7.1 side and rear surrounds are mixed as one surround pair, each at -3 dB.
+DOWNMIX_MATRICES = {
+    'loro': {
+        '5.1': {'DL': {'L': 1.0, 'C': 0.7071, 'Ls': 0.7071},
+                'DR': {'R': 1.0, 'C': 0.7071, 'Rs': 0.7071}},
+        '5.1(side)': {'DL': {'L': 1.0, 'C': 0.7071, 'Lsr': 0.7071},
+                      'DR': {'R': 1.0, 'C': 0.7071, 'Rsr': 0.7071}},
+        '7.1': {'DL': {'L': 1.0, 'C': 0.7071, 'Ls': 0.5, 'Lsr': 0.5},
+                'DR': {'R': 1.0, 'C': 0.7071, 'Rs': 0.5, 'Rsr': 0.5}},
+    },
+    'ltrt': {
+        '5.1': {'DL': {'L': 1.0, 'C': 0.7071, 'Ls': -0.5, 'Rs': -0.5},
+                'DR': {'R': 1.0, 'C': 0.7071, 'Ls': 0.5, 'Rs': 0.5}},
+        '5.1(side)': {'DL': {'L': 1.0, 'C': 0.7071, 'Lsr': -0.5, 'Rsr': -0.5},
+                      'DR': {'R': 1.0, 'C': 0.7071, 'Lsr': 0.5, 'Rsr': 0.5}},
+        '7.1': {'DL': {'L': 1.0, 'C': 0.7071, 'Ls': -0.3536, 'Rs': -0.3536, 'Lsr': -0.3536, 'Rsr': -0.3536},
+                'DR': {'R': 1.0, 'C': 0.7071, 'Ls': 0.3536, 'Rs': 0.3536, 'Lsr': 0.3536, 'Rsr': 0.3536}},
+    },
+}
+
+# Loudness targets of 'normalize': integrated loudness (LUFS/LKFS), maximum true peak (dBTP),
+# and the tolerance (LU) within which a file already meets the target and is copied as it is
+LOUDNESS_PRESETS = {
+    'ebu': {'integrated': -23.0, 'true_peak': -1.0, 'tolerance': 0.5},     # EBU R128
+    'atsc': {'integrated': -24.0, 'true_peak': -2.0, 'tolerance': 2.0},    # ATSC A/85
+}
+
 
 # All the possible channel extensions I could possibly think of - used when searching for multi-mono tracks
 CHANNEL_NAMES = (
@@ -222,6 +331,10 @@ CHANNEL_NAMES = (
     "RH.R",
     "Vhl",
     "Vhr",
+    "Ltb",
+    "Rtb",
+    "Ltm",
+    "Rtm",
     "1",
     "2",
     "3",
@@ -275,23 +388,16 @@ SMPTE_ORDER = {
 }
 
 
+# Maps soundfile subtypes (as reported by sf.info) to their ffmpeg codec names
+SF_SUBTYPE_CODECS = {
+    'PCM_U8': 'pcm_u8',
+    'PCM_16': 'pcm_s16le',
+    'PCM_24': 'pcm_s24le',
+    'PCM_32': 'pcm_s32le',
+    'FLOAT': 'pcm_f32le',
+    'DOUBLE': 'pcm_f64le',
+}
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Methods used by helpers.fast_copy() - files materialised by one of these skipped ffmpeg entirely
+# ('noop': the output would be the input itself, so nothing was written)
+PASSTHROUGH_METHODS = ('hardlink', 'reflink', 'copy_file_range', 'copy', 'noop')
@@ -1,18 +1,36 @@
+import json
 import os
 import shutil
 from plumbum import local   # needs pip install
-from constants import CH_LAYOUT_COMP, CH_SMPTE_COMP
-from helpers import get_bin_path, smpte_order_key, SoundFilesUtils, get_audio_info, validate_paths
+from constants import PASSTHROUGH_METHODS, AUDIO_FORMATS, VIDEO_AUDIO_CODECS, SF_SUBTYPE_CODECS, CONCAT_ENCODERS, LOUDNESS_PRESETS
+from helpers import get_ffmpeg, smpte_order_key, SoundFilesUtils, get_audio_info, get_header_info, validate_paths, is_passthrough, fast_copy
+from helpers import read_wav_channel_mask, write_wav_channel_mask, concat_wav, natural_key
+from scheduler import Job, Scheduler
+from supervisor import pop_failures
+from history import stage, current_record
+from cancellation import CancelledError, current_token
+from layouts import LAYOUTS
+from tasks import Task, run_tasks
+from analysis import get_qc_report, find_silent_channels, group_duplicates, get_loudness
+from planner import estimate_output_bytes
+from pcm_engine import native_reason, ffmpeg_writes, transcode_in_pool, CODEC_SUBTYPES, NATIVE_CONTAINERS, NATIVE_INPUTS
+from pcm_engine import downmix, downmix_matrix, load_downmix_matrices, run_in_pool
+from segments import resolve_segments, segment_ranges, segments_dir, seek_frame, run_segment_tasks, join_segments
 from pathlib import Path
-from typing import Callable, Optional, List, Dict, Tuple, Union
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
 
 # REPEAT OPERATION FUNCTION
 def repeat_operation(in_dir: Path, 
                      out_dir: Optional[Path] = None, 
                      *, 
                      list_type: str = 'all', 
-                     func: Callable[[Path, Path], None]
-                     ):
+                     func: Callable[[Path, Path], None],
+                     jobs: Optional[int] = None,
+                     cores: Optional[int] = None,
+                     io_jobs: int = 2,
+                     job_kind: str = 'cpu',
+                     dedupe: bool = False
+                     ) -> Dict[str, Any]:
     """Repeat an operation for each sound file in the input directory.
 
     This function performs a specified operation for each sound file in the provided input directory.
@@ -20,6 +38,9 @@ def repeat_operation(in_dir: Path,
     in the specified output directory. By default, the operation is applied to all sound files,
     but you can specify whether to operate on multi-channel ('multi') or mono-channel ('mono') files.
 
+    Files are processed concurrently by a `scheduler.Scheduler`: longest files (duration x channels)
+    start first, and the core budget is split between running ffmpeg processes.
+
     Parameters
     ----------
     in_dir : Path
@@ -30,44 +51,170 @@ def repeat_operation(in_dir: Path,
         The type of sound files to operate on ('all', 'multi', or 'mono') (default is 'all').
     func : Callable(inPath, outPath)
         The operation function to be applied to each sound file. It takes an input file path and an output directory path.
+    jobs : int, optional
+        The maximum number of files processed concurrently (default is None, which uses half of `cores`).
+    cores : int, optional
+        The core budget shared by all running jobs (default is None, which uses all cores).
+    io_jobs : int, optional
+        The maximum number of concurrent jobs if the operation is I/O-heavy (default is 2).
+    job_kind : str, optional
+        'cpu' if the operation is bound by encoding/filtering, 'io' if it is bound by disk throughput (default is 'cpu').
+    dedupe : bool, optional
+        If True, files with the same audio content are only processed once (default is False).
+        The content is hashed from the decoded samples (see `analysis.get_content_hash()`, cached per
+        file version), and the outputs of duplicates are copies of the first file's outputs, renamed.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Maps each processed file name to the value returned by `func` (None if it failed).
+        With `dedupe`, duplicates map to {'outputs', 'method': 'duplicate', 'duplicate_of'}.
 
     Raises
     ------
     FileNotFoundError
         If no appropriate sound files are found in the input directory.
+    cancellation.CancelledError
+        If the batch was cancelled (see `cancellation.CancelToken`). Files that were done keep their
+        outputs, the partial outputs of interrupted files are deleted, and the other files are not started.
     """
     # Set out_dir to in_dir if not specified by the user
     if out_dir is None:
         out_dir = in_dir
 
     # Create SFU object to get in_dir's list of multitracks
-    sfu = SoundFilesUtils(user_path=in_dir)
+    with stage('list'):
+        sfu = SoundFilesUtils(user_path=in_dir)
 
-    # Choose appropriate file type based on list_type
-    if list_type == 'multi':
-        sfiles = sfu.list_multisf
-    elif list_type == 'mono':
-        sfiles = sfu.list_monosf
-    else:
-        sfiles = sfu.sfile_list
+        # Choose appropriate file type based on list_type
+        sfiles = sfu.list_by_type(list_type)
 
     # If no sfiles found, raise Error
     if len(sfiles) == 0:
         raise FileNotFoundError("No appropriate sound files found in dir.")
 
-    # For each list element, try to split
-    for input_file in sfiles:
-        try:
-            sf_path = os.path.join(sfu.user_dir, input_file) 
-            func(sf_path, out_dir)
-        except Exception as e:
-            print(f"Error processing file '{input_file}': Corrupted file or extention not supported.")
-            continue
+    # Only process the first file of each group of identical audio
+    paths = [os.path.join(sfu.user_dir, input_file) for input_file in sfiles]
+    if dedupe:
+        with stage('dedupe'):
+            groups = group_duplicates(paths, workers=io_jobs)
+    else:
+        groups = {path: [] for path in paths}
+
+    # Create a job for each list element and run them, longest first
+    batch = [Job(path, kind=job_kind) for path in groups]
+    scheduler = Scheduler(cores=cores, max_jobs=jobs, io_jobs=io_jobs)
+    with stage('process'):
+        scheduler.run(batch, lambda sf_path: func(sf_path, out_dir))
+
+    # Collect results, and copy the outputs of duplicates
+    collected = {}
+    cancel = current_token()
+    with stage('collect'):
+        for job in batch:
+            input_file = os.path.basename(job.path)
+            collected[input_file] = job.result
+            if isinstance(job.error, CancelledError) or (job.result is None and cancel is not None and cancel.cancelled):
+                collected.update((os.path.basename(duplicate), None) for duplicate in groups[job.path])
+                continue
+            if job.error is not None:
+                print(f"Error processing file '{input_file}': Corrupted file or extention not supported.")
+            for duplicate in groups[job.path]:
+                collected[os.path.basename(duplicate)] = _copy_duplicate(job.path, duplicate, job.result, out_dir)
+
+    # Sort results in listing order
+    results = {input_file: collected[input_file] for input_file in sfiles}
+
+    # Report how many files skipped ffmpeg entirely
+    fast = [res for res in results.values() if isinstance(res, dict) and res.get('method') in PASSTHROUGH_METHODS]
+    if fast:
+        print(f"\nFAST PATH: {len(fast)} of {len(sfiles)} file(s) already matched the target format and were not re-encoded.")
+
+    # Report how many files had nothing to do (e.g. stereo stems given to 'downmix')
+    skipped = [res for res in results.values() if isinstance(res, dict) and res.get('method') == 'skipped']
+    if skipped:
+        print(f"\nSKIPPED: {len(skipped)} of {len(sfiles)} file(s) didn't apply to the operation and were not processed.")
+
+    # Report how many files were duplicates
+    duplicates = [res for res in results.values() if isinstance(res, dict) and res.get('method') == 'duplicate']
+    if dedupe:
+        print(f"\nDEDUPE: {len(duplicates)} of {len(sfiles)} file(s) had the same audio as another file and were copied.")
+
+    # Report cancelled files: not started, or interrupted (their partial outputs are deleted)
+    failures = {os.path.basename(path): failure for path, failure in pop_failures(paths).items()}
+    cancelled = []
+    if cancel is not None and cancel.cancelled:
+        cancelled = [input_file for input_file, res in results.items()
+                     if res is None or failures.get(input_file, {}).get('reason') == 'cancelled']
+        print(f"\nCANCELLED: {len(cancelled)} of {len(sfiles)} file(s) were not finished. "
+              f"The outputs of the {len(sfiles) - len(cancelled)} finished file(s) were kept.")
+
+    # Report failed files, with the reason each one failed (see `supervisor.SupervisorError`)
+    failed = [input_file for input_file, res in results.items()
+              if (res is None or input_file in failures) and input_file not in cancelled]
+    if failed:
+        reasons = [failures.get(input_file, {}).get('reason', 'error') for input_file in failed]
+        counts = ', '.join(f"{reason}: {reasons.count(reason)}" for reason in sorted(set(reasons)))
+        print(f"\nFAILURES: {len(failed)} of {len(sfiles)} file(s) failed ({counts}):")
+        for input_file, reason in zip(failed, reasons):
+            attempts = failures.get(input_file, {}).get('attempts', 1)
+            print(f" - '{input_file}': {reason}{f' after {attempts} attempts' if attempts > 1 else ''}")
+
+    # Add the batch to the run being recorded, if any (see `history.py`)
+    record = current_record()
+    if record is not None:
+        record.task_seconds += sum(job.elapsed for job in batch)
+        if failed:
+            record.failures.update(zip(failed, reasons))
+        record.failures.update((input_file, 'cancelled') for input_file in cancelled)
+
+    if cancelled:
+        raise CancelledError(f"Cancelled ({cancel.source}).")
+    return results
+
+
+def _copy_duplicate(original: str, duplicate: str, result: Any, out_dir: Path) -> Optional[Dict[str, Any]]:
+    """Copy the outputs of `original` for `duplicate`, renaming its base name in the paths.
+
+    Returns
+    -------
+    Dict[str, Any] or None
+        {'outputs', 'method': 'duplicate', 'duplicate_of'}, or None if the original failed.
+    """
+    original_name = os.path.basename(original)
+    if not isinstance(result, dict) or not result.get('outputs'):
+        print(f"'{os.path.basename(duplicate)}' was skipped: it is a duplicate of '{original_name}', which failed.")
+        return None
+
+    old_base = os.path.splitext(original_name)[0]
+    new_base = os.path.splitext(os.path.basename(duplicate))[0]
+    out_root = os.path.abspath(out_dir)
+
+    def rename(part):
+        # Rename 'base' and 'base.*' (e.g. 'base.L.wav', 'base.qc.json'), leave other parts alone
+        if part == old_base or part.startswith(old_base + '.'):
+            return new_base + part[len(old_base):]
+        return part
+
+    outputs = []
+    try:
+        for output in result['outputs']:
+            rel_path = os.path.relpath(output, out_root)
+            target = os.path.join(out_root, *[rename(part) for part in rel_path.split(os.sep)])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fast_copy(output, target)
+            outputs.append(target)
+    except OSError as e:
+        print(f"Error copying the outputs of '{original_name}' for '{os.path.basename(duplicate)}': {e}")
+        return None
+
+    print(f"'{os.path.basename(duplicate)}' has the same audio as '{original_name}'. Outputs copied.")
+    return {'outputs': outputs, 'method': 'duplicate', 'duplicate_of': original_name}
 
 
 
 # MONO TO MULTI FUNCTION
-def mono_to_multi(inpt: Path, outpt: Optional[Path] = None):
+def mono_to_multi(inpt: Path, outpt: Optional[Path] = None, *, strict: bool = True) -> Dict[str, Any]:
     """Convert mono audio files (of the same name and different channel extensions) to multi-channel format.
 
     This function takes a directory containing mono audio files that are part of a multi-mono track 
@@ -83,6 +230,9 @@ def mono_to_multi(inpt: Path, outpt: Optional[Path] = None):
         The path to the input directory containing mono audio files.
     outpt : Path, optional
         The path to the output directory where the converted files will be saved (default is None, which uses inpt).
+    strict : bool, optional
+        If True, tracks whose files differ in length are not merged (default is True).
+        If False, they are merged with a warning (ffmpeg cuts the track to its shortest file).
 
     Raises
     ------
@@ -90,7 +240,18 @@ def mono_to_multi(inpt: Path, outpt: Optional[Path] = None):
         If the channel layout of the mono audio file is not recognized or supported.
     FileNotFoundError
         If no multi-mono tracks are found in the input directory
-        or if number of multi-mono tracks cannot lead to a supported mutlitrack format (stereo, 5.1, 7.0, 7.1).
+        or if number of multi-mono tracks cannot lead to a supported mutlitrack format (see `layouts.LAYOUTS`).
+
+    Returns
+    -------
+    Dict[str, Any]
+        The result of `run_tasks()` ('outputs', 'method' and, if a track failed, 'errors').
+        'warnings' lists the problems of tracks that were merged anyway.
+
+    Notes
+    -----
+    Every track is checked before any ffmpeg process starts (see `preflight_mono_group()`),
+    and all the tracks that can't be merged are reported together.
     
     Example
     -------
@@ -104,11 +265,122 @@ def mono_to_multi(inpt: Path, outpt: Optional[Path] = None):
     - "mono_track.wav"
     """
 
+    return run_tasks(plan_mono_to_multi(inpt, outpt, strict=strict))
+
+
+def preflight_mono_group(in_dir: str, base_name: str, ext: str, group: List[str], *,
+                         strict: bool = True) -> Dict[str, Any]:
+    """Check that the files of a multi-mono track can be merged, from their headers only.
+
+    Parameters
+    ----------
+    in_dir : str
+        The directory of the files.
+    base_name : str
+        The name of the track, without channel extension (e.g. 'track' for 'track.L.wav').
+    ext : str
+        The file extension of the track (e.g. 'wav').
+    group : List[str]
+        The file names of the track.
+    strict : bool, optional
+        If True, a length mismatch is an error, otherwise a warning (default is True).
+
+    Returns
+    -------
+    Dict[str, Any]
+        A dictionary with:
+        - 'layout': The `layouts.Layout` of the track (None if it can't be determined).
+        - 'files': The file names, in layout order.
+        - 'errors': Problems that prevent the merge (List[str]).
+        - 'warnings': Problems that don't (List[str]).
+
+    Notes
+    -----
+    The checks are: every file is a readable mono file; the channel extensions form a known
+    layout (or the number of files has a default layout); sample rates and lengths match.
+    Different bit depths are only a warning, as ffmpeg converts them to a single format.
+    Headers are read with `helpers.get_header_info()`, which caches them.
+    """
+    errors, warnings = [], []
+
+    # Find the layout from the channel extensions (e.g. 'L', 'R', 'Ltf'...) and order the files by it
+    suffixes = {infile[len(base_name) + 1:-(len(ext) + 1)]: infile for infile in group}
+    by_suffix = {suffix.lower(): infile for suffix, infile in suffixes.items()}
+    layout = LAYOUTS.from_suffixes(suffixes) if len(group) > 1 else None
+    closest = LAYOUTS.closest(suffixes) if layout is None else None
+    if layout is not None:
+        input_files = [by_suffix[suffix.lower()] for suffix in layout.suffixes]
+
+    # Otherwise, extensions of a known layout with some channels missing
+    elif closest is not None:
+        missing = [suffix for suffix in closest.suffixes if suffix.lower() not in by_suffix]
+        errors.append(f"missing channel(s) {', '.join(missing)} for {closest.name}")
+        input_files = sorted(group, key=smpte_order_key)
+
+    # Otherwise, use the default layout for the number of files, sorted as per SMPTE Order
+    else:
+        layout = LAYOUTS.default(len(group)) if len(group) > 1 else None
+        if layout is None:
+            errors.append(f"incorrect number of channels ({len(group)})")
+        input_files = sorted(group, key=smpte_order_key)
+
+    # Read headers
+    headers = {}
+    for infile in input_files:
+        try:
+            headers[infile] = get_header_info(os.path.join(in_dir, infile))
+        except ValueError:
+            errors.append(f"'{infile}' could not be read")
+    for infile, header in headers.items():
+        if header['channels'] != 1:
+            errors.append(f"'{infile}' has {header['channels']} channels")
+
+    def describe(key):
+        return ', '.join(f"{infile}: {header[key]}" for infile, header in headers.items())
+
+    # Compare formats
+    if len({header['sample_rate'] for header in headers.values()}) > 1:
+        errors.append(f"sample rates differ ({describe('sample_rate')})")
+    elif len({header['frames'] for header in headers.values()}) > 1:
+        problem = f"lengths differ in frames ({describe('frames')})"
+        (errors if strict else warnings).append(problem)
+    if len({header['subtype'] for header in headers.values()}) > 1:
+        warnings.append(f"bit depths differ ({describe('subtype')})")
+
+    return {'layout': layout, 'files': input_files, 'errors': errors, 'warnings': warnings}
+
+
+def plan_mono_to_multi(inpt: Path, outpt: Optional[Path] = None, *, strict: bool = True) -> List[Task]:
+    """Plan `mono_to_multi()`: one ffmpeg 'join' task per multi-mono track.
+
+    Every track is checked with `preflight_mono_group()` first. Tracks that can't be merged
+    are skipped, and reported together before any task runs.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the input directory containing mono audio files.
+    outpt : Path, optional
+        The path to the output directory (default is None, which uses inpt).
+    strict : bool, optional
+        See `mono_to_multi()`.
+
+    Returns
+    -------
+    List[Task]
+        The tasks to run.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no multi-mono tracks are found in the input directory.
+    """
     # Validate paths
     try:
         input_file, in_dir, out_dir = validate_paths(inpt, outpt, isdir=True)
     except OSError as e:
         print("Error:", e)
+        raise
 
     # Create SFU object
     sfu = SoundFilesUtils(user_path=in_dir)
@@ -116,85 +388,79 @@ def mono_to_multi(inpt: Path, outpt: Optional[Path] = None):
     if len(sfu.list_monosf) == 0:
         raise FileNotFoundError("No multi-mono tracks found")
 
+    tasks = []
+    rejected = {}
     for ext in sfu.monodict:
-        num_channels = 0
         for sfilename in sfu.monodict[ext]:
-            try:
-                # Sort input files as per SMPTE Order
-                input_files = sorted(sfu.monodict[ext][sfilename], key=smpte_order_key)
-
-                # Check channel length
-                num_channels = len(input_files)
-
-                # Initialize channel_layout based on number of files in 'input_files' list
-                if num_channels == 2:
-                    channel_layout = 'stereo'
-                elif num_channels == 6:
-                    channel_layout = '5.1'
-                elif num_channels == 7:
-                    channel_layout = '7.0'
-                elif num_channels == 8:
-                    channel_layout = '7.1'
-                else:
-                    raise ValueError("Invalid channel_layout")
-
-                # Create command-line argument strings for command
-                ch_list1 = [f"[{i}:a]" for i in range(num_channels)]
-                ch_list2 = [f"{i}.0" for i in range(num_channels)]
-
-                # Create string from ch_list1
-                inp_str = ''.join(ch_list1)
-
-                # Create string from ch_list2
-                map_list = []
-                incr = 0
-                for ch in CH_LAYOUT_COMP[channel_layout]:
-                    map_list.append(f"{ch_list2[incr]}-{ch}")
-                    incr += 1
-                map_str = '|'.join(map_list)
-
-
-                # Create output_path
-                output_filename = f'{sfilename}.{ext}'
-                output_path = os.path.join(out_dir, output_filename)
-
-
-                # PLUMBUM COMMAND
-                try:
-                    ffmpeg_path = get_bin_path()
-                    ffmpeg = local[ffmpeg_path]
-                except Exception:
-                    ffmpeg = local['ffmpeg']
-
-                # Construct the command using plumbum syntax & list comprehension
-                cmd = ffmpeg[sum([['-i', os.path.join(in_dir, infile)] for infile in input_files], [])]
-
-                # Overwrite if file is present
-                cmd = cmd['-y']
-
-                # Filter complex
-                cmd = cmd['-filter_complex',
-                    f'{inp_str}\
-                    join=inputs={num_channels}:\
-                    channel_layout={channel_layout}:\
-                    map={map_str}[a]']
-
-                # Map [a] to output
-                cmd = cmd['-map', '[a]']
-                cmd = cmd[output_path]
-
-                # Run the command
-                cmd()
-
-                # PRINT SUCCESS MESSAGE
-                print(f"'{sfilename}' files were successfully merged.")
-
-            except ValueError:
-                print(f"NOTE: '{sfilename}' multi-mono track not processed. Incorrect number of channels ({num_channels}).")
-                pass
+            # Pre-flight checks (headers only)
+            check = preflight_mono_group(in_dir, sfilename, ext, sfu.monodict[ext][sfilename], strict=strict)
+            if check['errors']:
+                rejected[f'{sfilename}.{ext}'] = check['errors']
+                continue
+            for warning in check['warnings']:
+                print(f"NOTE: '{sfilename}': {warning}. Merging anyway.")
+            layout, input_files = check['layout'], check['files']
+            num_channels = len(input_files)
+
+            # Create command-line argument strings for command
+            ch_list1 = [f"[{i}:a]" for i in range(num_channels)]
+            ch_list2 = [f"{i}.0" for i in range(num_channels)]
+
+            # Create string from ch_list1
+            inp_str = ''.join(ch_list1)
+
+            # Create string from ch_list2
+            map_list = []
+            incr = 0
+            for ch in layout.channels:
+                map_list.append(f"{ch_list2[incr]}-{ch}")
+                incr += 1
+            map_str = '|'.join(map_list)
+
+
+            # Create output_path
+            output_filename = f'{sfilename}.{ext}'
+            output_path = os.path.join(out_dir, output_filename)
+
+
+            # PLUMBUM COMMAND
+            ffmpeg = get_ffmpeg()
+
+            # Construct the command using plumbum syntax & list comprehension
+            input_paths = [os.path.join(in_dir, infile) for infile in input_files]
+            cmd = ffmpeg[sum([['-i', path] for path in input_paths], [])]
+
+            # Overwrite if file is present
+            cmd = cmd['-y']
+
+            # Filter complex
+            cmd = cmd['-filter_complex',
+                f'{inp_str}\
+                join=inputs={num_channels}:\
+                channel_layout={layout.ffmpeg}:\
+                map={map_str}[a]']
+
+            # Map [a] to output
+            cmd = cmd['-map', '[a]']
+            cmd = cmd[output_path]
+
+            tasks.append(Task(input_paths, [output_path], cmd=cmd,
+                              message=f"'{sfilename}' files were successfully merged.",
+                              info={'warnings': [f"'{sfilename}': {warning}" for warning in check['warnings']]}))
+
+    # Report every rejected track at once, before anything runs
+    if rejected:
+        print(f"\nPRE-FLIGHT: {len(rejected)} multi-mono track(s) will not be merged:")
+        for track, errors in rejected.items():
+            print(f" - '{track}': {'; '.join(errors)}.")
+        print()
+
+    return tasks
 
 # MULTI TO MULTI-MONO FUNCTION
-def split_multi_sf(inpt: Path, outpt: Optional[Path] = None):
+def split_multi_sf(inpt: Path, outpt: Optional[Path] = None, *, channels: Optional[str] = None,
+                   skip_silent: bool = False, silence_threshold: Optional[Union[str, float]] = None,
+                   preallocate: bool = False, segments: Optional[Union[str, int]] = None) -> Optional[Dict[str, Any]]:
     """Split a multi-channel audio file into separate mono files.
 
     This function takes a multi-channel audio file and splits it into separate mono files,
@@ -202,7 +468,7 @@ def split_multi_sf(inpt: Path, outpt: Optional[Path] = None):
     will be saved in the specified or default output directory inside a folder named as
     the input_file's base name.
 
-    .. note:: This function currently works correctly with stereo, 5.1, 7.0, 7.1 files.
+    .. note:: This function works with every layout of `layouts.LAYOUTS`, including 7.1.4 and 9.1.6 beds.
     .. note:: Accepted audio files: 'wav', 'flac', 'ogg', 'aiff', 'aifc', 'mp3', 'aac'.
 
     Parameters
@@ -212,17 +478,37 @@ def split_multi_sf(inpt: Path, outpt: Optional[Path] = None):
     outpt : Path, optional
         The directory path where the output files will be saved. If not specified,
         the output files will be saved in the same directory as the input file.
+    channels : str, optional
+        Only extract these channels: channel extensions or 1-based channel numbers, separated by commas
+        (e.g. 'C' for the dialogue channel, or 'L,R') (default is None, which extracts every channel).
+        Only the selected channels are split out by the filter graph and written.
+    skip_silent : bool, optional
+        If True, channels that are silent for the whole file are not written (default is False).
+    silence_threshold : str or float, optional
+        With `skip_silent`, channels whose peak never exceeds this level (dBFS) count as silent
+        (default is None, which only skips digital silence - all-zero channels).
+    preallocate : bool, optional
+        If True, the outputs are written under hidden temporary names with their final size
+        reserved on disk, and renamed when the split succeeds (default is False).
+        See `preallocate_outputs()`.
+    segments : str or int, optional
+        Split a long WAV file in this many time segments at once, then join the segments of each
+        channel (default is None, which splits it in one piece). 'auto' uses one segment per core,
+        each at least `segments.MIN_SEGMENT_SECONDS` long. The samples are the same as a split in one piece.
 
     Raises
     ------
     OSError
         If input_file or outpt is not a valid path.
     ValueError
-        If input_file is not a valid file or is a mono track.
+        If input_file is not a valid file, is a mono track, a selected channel is not part of its layout,
+        or all its (selected) channels are silent.
 
     Returns
     -------
-    None
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the split failed.
+        With `skip_silent`, 'skipped_channels' lists the channels that were not written (e.g. ['file.LFE']).
 
     Notes
     -----
@@ -252,83 +538,225 @@ def split_multi_sf(inpt: Path, outpt: Optional[Path] = None):
     - "multitrack_audio.L.wav" (left channel)
     - "multitrack_audio.R.wav" (right channel)
     - "multitrack_audio.X.wav" (where X = other channels)
+
+    With `channels='C'`, the subdirectory only contains "multitrack_audio.C.wav".
+    """
+
+    try:
+        return run_tasks(plan_split_multi_sf(inpt, outpt, channels=channels, skip_silent=skip_silent,
+                                             silence_threshold=silence_threshold, preallocate=preallocate,
+                                             segments=segments))
+    except Exception as e:
+        print(e)
+
+
+def plan_split_multi_sf(inpt: Path, outpt: Optional[Path] = None, *, channels: Optional[str] = None,
+                        skip_silent: bool = False, silence_threshold: Optional[Union[str, float]] = None,
+                        preallocate: bool = False, segments: Optional[Union[str, int]] = None) -> List[Task]:
+    """Plan `split_multi_sf()`: a single ffmpeg 'channelsplit' task.
+
+    With `channels`, 'channelsplit' only outputs the selected channels (see `layouts.Layout.select()`).
+    With `skip_silent`, the file is scanned for silent channels first (see
+    `analysis.find_silent_channels()`), and only the other channels are extracted.
+
+    With `segments`, the task runs one 'channelsplit' command per time segment at once
+    (see `_split_segments_task()`).
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the multi-channel audio file to be split.
+    outpt : Path, optional
+        The directory path where the output folder will be created (default is None, which uses the input's directory).
+    channels, skip_silent, silence_threshold, preallocate, segments
+        See `split_multi_sf()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+
+    Raises
+    ------
+    OSError
+        If input_file or outpt is not a valid path, or the file could not be analyzed.
+    ValueError
+        If input_file is a mono track, a selected channel is not part of its layout,
+        all its (selected) channels are silent, or `segments` is invalid.
     """
+    # Check the 'segments' option before the file is read
+    resolve_segments(segments, 0)
 
     # Ensure 'input_file' and 'out_dir' paths are valid:
     try:
         input_file, in_dir, out_dir = validate_paths(inpt, outpt)
     except OSError as e:
         print("Error:", e)
+        raise
 
     # Get filename, base_name, and extension from 'input_file'
     sfilename = os.path.basename(input_file)
     base_name, ext = os.path.splitext(sfilename)
 
-    # Create directory in out_dir
-    os.makedirs(os.path.join(out_dir, base_name), exist_ok=True)
-    
-    # Path of the newly created output folder
+    # Path of the output folder (created when the task runs)
     output_path = os.path.join(out_dir, base_name)
 
+    # Read the multi-channel audio file and get audio properties
     try:
+        sf_info = get_audio_info(input_file)
+        num_channels = int(sf_info['channels'])
+        channel_layout = sf_info['channel_layout']
+    except Exception as e:
+        raise OSError(f"File '{input_file}' could not be analyzed.", e)
 
-        # Read the multi-channel audio file and get audio properties
-        try:
-            sf_info = get_audio_info(input_file)
-            num_channels = int(sf_info['channels'])
-            channel_layout = sf_info['channel_layout']
-        except Exception as e:
-            raise OSError(f"File '{input_file}' could not be analyzed.", e)
-
-        # If file is 'mono' abort
-        if not num_channels > 1:
-            raise ValueError(f"File '{input_file}' is not a multitrack.")
-        
-        # Construct the command using Plumbum
+    # If file is 'mono' abort
+    if not num_channels > 1:
+        raise ValueError(f"File '{input_file}' is not a multitrack.")
+
+    # Selected channels
+    layout = LAYOUTS[channel_layout]
+    selected = layout.select(channels) if channels else list(range(num_channels))
+    if not selected:
+        raise ValueError("No channel selected.")
+
+    # Find silent channels (reading stops as soon as every channel has been heard)
+    silent = []
+    if skip_silent:
+        threshold = None if silence_threshold is None else float(silence_threshold)
+        silent = [i for i in find_silent_channels(input_file, threshold=threshold) if i in selected]
+        if len(silent) == len(selected):
+            raise ValueError(f"File '{input_file}' only has silent channels"
+                             f"{'' if len(selected) == num_channels else ' among the selected ones'}.")
+    kept = [i for i in selected if i not in silent]
+    skipped = [f"{base_name}.{layout.suffixes[i]}" for i in silent]
+
+    # Construct the command using Plumbum
+    ffmpeg = get_ffmpeg()
+
+    # Set in file
+    cmd = ffmpeg['-i', input_file]
+
+    # Overwrite file if file is present
+    cmd = cmd['-y']
+
+    # Split operation (only the kept channels are extracted when some are skipped or not selected)
+    if len(kept) < num_channels:
+        names = "+".join(layout.channels[i] for i in kept)
+        split_filter = (f'{layout.relabel_filter()},'
+                        f'channelsplit=channel_layout={layout.ffmpeg}:channels={names}'
+                        f'{"".join([f"[{i}]" for i in kept])}')
+    else:
+        split_filter = f'{layout.relabel_filter()},channelsplit=channel_layout=\
+            {layout.ffmpeg}\
+            {"".join([f"[{i}]" for i in range(num_channels)])}'
+    cmd = cmd['-filter_complex', f'[0:a]{split_filter}']
+
+    # Loop over the output channels and map them to their respective output files
+    output_files = []
+    for i in kept:
+        ch_ext = layout.suffixes[i]
+
+        # Use output_path to create the full path to the output file   
+        file_with_ext = f'{base_name}.{ch_ext}{ext}'
+        output_file = os.path.join(output_path, file_with_ext)
+        cmd = cmd['-map', f'[{i}]', output_file]
+        output_files.append(output_file)
+
+    # Long WAV files can be split in time segments at once
+    ranges = []
+    if segments and ext.lower() == '.wav':
+        header = get_header_info(input_file)
+        ranges = segment_ranges(header['frames'], resolve_segments(segments, header['frames'] / header['sample_rate']))
+
+    message = f"'{sfilename}' was successfully split{f' ({len(ranges)} segments)' if len(ranges) > 1 else ''}."
+    if len(selected) < num_channels:
+        message += f" Selected channels: {', '.join(layout.suffixes[i] for i in selected)}."
+    if skipped:
+        message += f" Skipped silent channels: {', '.join(skipped)}."
+    info = {'skipped_channels': skipped} if skip_silent else None
+
+    # The segments' outputs are joined, so they are never preallocated
+    if len(ranges) > 1:
+        return [_split_segments_task(input_file, output_path, output_files, split_filter, kept, ranges,
+                                     sample_rate=header['sample_rate'], message=message, info=info)]
+
+    task = Task([input_file], output_files, cmd=cmd, dirs=[output_path], cleanup=[output_path],
+                message=message, info=info)
+    if preallocate:
+        preallocate_outputs(task)
+    return [task]
+
+
+def _split_segments_task(input_file: str, output_path: str, output_files: List[str], split_filter: str,
+                         labels: List[int], ranges: List[Tuple[int, int]], *, sample_rate: int,
+                         message: str, info: Optional[Dict[str, List[Any]]]) -> Task:
+    """Build the segmented task of `plan_split_multi_sf()`.
+
+    Each segment runs the split's filter after an 'atrim' that keeps its exact samples: ffmpeg
+    seeks to a frame shortly before the segment (see `segments.seek_frame()`), and 'atrim' counts
+    samples from there. The segments of each channel are then joined with `helpers.concat_wav()`.
+    """
+    ffmpeg = get_ffmpeg()
+    parts_dir = segments_dir(output_path)
+    parts = {output_file: [] for output_file in output_files}
+    tasks = []
+    for index, (start, stop) in enumerate(ranges):
+        seek = seek_frame(start, sample_rate)
+        cmd = ffmpeg['-ss', f'{seek / sample_rate:.6f}', '-i', input_file, '-y']
+        cmd = cmd['-filter_complex', f'[0:a]atrim=start_sample={start - seek}:end_sample={stop - seek},{split_filter}']
+        segment_files = []
+        for label, output_file in zip(labels, output_files):
+            part = os.path.join(parts_dir, f'{index:04d}.{os.path.basename(output_file)}')
+            cmd = cmd['-map', f'[{label}]', part]
+            parts[output_file].append(part)
+            segment_files.append(part)
+        tasks.append(Task([input_file], segment_files, cmd=cmd))
+
+    def split() -> str:
         try:
-            ffmpeg_path = get_bin_path()
-            ffmpeg = local[ffmpeg_path]
-        except Exception:
-            try:
-                ffmpeg = local['ffmpeg']
-            except Exception:
-                raise OSError("ffmpeg could not be loaded.")
-
-        # Set in file
-        cmd = ffmpeg['-i', input_file]
+            run_segment_tasks(tasks)
+            join_segments(parts)
+        finally:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+        return 'ffmpeg'
 
-        # Overwrite file if file is present
-        cmd = cmd['-y']
-
-        # Split operation
-        cmd = cmd['-filter_complex', f'channelsplit=channel_layout=\
-            {channel_layout}\
-            {"".join([f"[{i}]" for i in range(num_channels)])}']
+    return Task([input_file], output_files, action=split, dirs=[output_path, parts_dir], cleanup=[output_path],
+                message=message, info=info)
 
-        # Loop over the output channels and map them to their respective output files
-        for i in range(num_channels):
-            ch_ext = CH_SMPTE_COMP[channel_layout][i]
+# Write a task's outputs under temporary names, with their final size reserved on disk
+def preallocate_outputs(task: Task) -> Task:
+    """Stage a task's outputs and reserve their expected size on disk.
 
-            # Use output_path to create the full path to the output file   
-            file_with_ext = f'{base_name}.{ch_ext}{ext}'
-            output_file = os.path.join(output_path, file_with_ext)
-            cmd = cmd['-map', f'[{i}]', output_file]
+    When several large outputs are written at once to the same volume (e.g. 8 or 16 mono files
+    of a split), their blocks interleave and the files end up badly fragmented. For PCM outputs
+    the final size is known from the input's header, so the space is reserved before ffmpeg
+    starts (see `helpers.preallocate()`) and every file is written into one contiguous extent.
 
-        # Run the command for the current input file
-        cmd()
+    The outputs are written under hidden names (see `helpers.staging_path()`) and renamed into
+    place when the task succeeds, so watch folders never see partial files.
 
-        # PRINT SUCCESS MESSAGE
-        print(f"'{sfilename}' was successfully split.")
+    Parameters
+    ----------
+    task : Task
+        A command task planned by `plan_split_multi_sf()` or `plan_sf_to_mov()`.
 
-    except Exception as e:
-        print(e)
+    Returns
+    -------
+    Task
+        The same task.
+    """
+    headers = {}
+    for path in task.inputs:
         try:
-            shutil.rmtree(output_path)
-        except OSError as e:
-            print(f"Error: {e}")
+            headers[path] = get_header_info(path)
+        except ValueError:
+            pass
+    task.stage_outputs(estimate_output_bytes(task, headers))
+    return task
+
 
 # CONFORM FUNCTION
-def sf_to_mov(inpt: Path, outpt: Optional[Path] = None):
+def sf_to_mov(inpt: Path, outpt: Optional[Path] = None, *, preallocate: bool = False) -> Optional[Dict[str, Any]]:
     """Convert multi-channel audio files to MOV format.
 
     This function takes a multi-channel audio file and converts it to MOV format while preserving
@@ -342,6 +770,10 @@ def sf_to_mov(inpt: Path, outpt: Optional[Path] = None):
     outpt : Optional[Path], optional
         The directory path where the converted MOV file will be saved. If not specified,
         the converted file will be saved in the same directory as the input file.
+    preallocate : bool, optional
+        If True, the MOV file is written under a hidden temporary name with its final size
+        reserved on disk, and renamed when it is complete (default is False).
+        See `preallocate_outputs()`.
 
     Raises
     ------
@@ -350,6 +782,11 @@ def sf_to_mov(inpt: Path, outpt: Optional[Path] = None):
     OSError
         If input_file or outpt is not a valid path.
 
+    Returns
+    -------
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the conversion failed.
+
     Example
     -------
     Assume we have a multi-channel audio file "multichannel_track.wav"
@@ -361,11 +798,44 @@ def sf_to_mov(inpt: Path, outpt: Optional[Path] = None):
     preserving the channel layout:
     - "multichannel_track.mov" (with channels preserved)
     """
+    tasks = plan_sf_to_mov(inpt, outpt, preallocate=preallocate)
+    try:
+        return run_tasks(tasks)
+    except Exception as e:
+        print(f"'{os.path.basename(inpt)}' failed to convert to mov.")
+        print(e)
+
+
+def plan_sf_to_mov(inpt: Path, outpt: Optional[Path] = None, *, preallocate: bool = False) -> List[Task]:
+    """Plan `sf_to_mov()`: a single ffmpeg task that writes one .mov stream per channel.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the multi-channel audio file to be converted.
+    outpt : Optional[Path], optional
+        The directory path where the MOV file will be saved (default is None, which uses the input's directory).
+    preallocate : bool, optional
+        See `sf_to_mov()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+
+    Raises
+    ------
+    ValueError
+        If the input file is already in MOV format or is not a multitrack audio file.
+    OSError
+        If input_file or outpt is not a valid path, or the file could not be analyzed.
+    """
     # Validate paths
     try:
         input_file, in_dir, out_dir = validate_paths(inpt, outpt)
     except OSError as e:
         print("Error:", e)
+        raise
 
 
     # Get base_name and extension
@@ -388,66 +858,221 @@ def sf_to_mov(inpt: Path, outpt: Optional[Path] = None):
     if not num_channels > 1:
         raise ValueError(f"File '{input_file}' is not a multitrack")
 
-    try:
-        # Set the path to the ffmpeg executable
-        try:
-            ffmpeg_path = get_bin_path()
-            ffmpeg = local[ffmpeg_path]
-        except Exception:
-            ffmpeg = local['ffmpeg']
+    layout = LAYOUTS[channel_layout]
+
+    # Set the path to the ffmpeg executable
+    ffmpeg = get_ffmpeg()
 
-        # Set in file
-        cmd = ffmpeg['-i', input_file]
+    # Set in file
+    cmd = ffmpeg['-i', input_file]
 
-        # Overwrite file if file is present
-        cmd = cmd['-y']
+    # Overwrite file if file is present
+    cmd = cmd['-y']
 
-        # Split operation
-        cmd = cmd['-filter_complex', f'[0:a]channelsplit=channel_layout=\
-                {channel_layout}\
-                {"".join([f"[{i}]" for i in range(num_channels)])}']
+    # Split operation
+    cmd = cmd['-filter_complex', f'[0:a]{layout.relabel_filter()},channelsplit=channel_layout=\
+            {layout.ffmpeg}\
+            {"".join([f"[{i}]" for i in range(num_channels)])}']
 
     # map channels
-        for i in range(num_channels):
-            cmd = cmd['-map', f'[{i}]']
+    for i in range(num_channels):
+        cmd = cmd['-map', f'[{i}]']
 
-        # Set outfiles' bitrate
-        cmd = cmd['-c:a', 'pcm_s24le', '-ar', '48000', '-disposition:a', '+default']
+    # Set outfiles' bitrate
+    cmd = cmd['-c:a', 'pcm_s24le', '-ar', '48000', '-disposition:a', '+default']
 
-        # Set name metadata for whole file name
-        cmd = cmd['-metadata', f'title={base_name}']
+    # Set name metadata for whole file name
+    cmd = cmd['-metadata', f'title={base_name}']
 
-        # Set name metadata for each audio stream
-        for i in range(num_channels):
-            ch_ext = CH_SMPTE_COMP[channel_layout][i]
-            cmd = cmd[f'-metadata:s:a:{i}', f'title={base_name}.{ch_ext}']
+    # Set name metadata for each audio stream
+    for i in range(num_channels):
+        ch_ext = layout.suffixes[i]
+        cmd = cmd[f'-metadata:s:a:{i}', f'title={base_name}.{ch_ext}']
 
 
-        output_file = os.path.normpath(os.path.join(out_dir, f'{base_name}.mov'))
-        # Set actual file name and type (.mov)
-        cmd = cmd[output_file]
+    output_file = os.path.normpath(os.path.join(out_dir, f'{base_name}.mov'))
+    # Set actual file name and type (.mov)
+    cmd = cmd[output_file]
 
-        # Run full command
-        cmd()
+    task = Task([input_file], [output_file], cmd=cmd, message=f"'{sfilename}' was successfully processed.")
+    if preallocate:
+        preallocate_outputs(task)
+    return [task]
 
-        # PRINT SUCCESS MESSAGE
-        print(f"'{sfilename}' was successfully processed.")
 
-    except Exception as e:
-        print(f"'{sfilename}' failed to convert to mov.")
-        print(e)
 
 
+# PACKAGE FUNCTIONS
+def package_to_mov(inpt: Path, outpt: Optional[Path] = None, *, name: Optional[str] = None,
+                   preallocate: bool = False) -> Dict[str, Any]:
+    """Put every audio file of a folder in a single MOV file, with one stream per channel.
+
+    Multi-channel files are split into one stream per channel, and mono files are added as they are.
+    Every stream is titled like the files `split_multi_sf()` would write (e.g. 'track.L'), the same
+    scheme as `sf_to_mov()`. Everything is done in a single ffmpeg pass.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the directory containing the audio files.
+    outpt : Path, optional
+        The directory path where the MOV file will be saved (default is None, which uses inpt).
+    name : str, optional
+        The name of the MOV file, without extension (default is None, which uses the folder's name).
+    preallocate : bool, optional
+        See `sf_to_mov()`.
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path, or a file could not be analyzed.
+    FileNotFoundError
+        If there are no audio files in the directory.
+    RuntimeError
+        If ffmpeg failed to write the MOV file.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The result of `run_tasks()` ('outputs', 'method').
+
+    Example
+    -------
+    Assume we have a delivery folder with "mix.wav" (5.1), "dx.L.wav" and "dx.R.wav"
+    >>> package_to_mov(Path("path/to/delivery"), Path("path/to/output"))
+
+    After running the function, the output directory will contain "delivery.mov" with 8 streams:
+    'dx.L', 'dx.R', 'mix.L', 'mix.R', 'mix.C', 'mix.LFE', 'mix.Ls', 'mix.Rs'.
+    """
+    return run_tasks(plan_package_to_mov(inpt, outpt, name=name, preallocate=preallocate))
+
+
+def plan_package_to_mov(inpt: Path, outpt: Optional[Path] = None, *, name: Optional[str] = None,
+                        preallocate: bool = False) -> List[Task]:
+    """Plan `package_to_mov()`: a single ffmpeg task that muxes every channel of a folder into one MOV.
+
+    Tracks are ordered by name. The files of a multi-mono track are kept together, in layout
+    order (see `preflight_mono_group()`).
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the directory containing the audio files.
+    outpt : Path, optional
+        The directory path where the MOV file will be saved (default is None, which uses inpt).
+    name, preallocate
+        See `package_to_mov()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path, or a file could not be analyzed.
+    FileNotFoundError
+        If there are no audio files in the directory.
+    """
+    # Validate paths
+    try:
+        input_file, in_dir, out_dir = validate_paths(inpt, outpt, isdir=True)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    sfu = SoundFilesUtils(user_path=in_dir)
+    if not sfu.sfile_list:
+        raise FileNotFoundError(f"No audio files found in '{in_dir}'")
+
+    # Tracks: (track name, files in stream order)
+    tracks = [(os.path.splitext(sfile)[0], [sfile]) for sfile in sfu.list_multisf]
+    for ext in sfu.monodict:
+        for base_name, group in sfu.monodict[ext].items():
+            files = preflight_mono_group(in_dir, base_name, ext, group, strict=False)['files']
+            tracks.append((base_name, files))
+    tracks.sort(key=lambda track: track[0].lower())
+
+    # Inputs, and the stream label and title of every channel
+    ffmpeg = get_ffmpeg()
+    cmd = ffmpeg
+    input_paths, filters, streams = [], [], []
+    for _, files in tracks:
+        for sfile in files:
+            path = os.path.join(in_dir, sfile)
+            base_name = os.path.splitext(sfile)[0]
+            k = len(input_paths)
+            input_paths.append(path)
+            cmd = cmd['-i', path]
+
+            try:
+                num_channels = int(get_header_info(path)['channels'])
+                channel_layout = get_audio_info(path)['channel_layout'] if num_channels > 1 else None
+            except Exception as e:
+                raise OSError(f"File '{path}' could not be analyzed.", e)
+
+            # Mono files are mapped as they are, multi-channel files are split first
+            if num_channels == 1:
+                streams.append((f'{k}:a:0', base_name))
+                continue
+            layout = LAYOUTS[channel_layout]
+            labels = [f'[{k}_{i}]' for i in range(num_channels)]
+            filters.append(f'[{k}:a]{layout.relabel_filter()},'
+                           f'channelsplit=channel_layout={layout.ffmpeg}{"".join(labels)}')
+            streams += [(label, f'{base_name}.{suffix}') for label, suffix in zip(labels, layout.suffixes)]
+
+    # Overwrite file if file is present
+    cmd = cmd['-y']
+
+    if filters:
+        cmd = cmd['-filter_complex', ';'.join(filters)]
+    for label, _ in streams:
+        cmd = cmd['-map', label]
+
+    # Set outfiles' bitrate (as sf_to_mov)
+    cmd = cmd['-c:a', 'pcm_s24le', '-ar', '48000', '-disposition:a', '+default']
+
+    # Set name metadata for the whole file and each audio stream
+    name = name or os.path.basename(os.path.normpath(in_dir))
+    cmd = cmd['-metadata', f'title={name}']
+    for i, (_, title) in enumerate(streams):
+        cmd = cmd[f'-metadata:s:a:{i}', f'title={title}']
+
+    output_file = os.path.normpath(os.path.join(out_dir, f'{name}.mov'))
+    cmd = cmd[output_file]
+
+    task = Task(input_paths, [output_file], cmd=cmd,
+                message=f"'{name}.mov' was successfully packaged ({len(streams)} streams from {len(input_paths)} files).")
+    if preallocate:
+        preallocate_outputs(task)
+    return [task]
+
 
 
 # CONVERT FUNCTIONS
 
-def convert_to_audio(inpt: Path, outpt: Optional[Path] = None, *, conversion: str = "wav", sample_rate: str = "48000", bit_rate: str = "pcm_s24le"):
-    """NEEDS FIXING!!! Convert audio files to a specified format.
+def convert_to_audio(inpt: Path, outpt: Optional[Path] = None, *, conversion: str = "wav", sample_rate: str = "48000", bit_rate: str = "pcm_s24le",
+                     link: bool = False, engine: str = "auto", dither: bool = False,
+                     segments: Optional[Union[str, int]] = None) -> Optional[Dict[str, Any]]:
+    """Convert audio files to a specified format.
 
     This function takes an audio file and converts it to the specified audio format. The resulting
     audio file will be saved in the specified or default output directory.
 
+    If the input file already has the target format, codec and sample rate, ffmpeg is skipped
+    and the output is materialised with `fast_copy()` (reflink, in-kernel copy or, optionally, hardlink).
+
+    PCM conversions between WAV, AIFF and FLAC can also run in-process with `pcm_engine.transcode()`
+    (in a shared process pool). By default, the native engine is used when the sample rate doesn't
+    change (its samples are bit-identical to ffmpeg's and the channel mask is kept, without starting a process) or when ffmpeg can't
+    write the codec to the format (e.g. PCM in FLAC). ffmpeg resamples faster, so it is kept for other
+    rate changes (see `python pcm_engine.py bench`).
+
+    A long file converted to WAV can be cut in time segments that are converted at once by the native
+    engine, then joined (see `pcm_engine.transcode_in_pool()`). The samples are the same as a conversion
+    in one piece by the native engine (see `tests/test_segments.py`).
+
     Parameters
     ----------
     inpt : Path
@@ -461,12 +1086,68 @@ def convert_to_audio(inpt: Path, outpt: Optional[Path] = None, *, conversion: st
         The sample rate of the output audio (default is "48000").
     bit_rate : str, optional
         The bit rate of the output audio (default is "pcm_s24le").
+    link : bool, optional
+        If True, no-op conversions are materialised as hardlinks when possible (default is False).
+    engine : str, optional
+        'auto', 'native' or 'ffmpeg' (default is "auto", which uses the native engine when the
+        conversion is supported and either keeps the sample rate or can't be done by ffmpeg).
+    dither : bool, optional
+        If True, TPDF dither is added when samples are rounded to a smaller bit depth (default is False).
+    segments : str or int, optional
+        Convert the file in this many time segments at once, with the native engine (default is None,
+        which converts it in one piece). 'auto' uses one segment per core, each at least
+        `segments.MIN_SEGMENT_SECONDS` long. Only for WAV outputs: other conversions run in one piece.
+
+    Returns
+    -------
+    Dict[str, Union[str, List[str]]] or None
+        A dictionary with the 'outputs' list and the 'method' used ('ffmpeg', 'native' or one of
+        `PASSTHROUGH_METHODS`), or None if the conversion failed.
     """    
+    try:
+        return run_tasks(plan_convert_to_audio(inpt, outpt, conversion=conversion, sample_rate=sample_rate,
+                                               bit_rate=bit_rate, link=link, engine=engine, dither=dither,
+                                               segments=segments))
+    except Exception as e:
+        print(e)
+
+
+def plan_convert_to_audio(inpt: Path, outpt: Optional[Path] = None, *, conversion: str = "wav", sample_rate: str = "48000",
+                          bit_rate: str = "pcm_s24le", link: bool = False, engine: str = "auto", dither: bool = False,
+                          segments: Optional[Union[str, int]] = None) -> List[Task]:
+    """Plan `convert_to_audio()`: an ffmpeg or native task, or a fast-path copy task for no-op conversions.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the input audio file to be converted.
+    outpt : Optional[Path], optional
+        The directory path where the converted audio file will be saved (default is None, which uses the input's directory).
+    conversion, sample_rate, bit_rate, link, engine, dither, segments
+        See `convert_to_audio()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run (a 'noop' task if the output would be the input itself).
+
+    Raises
+    ------
+    ValueError
+        If `engine` is unknown, or is 'native' and the conversion isn't supported by the native engine,
+        or `segments` is invalid or used with the 'ffmpeg' engine.
+    """
+    if engine not in ('auto', 'native', 'ffmpeg'):
+        raise ValueError(f"Invalid engine '{engine}'. Use 'auto', 'native' or 'ffmpeg'.")
+    if resolve_segments(segments, float('inf')) > 1 and engine == 'ffmpeg':
+        raise ValueError("Segments are converted by the native engine. Use engine 'auto' or 'native'.")
+
     # Validate paths
     try:
         input_file, in_dir, out_dir = validate_paths(inpt, outpt)
     except OSError as e:
         print("Error:", e)
+        raise
 
     # Get filename, base_name, and extension from 'input_file'
     sfilename = os.path.basename(input_file)
@@ -476,41 +1157,972 @@ def convert_to_audio(inpt: Path, outpt: Optional[Path] = None, *, conversion: st
     output_file = f"{base_name}.{conversion}"
     output_path = os.path.join(out_dir, output_file)
 
+    # FAST PATH: Input already matches the target, so copy instead of re-encoding
     try:
-        # Set the path to the ffmpeg executable
+        sf_info = get_audio_info(input_file)
+    except Exception:
+        sf_info = {}
+
+    if sf_info and is_passthrough(sf_info, ext, conversion=conversion, sample_rate=sample_rate, bit_rate=bit_rate):
+        # Nothing to do if output would overwrite the input (no cleanup: the output is the input)
+        if os.path.exists(output_path) and os.path.samefile(input_file, output_path):
+            return [Task([input_file], [output_path], action=lambda: 'noop', method='noop', cleanup=[],
+                         message=f"'{sfilename}' is already {conversion} ({bit_rate}, {sample_rate}Hz). Skipped.")]
+
+        def materialise() -> str:
+            try:
+                method = fast_copy(input_file, output_path, link=link)
+                print(f"'{sfilename}' already matches target format. Materialised as {output_file} ({method}).")
+                return method
+            except OSError as e:
+                # Fall back to re-encoding
+                print(f"Fast path failed for '{sfilename}', converting with ffmpeg instead. ({e})")
+                ffmpeg_task.run()
+                return 'ffmpeg'
+
+        ffmpeg_task = _convert_task(input_file, output_path, sample_rate=sample_rate, bit_rate=bit_rate, dither=dither)
+        return [Task([input_file], [output_path], action=materialise, method='copy')]
+
+    # NATIVE ENGINE: PCM conversions that soundfile can read and write
+    if engine != 'ffmpeg':
         try:
-            ffmpeg_path = get_bin_path()
-            ffmpeg = local[ffmpeg_path]
-        except Exception:
-            ffmpeg = local['ffmpeg']
+            header = get_header_info(input_file)
+            reason = native_reason(header, conversion=conversion, sample_rate=sample_rate, bit_rate=bit_rate)
+        except ValueError as e:
+            header, reason = {}, str(e)
+        if engine == 'native' and reason:
+            raise ValueError(f"'{sfilename}' can't be converted by the native engine: {reason}.")
+        # Segmented conversions are joined as WAV files
+        count = 1
+        if segments and not reason and conversion.lower() == 'wav':
+            count = resolve_segments(segments, header['frames'] / header['sample_rate'])
+        if not reason and (count > 1 or engine == 'native' or header['sample_rate'] == int(sample_rate)
+                           or not ffmpeg_writes(conversion, bit_rate)):
+            return [_native_convert_task(input_file, output_path, conversion=conversion, sample_rate=sample_rate,
+                                         bit_rate=bit_rate, dither=dither, segments=count)]
+
+    return [_convert_task(input_file, output_path, sample_rate=sample_rate, bit_rate=bit_rate, dither=dither)]
+
+
+def _native_convert_task(input_file: str, output_path: str, *, conversion: str, sample_rate: str, bit_rate: str,
+                         dither: bool, segments: int = 1) -> Task:
+    """Build the native engine task of `plan_convert_to_audio()`."""
+    def transcode() -> str:
+        transcode_in_pool(input_file, output_path, sample_rate=int(sample_rate), subtype=CODEC_SUBTYPES[bit_rate],
+                          container=NATIVE_CONTAINERS[conversion.lower()], dither=dither, segments=segments)
+        return 'native'
+
+    native = f"native, {segments} segments" if segments > 1 else "native"
+    return Task([input_file], [output_path], action=transcode, method='native',
+                message=f"'{os.path.basename(input_file)}' converted to {os.path.basename(output_path)} ({native}).")
+
+
+def _convert_task(input_file: str, output_path: str, *, sample_rate: str, bit_rate: str, dither: bool = False) -> Task:
+    """Build the ffmpeg task of `plan_convert_to_audio()`."""
+    # Set the path to the ffmpeg executable
+    ffmpeg = get_ffmpeg()
+
+    # Construct the command using Plumbum syntax
+    cmd = ffmpeg['-i', input_file]
+
+    cmd = cmd['-y']
+    
+    cmd = cmd["-ar", sample_rate]
 
-        # Construct the command using Plumbum syntax
-        cmd = ffmpeg['-i', input_file]
+    cmd = cmd['-c:a', bit_rate]  # Use -c:a to specify the audio codec
 
-        cmd = cmd['-y']
+    if dither:
+        cmd = cmd['-dither_method', 'triangular']
         
-        cmd = cmd["-ar", sample_rate]
+    cmd = cmd[output_path]
+
+    return Task([input_file], [output_path], cmd=cmd,
+                message=f"'{os.path.basename(input_file)}' converted to {os.path.basename(output_path)}.")
+
+
+
+
+# QC FUNCTIONS
+def qc_audio(inpt: Path, outpt: Optional[Path] = None, *, silence_threshold: Union[str, float] = -60.0,
+             min_silence: Union[str, float] = 0.5, no_cache: bool = False) -> Optional[Dict[str, Any]]:
+    """Analyze an audio file (peak, RMS, DC offset, clipping, silent regions per channel) and save a JSON report.
+
+    The file is streamed in blocks and analyzed with NumPy (see `analysis.analyze_audio()`).
+    Reports are cached by file fingerprint, so re-running QC on unchanged files (or using the
+    results from other operations) doesn't decode the audio again.
 
-        cmd = cmd['-c:a', bit_rate]  # Use -c:a to specify the audio codec
-            
-        cmd = cmd[output_path]
+    Parameters
+    ----------
+    inpt : Path
+        The path to the audio file.
+    outpt : Path, optional
+        The directory path where the report will be saved (default is None, which uses the input's directory).
+    silence_threshold : str or float, optional
+        Windows at or below this RMS level (dBFS) count as silent (default is -60.0).
+    min_silence : str or float, optional
+        The shortest silent region reported, in seconds (default is 0.5).
+    no_cache : bool, optional
+        If True, analyze the file even if a cached report exists (default is False).
 
-        # Run the command
-        cmd()
+    Returns
+    -------
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the analysis failed.
+        'method' is 'cache' if the report came from the cache, 'numpy' otherwise.
 
-        # PRINT SUCCESS MESSAGE
-        print(f"'{sfilename}' converted to {output_file}.")
+    Example
+    -------
+    >>> qc_audio(Path("path/to/track.wav"), Path("path/to/output"))
 
+    After running the function, the output directory will contain "track.qc.json".
+    """
+    try:
+        return run_tasks(plan_qc_audio(inpt, outpt, silence_threshold=silence_threshold,
+                                       min_silence=min_silence, no_cache=no_cache))
     except Exception as e:
         print(e)
-        try:
-            shutil.rmtree(output_path)
-        except OSError as e:
-            print(f"Error: {e}")
 
 
+def plan_qc_audio(inpt: Path, outpt: Optional[Path] = None, *, silence_threshold: Union[str, float] = -60.0,
+                  min_silence: Union[str, float] = 0.5, no_cache: bool = False) -> List[Task]:
+    """Plan `qc_audio()`: a single Python task that writes '<base_name>.qc.json'.
 
+    Parameters
+    ----------
+    inpt, outpt, silence_threshold, min_silence, no_cache
+        See `qc_audio()`.
 
-# QC VIDEO FUNCTIONS
-def qc_video():
-    ...
\ No newline at end of file
+    Returns
+    -------
+    List[Task]
+        The task to run.
+    """
+    # Validate paths
+    try:
+        input_file, in_dir, out_dir = validate_paths(inpt, outpt)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    sfilename = os.path.basename(input_file)
+    base_name, ext = os.path.splitext(sfilename)
+    output_path = os.path.join(out_dir, f"{base_name}.qc.json")
+    params = {'silence_threshold': float(silence_threshold), 'min_silence': float(min_silence)}
+
+    def analyse() -> str:
+        # Name channels after the file's layout (e.g. L, R, C...)
+        try:
+            sf_info = get_audio_info(input_file)
+            params['channel_names'] = LAYOUTS[sf_info['channel_layout']].suffixes
+        except Exception:
+            pass
+
+        report, cached = get_qc_report(input_file, use_cache=not no_cache, **params)
+        with open(output_path, 'w') as f:
+            json.dump({'file': input_file, **report}, f, indent=4)
+
+        silent = [ch['name'] for ch in report['per_channel'] if ch['silent']]
+        clipped = [ch['name'] for ch in report['per_channel'] if ch['clipped']]
+        print(f"'{sfilename}' QC done{' (cached)' if cached else ''}. "
+              f"Clipped: {', '.join(clipped) or 'none'}. Silent: {', '.join(silent) or 'none'}.")
+        return 'cache' if cached else 'numpy'
+
+    return [Task([input_file], [output_path], action=analyse, method='numpy')]
+
+
+# QC VIDEO FUNCTIONS
+def qc_video(inpt: Path, outpt: Optional[Path] = None, *, audio: Optional[Path] = None,
+             sample_rate: str = "48000", audio_codec: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Put an audio file on a video, for QC, without re-encoding the picture.
+
+    The video stream is copied as it is, and only the audio is converted. The video's own audio
+    streams are replaced. In a batch, every video of the folder is paired with the audio file
+    that has the same base name (e.g. 'ep101.mov' and 'ep101.wav').
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the video file (see `VIDEO_FORMATS`).
+    outpt : Path, optional
+        The directory path where the new video will be saved (default is None, which uses the input's directory).
+    audio : Path, optional
+        The path to the audio file (default is None, which uses the audio file next to the video
+        with the same base name - see `find_audio_pair()`).
+    sample_rate : str, optional
+        The sample rate of the audio in the output (default is "48000").
+    audio_codec : str, optional
+        The ffmpeg audio codec (default is None, which uses `VIDEO_AUDIO_CODECS` for the video's
+        container - 24-bit PCM for .mov).
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path.
+    FileNotFoundError
+        If no audio file (or more than one) matches the video.
+    ValueError
+        If the output would overwrite the video.
+
+    Returns
+    -------
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the mux failed.
+
+    Example
+    -------
+    Assume we have "ep101.mov" and "ep101.wav" in a folder
+    >>> qc_video(Path("path/to/ep101.mov"), Path("path/to/output"))
+
+    After running the function, the output directory will contain "ep101.mov" with the picture
+    of the input and the audio of "ep101.wav".
+    """
+    try:
+        return run_tasks(plan_qc_video(inpt, outpt, audio=audio, sample_rate=sample_rate, audio_codec=audio_codec))
+    except Exception as e:
+        print(e)
+
+
+def find_audio_pair(video_file: Path) -> str:
+    """Find the audio file that goes with a video: the one next to it with the same base name.
+
+    Parameters
+    ----------
+    video_file : Path
+        The path to the video file.
+
+    Returns
+    -------
+    str
+        The path to the audio file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If there is no matching audio file, or more than one (e.g. 'ep101.wav' and 'ep101.aiff').
+    """
+    folder, filename = os.path.split(os.path.abspath(video_file))
+    base_name = os.path.splitext(filename)[0].lower()
+    matches = sorted(
+        file for file in os.listdir(folder)
+        if os.path.splitext(file)[0].lower() == base_name
+        and os.path.splitext(file)[1][1:].lower() in AUDIO_FORMATS
+        and not file.startswith('.')
+    )
+    if not matches:
+        raise FileNotFoundError(f"No audio file found for '{filename}'")
+    if len(matches) > 1:
+        raise FileNotFoundError(f"More than one audio file found for '{filename}': {', '.join(matches)}")
+    return os.path.join(folder, matches[0])
+
+
+def plan_qc_video(inpt: Path, outpt: Optional[Path] = None, *, audio: Optional[Path] = None,
+                  sample_rate: str = "48000", audio_codec: Optional[str] = None) -> List[Task]:
+    """Plan `qc_video()`: a single ffmpeg task that copies the video and converts the audio.
+
+    Parameters
+    ----------
+    inpt, outpt, audio, sample_rate, audio_codec
+        See `qc_video()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+    """
+    # Validate paths
+    try:
+        video_file, in_dir, out_dir = validate_paths(inpt, outpt)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    vfilename = os.path.basename(video_file)
+    base_name, ext = os.path.splitext(vfilename)
+    audio_file = os.path.abspath(audio) if audio else find_audio_pair(video_file)
+    codec = audio_codec or VIDEO_AUDIO_CODECS.get(ext.lower(), 'pcm_s24le')
+
+    output_file = os.path.normpath(os.path.join(out_dir, vfilename))
+    if output_file == os.path.normpath(video_file):
+        raise ValueError(f"Output would overwrite '{vfilename}'. Please choose another output folder.")
+
+    ffmpeg = get_ffmpeg()
+    cmd = ffmpeg['-i', video_file, '-i', audio_file]
+
+    # Overwrite file if file is present
+    cmd = cmd['-y']
+
+    # Picture (and the video's metadata, e.g. timecode) from the video, sound from the audio file
+    cmd = cmd['-map', '0:v', '-map', '1:a', '-map_metadata', '0']
+    cmd = cmd['-c:v', 'copy', '-c:a', codec, '-ar', str(sample_rate)]
+    cmd = cmd[output_file]
+
+    return [Task([video_file, audio_file], [output_file], cmd=cmd,
+                 message=f"'{vfilename}' + '{os.path.basename(audio_file)}' were successfully muxed.")]
+
+
+# REMAP FUNCTIONS
+def remap_channels(inpt: Path, outpt: Optional[Path] = None, *, layout: Optional[str] = None,
+                   in_place: bool = False) -> Optional[Dict[str, Any]]:
+    """Set the channel layout of a WAV file by patching its channel mask, without rewriting the audio.
+
+    Files that went through other tools (e.g. time-stretching) often come back with the wrong
+    or no channel mapping. In a WAVE_FORMAT_EXTENSIBLE file the mapping is the 4-byte
+    dwChannelMask of the 'fmt ' chunk, so only those 4 bytes are written - this takes
+    milliseconds, whatever the size of the file.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the WAV file.
+    outpt : Path, optional
+        The directory path where the remapped copy will be saved (default is None, which uses the input's directory).
+    layout : str, optional
+        The channel layout to set (a key of `CH_LAYOUT_COMP`, e.g. '5.1'), (default is None, which
+        uses the default layout for the file's number of channels - see `DEFAULT_LAYOUTS`).
+    in_place : bool, optional
+        If True, the input file itself is patched and nothing is copied (default is False).
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path.
+    ValueError
+        If the file is not a WAVE_FORMAT_EXTENSIBLE WAV file, or the layout is unknown, has no
+        channel mask, or doesn't match the file's number of channels.
+
+    Returns
+    -------
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the remap failed.
+        'method' is 'header', as only the header is written. The copy is made with `fast_copy()`.
+
+    Example
+    -------
+    >>> remap_channels(Path("path/to/stretched_5.1.wav"), Path("path/to/output"), layout='5.1')
+
+    After running the function, the output directory will contain "stretched_5.1.wav" (a reflink of
+    the input where the filesystem supports it) with the 5.1 channel mask.
+    """
+    try:
+        return run_tasks(plan_remap_channels(inpt, outpt, layout=layout, in_place=in_place))
+    except Exception as e:
+        print(e)
+
+
+def plan_remap_channels(inpt: Path, outpt: Optional[Path] = None, *, layout: Optional[str] = None,
+                        in_place: bool = False) -> List[Task]:
+    """Plan `remap_channels()`: a single Python task that copies the file (unless `in_place`) and patches its mask.
+
+    The file's header and the layout are checked while planning, so nothing is copied for files
+    that can't be remapped.
+
+    Parameters
+    ----------
+    inpt, outpt, layout, in_place
+        See `remap_channels()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+    """
+    # Validate paths
+    try:
+        input_file, in_dir, out_dir = validate_paths(inpt, outpt)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    sfilename = os.path.basename(input_file)
+
+    # Check the header (only WAVE_FORMAT_EXTENSIBLE files have a mask to patch)
+    old_mask = read_wav_channel_mask(input_file)
+    if old_mask is None:
+        raise ValueError(f"'{sfilename}' is not a WAVE_FORMAT_EXTENSIBLE WAV file. Use 'conform' or 'convert' to rewrite it.")
+    num_channels = int(get_header_info(input_file)['channels'])
+
+    # Check the layout
+    target = LAYOUTS.get(layout) if layout else LAYOUTS.default(num_channels)
+    if target is None:
+        raise ValueError(f"Invalid channel_layout '{layout or num_channels}'")
+    if target.num_channels != num_channels:
+        raise ValueError(f"'{sfilename}' has {num_channels} channels, '{target.name}' has {target.num_channels}")
+    if target.mask is None:
+        raise ValueError(f"'{target.name}' can't be stored as a WAV channel mask")
+
+    output_file = input_file if in_place else os.path.normpath(os.path.join(out_dir, sfilename))
+    if not in_place and output_file == os.path.normpath(input_file):
+        raise ValueError(f"Output would overwrite '{sfilename}'. Use --in-place to patch the file itself.")
+
+    def remap() -> None:
+        # Never hardlink: the copy's mask is patched, and a hardlink would patch the input too
+        copied = 'in place' if in_place else f"{fast_copy(input_file, output_file)} copy"
+        write_wav_channel_mask(output_file, target.mask)
+        previous = LAYOUTS.from_mask(old_mask)
+        print(f"'{sfilename}' remapped to {target.name} "
+              f"(was {previous.name if previous else f'{old_mask:#x}'}, {copied}).")
+
+    # Never delete the input if patching it fails
+    return [Task([input_file], [output_file], action=remap, method='header',
+                 cleanup=[] if in_place else None)]
+
+
+
+
+# CONCAT FUNCTIONS
+def concat_files(inpt: Path, outpt: Optional[Path] = None, *, order: Optional[str] = None, name: Optional[str] = None,
+                 engine: str = "auto") -> Dict[str, Any]:
+    """Join the audio files of a folder (e.g. reels or consecutive takes) into one file, without re-encoding.
+
+    The first file sets the output's format. Files that have it are joined as they are: PCM WAV
+    files by appending their audio data to a single header (`helpers.concat_wav()`), other formats
+    with ffmpeg's concat demuxer and '-c copy' (FLAC files, whose frames can't be copied, are
+    re-encoded losslessly). Only the files that don't match are converted first (to the first file's
+    format, sample format and sample rate), so joining costs about one sequential read and write.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the directory containing the audio files.
+    outpt : Path, optional
+        The directory path where the joined file will be saved (default is None, which uses inpt).
+    order : str, optional
+        The files to join, in order: a comma-separated list of file names, or the path to a text file
+        with one file name per line (default is None, which joins every audio file sorted by name,
+        with numbers sorted by value - 'reel2' before 'reel10').
+    name : str, optional
+        The name of the joined file, without extension (default is None, which uses the folder's name).
+    engine : str, optional
+        'auto', 'native' or 'ffmpeg' (default is "auto", which appends PCM WAV files natively
+        and uses ffmpeg's concat demuxer for other formats).
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path, or a file could not be analyzed.
+    FileNotFoundError
+        If there are less than two audio files to join, or a file of `order` doesn't exist.
+    ValueError
+        If the files don't have the same number of channels, or `engine` is unknown or can't join them.
+    RuntimeError
+        If the join failed.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The result of `run_tasks()` ('outputs', 'method', and the 'converted' files).
+
+    Example
+    -------
+    Assume we have a folder with "reel1.wav", "reel2.wav" and "reel10.wav" (48kHz, 24-bit, 5.1)
+    >>> concat_files(Path("path/to/reels"), Path("path/to/output"), name='feature')
+
+    After running the function, the output directory will contain "feature.wav", with reel1, reel2
+    and reel10 one after the other.
+    """
+    return run_tasks(plan_concat_files(inpt, outpt, order=order, name=name, engine=engine))
+
+
+def plan_concat_files(inpt: Path, outpt: Optional[Path] = None, *, order: Optional[str] = None,
+                      name: Optional[str] = None, engine: str = "auto") -> List[Task]:
+    """Plan `concat_files()`: a single Python task that converts the mismatched files, then joins every file.
+
+    The files are probed while planning, so nothing is written if they can't be joined.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the directory containing the audio files.
+    outpt : Path, optional
+        The directory path where the joined file will be saved (default is None, which uses inpt).
+    order, name, engine
+        See `concat_files()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path, or a file could not be analyzed.
+    FileNotFoundError
+        If there are less than two audio files to join, or a file of `order` doesn't exist.
+    ValueError
+        If the files don't have the same number of channels, or `engine` is unknown or can't join them.
+    """
+    if engine not in ('auto', 'native', 'ffmpeg'):
+        raise ValueError(f"Invalid engine '{engine}'. Use 'auto', 'native' or 'ffmpeg'.")
+
+    # Validate paths
+    try:
+        input_file, in_dir, out_dir = validate_paths(inpt, outpt, isdir=True)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    # Files to join, in order
+    sfiles = order_concat_files(in_dir, order)
+    if len(sfiles) < 2:
+        raise FileNotFoundError(f"At least two audio files are needed to concat (found {len(sfiles)} in '{in_dir}')")
+    paths = [os.path.join(in_dir, sfile) for sfile in sfiles]
+
+    # The first file sets the format, the others are converted to it if they don't have it
+    try:
+        formats = [_concat_format(path) for path in paths]
+    except Exception as e:
+        raise OSError("A file could not be analyzed.", e)
+    reference, ext = formats[0], os.path.splitext(sfiles[0])[1].lower()
+    mismatched = []
+    for sfile, fmt in zip(sfiles, formats):
+        if fmt['channels'] != reference['channels']:
+            raise ValueError(f"'{sfile}' has {fmt['channels']} channels, '{sfiles[0]}' has {reference['channels']}")
+        if os.path.splitext(sfile)[1].lower() != ext or fmt != reference:
+            mismatched.append(sfile)
+
+    # PCM WAV files are appended natively
+    native = ext == '.wav' and str(reference['subtype']).startswith(('PCM', 'FLOAT', 'DOUBLE'))
+    if engine == 'native' and not native:
+        raise ValueError(f"The native engine only joins PCM WAV files ('{sfiles[0]}' is {reference['subtype']}).")
+    native = native and engine != 'ffmpeg'
+
+    name = name or os.path.basename(os.path.normpath(in_dir))
+    output_file = os.path.normpath(os.path.join(out_dir, f'{name}{ext}'))
+    if output_file in (os.path.normpath(path) for path in paths):
+        raise ValueError(f"Output would overwrite '{os.path.basename(output_file)}'. Use another --name or output folder.")
+
+    # Mismatched files are converted next to the output, in a hidden folder that is deleted afterwards
+    parts_dir = os.path.join(out_dir, f'.{name}.parts')
+    parts, conversions = [], []
+    for sfile, path in zip(sfiles, paths):
+        if sfile not in mismatched:
+            parts.append(path)
+            continue
+        part = os.path.join(parts_dir, f'{len(parts):04d}.{os.path.splitext(sfile)[0]}{ext}')
+        conversions.append(_concat_part_task(path, part, ext=ext, reference=reference))
+        parts.append(part)
+
+    # FLAC frames are numbered from the start of their file, so FLAC files are re-encoded (losslessly) instead of copied
+    codec_args = ['-c:a', 'flac'] if ext == '.flac' else ['-c', 'copy']
+
+    def concat() -> str:
+        try:
+            for task in conversions:
+                task.run()
+            if native:
+                concat_wav(parts, output_file)
+                return 'native'
+            return _concat_demuxer(parts, output_file, parts_dir, codec_args=codec_args)
+        finally:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+    converted = f", {len(mismatched)} converted" if mismatched else ""
+    return [Task(paths, [output_file], action=concat, method='native' if native else 'ffmpeg', dirs=[parts_dir],
+                 message=f"'{name}{ext}' was successfully joined ({len(paths)} files{converted}).",
+                 info={'converted': mismatched})]
+
+
+def order_concat_files(in_dir: str, order: Optional[str] = None) -> List[str]:
+    """Get the files `concat_files()` joins, in order.
+
+    Parameters
+    ----------
+    in_dir : str
+        The path to the directory containing the audio files.
+    order : str, optional
+        See `concat_files()`.
+
+    Returns
+    -------
+    List[str]
+        The file names (and not abs/rel paths).
+
+    Raises
+    ------
+    FileNotFoundError
+        If a file of `order` doesn't exist.
+    """
+    if order is None:
+        return sorted(SoundFilesUtils(user_path=in_dir).sfile_list, key=natural_key)
+
+    # A list file (relative to the input folder or to the working directory), or a comma-separated list
+    list_file = next((path for path in (os.path.join(in_dir, order), order) if os.path.isfile(path)), None)
+    if list_file is not None and not list_file.lower().endswith(tuple(AUDIO_FORMATS)):
+        with open(list_file, encoding='utf-8') as f:
+            sfiles = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    else:
+        sfiles = [sfile.strip() for sfile in order.split(',') if sfile.strip()]
+
+    missing = [sfile for sfile in sfiles if not os.path.isfile(os.path.join(in_dir, sfile))]
+    if missing:
+        raise FileNotFoundError(f"File(s) not found in '{in_dir}': {', '.join(missing)}")
+    return sfiles
+
+
+def _concat_format(path: str) -> Dict[str, Union[str, int]]:
+    """Get the format a file must share with the others to be joined without conversion (see `plan_concat_files()`)."""
+    try:
+        header = get_header_info(path)
+    except ValueError:
+        # Formats soundfile can't read (e.g. AAC)
+        info = get_audio_info(path)
+        header = {'format': info['codec_name'], 'subtype': info['bit_rate'],
+                  'sample_rate': info['sample_rate'], 'channels': info['channels']}
+    return {'format': header['format'], 'subtype': header['subtype'],
+            'sample_rate': int(header['sample_rate']), 'channels': int(header['channels'])}
+
+
+def _concat_part_task(input_file: str, part: str, *, ext: str, reference: Dict[str, Union[str, int]]) -> Task:
+    """Build the task that converts a file of `plan_concat_files()` to the format of the first file.
+
+    PCM files are converted by the native engine (which writes any PCM subtype to WAV, AIFF and FLAC),
+    other files by ffmpeg.
+
+    Raises
+    ------
+    ValueError
+        If the file can't be converted to the first file's format.
+    """
+    sfilename = os.path.basename(input_file)
+    header = _concat_format(input_file)
+    container = NATIVE_CONTAINERS.get(ext.lstrip('.'))
+    if container and header['format'] in NATIVE_INPUTS and str(header['subtype']).startswith(('PCM', 'FLOAT', 'DOUBLE')):
+        def transcode() -> str:
+            transcode_in_pool(input_file, part, sample_rate=reference['sample_rate'], subtype=reference['subtype'],
+                              container=container)
+            return 'native'
+
+        return Task([input_file], [part], action=transcode, method='native',
+                    message=f"'{sfilename}' converted to the format of the first file (native).")
+
+    # Encoder of the first file's format
+    args = codec_args(ext, reference['subtype'])
+    if args is None:
+        raise ValueError(f"'{sfilename}' can't be converted to the format of the first file ({reference['subtype']}{ext}).")
+
+    cmd = get_ffmpeg()['-i', input_file, '-y', '-vn', '-ar', str(reference['sample_rate'])][tuple(args)][part]
+    return Task([input_file], [part], cmd=cmd,
+                message=f"'{sfilename}' converted to the format of the first file.")
+
+
+def codec_args(ext: str, subtype: Optional[str]) -> Optional[List[str]]:
+    """Get the ffmpeg arguments that write a file with the extension `ext` and the soundfile `subtype` (e.g. 'PCM_24').
+
+    Returns
+    -------
+    List[str] or None
+        E.g. ['-c:a', 'pcm_s24le'], or None if the format has no known encoder.
+    """
+    codec = SF_SUBTYPE_CODECS.get(str(subtype))
+    if ext == '.wav' and codec:
+        return ['-c:a', codec]
+    if ext in ('.aiff', '.aif', '.aifc') and codec:
+        return ['-c:a', codec if codec == 'pcm_u8' else codec.replace('le', 'be')]
+    if ext == '.flac':
+        return ['-c:a', 'flac'] + (['-sample_fmt', 's32'] if subtype == 'PCM_24' else [])
+    if ext in CONCAT_ENCODERS:
+        return ['-c:a', CONCAT_ENCODERS[ext]]
+    return None
+
+
+def _concat_demuxer(parts: List[str], output_file: str, list_dir: str, *, codec_args: List[str]) -> str:
+    """Join files that have the same format with ffmpeg's concat demuxer and `codec_args` (see `plan_concat_files()`)."""
+    # The demuxer reads the files from a list, where quotes are escaped as '\''
+    os.makedirs(list_dir, exist_ok=True)
+    list_path = os.path.join(list_dir, 'concat.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for part in parts:
+            escaped = os.path.abspath(part).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    ffmpeg = get_ffmpeg()
+    cmd = ffmpeg['-f', 'concat', '-safe', '0', '-i', list_path, '-y', '-map', '0:a'][tuple(codec_args)][output_file]
+
+    task = Task(parts, [output_file], cmd=cmd)
+    task.stage_outputs({output_file: sum(os.path.getsize(part) for part in parts)})
+    try:
+        task.run()
+    except BaseException:
+        task.clean()
+        raise
+    return 'ffmpeg'
+
+
+# DOWNMIX FUNCTIONS
+def downmix_channels(inpt: Path, outpt: Optional[Path] = None, *, matrix: str = "loro", layout: Optional[str] = None,
+                     normalize: bool = False) -> Optional[Dict[str, Any]]:
+    """Mix a multi-channel file down to stereo (or any layout) through coefficient matrices.
+
+    Every matrix of `matrix` writes one file, '<name>.<matrix>.<ext>' (e.g. 'stem.loro.wav' with the
+    'downmix' layout, DL/DR), in one streaming pass over the input (see `pcm_engine.downmix()`).
+    The mix runs in the native engine's process pool, so batches use every core.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the multi-channel file (WAV, AIFF or FLAC).
+    outpt : Path, optional
+        The directory path where the downmixes will be saved (default is None, which uses the input's directory).
+    matrix : str, optional
+        The matrices to apply, separated by commas: names of `DOWNMIX_MATRICES` ('loro', 'ltrt') or
+        paths to JSON files with the same structure (default is "loro").
+    layout : str, optional
+        The layout of the file (a key of `CH_LAYOUT_COMP`) (default is None, which reads it from the
+        file's channel mask, or uses the default layout for its number of channels).
+    normalize : bool, optional
+        If True, each matrix is scaled down so that its outputs can't exceed full scale (default is False,
+        which clips the samples that do and reports how many there were).
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path.
+    ValueError
+        If the file can't be read by the native engine, its layout is unknown, or a matrix is unknown.
+
+    Returns
+    -------
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the downmix failed.
+        Matrices without coefficients for the file's layout are skipped. If none has any, nothing
+        is written and 'method' is 'skipped' (e.g. the stereo stems of a 5.1 delivery).
+
+    Example
+    -------
+    >>> downmix_channels(Path("path/to/stem_5.1.wav"), Path("path/to/output"), matrix="loro,ltrt")
+
+    After running the function, the output directory will contain "stem_5.1.loro.wav" and "stem_5.1.ltrt.wav".
+    """
+    try:
+        return run_tasks(plan_downmix_channels(inpt, outpt, matrix=matrix, layout=layout, normalize=normalize))
+    except Exception as e:
+        print(e)
+
+
+def plan_downmix_channels(inpt: Path, outpt: Optional[Path] = None, *, matrix: str = "loro",
+                          layout: Optional[str] = None, normalize: bool = False) -> List[Task]:
+    """Plan `downmix_channels()`: a single native task that writes every matrix's output.
+
+    The file's header, its layout and the matrices are checked while planning.
+
+    Parameters
+    ----------
+    inpt, outpt, matrix, layout, normalize
+        See `downmix_channels()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+    """
+    # Validate paths
+    try:
+        input_file, in_dir, out_dir = validate_paths(inpt, outpt)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    sfilename = os.path.basename(input_file)
+    base_name, ext = os.path.splitext(sfilename)
+
+    # The native engine reads the file
+    header = get_header_info(input_file)
+    if header['format'] not in NATIVE_INPUTS:
+        raise ValueError(f"'{sfilename}' can't be downmixed: {header['format']} files are not supported.")
+
+    # Layout of the file
+    source = LAYOUTS.get(layout) if layout else LAYOUTS.resolve(header['channels'], mask=lambda: read_wav_channel_mask(input_file))
+    if source is None:
+        raise ValueError(f"Invalid channel_layout '{layout or header['channels']}'")
+    if source.num_channels != header['channels']:
+        raise ValueError(f"'{sfilename}' has {header['channels']} channels, '{source.name}' has {source.num_channels}")
+
+    # Matrices without coefficients for the layout are skipped (e.g. for the stereo stems of a 5.1 delivery)
+    matrices = [m.strip() for m in str(matrix).split(',') if m.strip()]
+    if not matrices:
+        raise ValueError("No downmix matrix given.")
+    labels = {name: os.path.splitext(os.path.basename(name))[0] for name in matrices}
+    skipped = [labels[name] for name in matrices if source.name not in load_downmix_matrices(name)]
+    if len(skipped) == len(matrices):
+        return [Task([input_file], [], action=lambda: 'skipped', method='skipped', cleanup=[],
+                     message=f"'{sfilename}' ({source.name}) has no coefficients in {', '.join(skipped)}. Skipped.")]
+
+    # One output per matrix, in the input's container
+    out_ext = ext.lower() if ext.lower().lstrip('.') in NATIVE_CONTAINERS else '.wav'
+    outputs, names = [], []
+    for name in matrices:
+        if source.name not in load_downmix_matrices(name):
+            continue
+        channels, coefficients = downmix_matrix(name, source, normalize=normalize)
+        outputs.append((os.path.join(out_dir, f"{base_name}.{labels[name]}{out_ext}"), coefficients))
+        names.append(f"{labels[name]} ({'/'.join(channels)})")
+
+    def mix() -> str:
+        result = run_in_pool(downmix, input_file, outputs)
+        for (path, _), clipped in zip(outputs, result['clipped']):
+            if clipped:
+                print(f"Warning: {clipped} samples of '{os.path.basename(path)}' were clipped. Use --normalize to avoid it.")
+        return 'native'
+
+    message = f"'{sfilename}' ({source.name}) downmixed to {', '.join(names)}."
+    if skipped:
+        message += f" Skipped {', '.join(skipped)} (no coefficients for {source.name})."
+    return [Task([input_file], [path for path, _ in outputs], action=mix, method='native', message=message)]
+
+
+
+# NORMALIZE FUNCTIONS
+def normalize_loudness(inpt: Path, outpt: Optional[Path] = None, *, preset: str = "ebu",
+                       target: Optional[Union[str, float]] = None, true_peak: Optional[Union[str, float]] = None,
+                       tolerance: Optional[Union[str, float]] = None, dither: bool = False,
+                       no_cache: bool = False) -> Optional[Dict[str, Any]]:
+    """Normalize the loudness of an audio file to a delivery spec (EBU R128, ATSC A/85), in two passes.
+
+    1. Measure: integrated loudness, true peak and loudness range (see `analysis.measure_loudness()`).
+       Measurements are cached by content hash (see `analysis.get_loudness()`), so re-running on unchanged
+       files, or on re-delivered copies of them, skips this pass.
+    2. Apply: a single linear gain that brings the file to the target, as long as its true peak stays
+       at or below the limit. The gain is applied by ffmpeg's 'volume' filter, and the output keeps the
+       input's format (see `codec_args()`).
+
+    Files already within `tolerance` of the target (and under the true peak limit) are copied as they are.
+
+    Parameters
+    ----------
+    inpt : Path
+        The path to the audio file.
+    outpt : Path, optional
+        The directory path where the normalized file will be saved (default is None, which uses the input's directory).
+    preset : str, optional
+        The loudness spec, a key of `LOUDNESS_PRESETS`: 'ebu' (-23 LUFS, -1 dBTP) or 'atsc' (-24 LKFS, -2 dBTP)
+        (default is "ebu").
+    target : str or float, optional
+        The integrated loudness to reach, in LUFS (default is None, which uses the preset's).
+    true_peak : str or float, optional
+        The highest true peak allowed, in dBTP (default is None, which uses the preset's).
+    tolerance : str or float, optional
+        How far from the target (in LU) a file can be and be left unchanged (default is None, which uses the preset's).
+    dither : bool, optional
+        If True, TPDF dither is added when the scaled samples are rounded to the output's bit depth (default is False).
+    no_cache : bool, optional
+        If True, measure the file even if a cached measurement exists (default is False).
+
+    Raises
+    ------
+    OSError
+        If inpt or outpt is not a valid path.
+    ValueError
+        If the preset is unknown, a target is not a number, the file is silent, or its format can't be written.
+
+    Returns
+    -------
+    Dict[str, Any] or None
+        The result of `run_tasks()` ('outputs', 'method'), or None if the normalization failed.
+        'loudness' lists the measurement of the file ('integrated', 'true_peak', 'lra', 'threshold'),
+        with the 'gain' applied (dB) and whether the measurement was 'cached'.
+
+    Notes
+    -----
+    The gain stage doesn't limit: a file whose true peak would exceed the limit at the target loudness
+    is only raised up to the limit, and a warning gives the loudness it reaches instead.
+
+    Example
+    -------
+    >>> normalize_loudness(Path("path/to/mix.wav"), Path("path/to/output"), preset="atsc")
+
+    After running the function, the output directory will contain "mix.wav", at -24 LKFS.
+    """
+    try:
+        return run_tasks(plan_normalize_loudness(inpt, outpt, preset=preset, target=target, true_peak=true_peak,
+                                                 tolerance=tolerance, dither=dither, no_cache=no_cache))
+    except Exception as e:
+        print(e)
+
+
+def plan_normalize_loudness(inpt: Path, outpt: Optional[Path] = None, *, preset: str = "ebu",
+                            target: Optional[Union[str, float]] = None, true_peak: Optional[Union[str, float]] = None,
+                            tolerance: Optional[Union[str, float]] = None, dither: bool = False,
+                            no_cache: bool = False) -> List[Task]:
+    """Plan `normalize_loudness()`: a single task that measures the file (or reads its cached measurement) and applies the gain.
+
+    The targets and the file's format are checked while planning. The gain depends on the
+    measurement, so it is only known when the task runs.
+
+    Parameters
+    ----------
+    inpt, outpt, preset, target, true_peak, tolerance, dither, no_cache
+        See `normalize_loudness()`.
+
+    Returns
+    -------
+    List[Task]
+        The task to run.
+    """
+    # Validate paths
+    try:
+        input_file, in_dir, out_dir = validate_paths(inpt, outpt)
+    except OSError as e:
+        print("Error:", e)
+        raise
+
+    sfilename = os.path.basename(input_file)
+    ext = os.path.splitext(sfilename)[1].lower()
+    output_file = os.path.normpath(os.path.join(out_dir, sfilename))
+    if output_file == os.path.normpath(input_file):
+        raise ValueError(f"Output would overwrite '{sfilename}'. Choose another output folder.")
+
+    # Targets: the preset's, unless given
+    spec = LOUDNESS_PRESETS.get(str(preset).lower())
+    if spec is None:
+        raise ValueError(f"Invalid loudness preset '{preset}'. Use one of: {', '.join(LOUDNESS_PRESETS)}.")
+    try:
+        target = float(spec['integrated'] if target is None else target)
+        true_peak = float(spec['true_peak'] if true_peak is None else true_peak)
+        tolerance = float(spec['tolerance'] if tolerance is None else tolerance)
+    except ValueError:
+        raise ValueError("--target, --true_peak and --tolerance must be numbers (LUFS, dBTP and LU).")
+
+    # The output keeps the input's format
+    try:
+        subtype = get_header_info(input_file)['subtype']
+    except ValueError:
+        subtype = None
+    args = codec_args(ext, subtype)
+    if args is None:
+        raise ValueError(f"'{sfilename}' can't be normalized: {ext} files are not supported.")
+    if dither:
+        args += ['-dither_method', 'triangular']
+
+    measurements = []
+
+    def normalize() -> str:
+        # First pass, skipped if the file's measurement is cached
+        loudness, cached = get_loudness(input_file, use_cache=not no_cache)
+        integrated, peak = loudness['integrated'], loudness['true_peak']
+        if peak is None or integrated <= -70.0:
+            raise ValueError(f"'{sfilename}' is silent: it can't be normalized.")
+
+        # Gain to the target, limited by the true peak
+        gain = target - integrated
+        limited = peak + gain > true_peak
+        if limited:
+            gain = true_peak - peak
+        measurements.append({'file': sfilename, **loudness, 'gain': round(gain, 2), 'cached': cached})
+        print(f"'{sfilename}' measured{' (cached)' if cached else ''}: {integrated} LUFS, {peak} dBTP, "
+              f"LRA {loudness['lra']} LU.")
+        if limited:
+            print(f"Warning: '{sfilename}' is limited by its true peak and reaches {integrated + gain:.1f} LUFS "
+                  f"instead of {target:g}. It needs a limiter to reach the target.")
+
+        # Second pass: the gain stage
+        if abs(integrated - target) <= tolerance and peak <= true_peak:
+            method = fast_copy(input_file, output_file)
+            print(f"'{sfilename}' already meets {preset} ({target:g} LUFS, {true_peak:g} dBTP). Copied ({method}).")
+            measurements[-1]['gain'] = 0.0
+            return method
+        cmd = get_ffmpeg()['-i', input_file, '-y', '-vn', '-af', f"volume={gain:.2f}dB"][tuple(args)][output_file]
+        Task([input_file], [output_file], cmd=cmd).run()
+        print(f"'{sfilename}' normalized to {preset} ({gain:+.2f} dB).")
+
+    return [Task([input_file], [output_file], action=normalize, info={'loudness': measurements})]
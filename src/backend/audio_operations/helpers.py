@@ -1,7 +1,13 @@
+import ctypes
+import hashlib
 import json
 import os
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
 import platform
 import re
+import shutil
 import soundfile as sf      # needs pip install
 import sys
 from pathlib import Path
@@ -10,10 +16,33 @@ from typing import Optional, List, Dict, Tuple, Union
 # Custom modules
 from constants import (
     AUDIO_FORMATS,
+    VIDEO_FORMATS,
     CHANNEL_NAMES,
     SMPTE_ORDER,
-    CH_LAYOUT_COMP
+    SF_SUBTYPE_CODECS
 )
+from layouts import LAYOUTS
+from supervisor import run_supervised, PROBE_TIMEOUT
+
+# fcntl only exists on POSIX systems (used for reflinks)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl request number for cloning a file's extents (reflink)
+FICLONE = 0x40049409
+
+# Linux fallocate() mode that reserves blocks without changing the file's size
+FALLOC_FL_KEEP_SIZE = 0x01
+
+# Number of threads the current job may give to ffmpeg (set by scheduler.Scheduler, None = ffmpeg's default)
+FFMPEG_THREADS: ContextVar[Optional[int]] = ContextVar('FFMPEG_THREADS', default=None)
+
+# In-process cache of get_audio_info() results, keyed by file fingerprint (shared by all threads)
+PROBE_CACHE_SIZE = 4096
+_probe_cache: 'OrderedDict[str, Dict[str, Union[str, int]]]' = OrderedDict()
+_probe_lock = threading.Lock()
 
 
 # Class for analyzing dirs and getting info about the audio files included within
@@ -42,7 +71,8 @@ class SoundFilesUtils:
     dict_asf : Dict[str, Union[List[str], Dict[str, List[str]]]]
         Dictionary that maps audio file names to their file paths.
     sf_json : dict
-        JSON-ready dictionary representation of the class instance.
+        JSON-ready dictionary representation of the class instance (including the cached
+        waveform overviews, see `peaks.get_peaks()`).
 
     Examples
     --------
@@ -135,15 +165,22 @@ class SoundFilesUtils:
             if not os.path.isfile(self.user_path):
                 raise ValueError(f"'{self.user_path}' is not a valid path.")
         
-        # Get audio files only, using the AUDIO_FORMATS constant
+        # Get audio files only, using the AUDIO_FORMATS constant (hidden files, e.g. outputs still being written, are skipped)
         sfiles = [
-            file for file in self.file_list if file.lower().endswith(tuple(AUDIO_FORMATS))
+            file for file in self.file_list if file.lower().endswith(tuple(AUDIO_FORMATS)) and not file.startswith('.')
         ]
 
         if len(sfiles) == 0:
             return []
         return sfiles
 
+    @property
+    def video_list(self) -> List[str]:
+        """List[str]: Get the list of all supported VIDEO files in the directory (see `VIDEO_FORMATS`)."""
+        return [
+            file for file in self.file_list if file.lower().endswith(tuple(VIDEO_FORMATS)) and not file.startswith('.')
+        ]
+
 
     # FUNCTIONS
 
@@ -247,6 +284,28 @@ class SoundFilesUtils:
         """
         return {"multi": self.list_multisf, "mono": self.monodict}
 
+    def list_by_type(self, list_type: str = 'all') -> List[str]:
+        """Get the sound files an operation with the given `list_type` works on.
+
+        Parameters
+        ----------
+        list_type : str, optional
+            'multi' for multi-channel files, 'mono' for mono files, 'video' for video files,
+            anything else for all sound files (default is 'all').
+
+        Returns
+        -------
+        List[str]
+            The names of the files (and not abs/rel paths).
+        """
+        if list_type == 'multi':
+            return self.list_multisf
+        elif list_type == 'mono':
+            return self.list_monosf
+        elif list_type == 'video':
+            return self.video_list
+        return self.sfile_list
+
     def to_json(self):
         """Convert the SoundFilesUtils instance to a JSON-ready dictionary.
 
@@ -262,10 +321,26 @@ class SoundFilesUtils:
             "mono_sound_files": self.list_monosf,
             "multi_sound_files": self.list_multisf,
             "mono_dict": self.monodict,
-            "sound_files_dict": self.dict_asf
+            "sound_files_dict": self.dict_asf,
+            "peaks": self.get_peaks()
         }
         return data
 
+    def get_peaks(self) -> Dict[str, Optional[Dict[str, Union[str, int, list]]]]:
+        """Get the cached waveform overview of each sound file, without reading any audio.
+
+        Overviews are built by the passes that already read the audio (QC, dedupe, native convert
+        and downmix) or by `python peaks.py build`. See `peaks.get_peaks()`.
+
+        Returns
+        -------
+        Dict[str, Optional[Dict[str, Union[str, int, list]]]]
+            Maps each sound file name to the description of its peak file, or None if it has none yet.
+        """
+        from peaks import get_peaks  # Imported here to avoid an import cycle (peaks -> cache -> helpers)
+
+        return {sfile: get_peaks(os.path.join(self.user_dir, sfile), compute=False) for sfile in self.sfile_list}
+
     def __str__(self):
         """Convert the SoundFilesUtils instance to a formatted JSON string.
 
@@ -350,14 +425,56 @@ def get_bin_path(file: str = "ffmpeg") -> Path:
         raise OSError(f"Bin path does not exist in given dir. Cannot run {file} program.")
     
 
+# Get a plumbum command for ffmpeg (or ffprobe)
+def get_ffmpeg(file: str = "ffmpeg"):
+    """Get a plumbum command for the bundled or the locally installed ffmpeg/ffprobe.
+
+    Parameters
+    ----------
+    file : str, optional
+        The name of the executable (default is "ffmpeg").
+
+    Returns
+    -------
+    plumbum.commands.base.BaseCommand
+        The command, ready to be extended with arguments.
+
+    Raises
+    ------
+    OSError
+        If neither the bundled nor a local executable could be loaded.
+
+    Notes
+    -----
+    If `FFMPEG_THREADS` is set for the current job (see `scheduler.Scheduler`), ffmpeg commands
+    get '-threads' and '-filter_threads' so that concurrent jobs share the core budget
+    instead of each using every core.
+    """
+    try:
+        cmd = local[get_bin_path(file)]
+    except Exception:
+        try:
+            cmd = local[file]
+        except Exception:
+            raise OSError(f"{file} could not be loaded.")
+
+    threads = FFMPEG_THREADS.get()
+    if file == "ffmpeg" and threads:
+        cmd = cmd['-threads', str(threads), '-filter_threads', str(threads)]
+    return cmd
+
+
 # Get audio file's info
-def get_audio_info(file_path: str) -> Dict[str, Union[str, int]]:
+def get_audio_info(file_path: str, *, use_cache: bool = True) -> Dict[str, Union[str, int]]:
     """Get audio file information using 'ffprobe' or 'soundfile'.
 
     Parameters
     ----------
     file_path : str
         The path to the audio file.
+    use_cache : bool, optional
+        If True, return the cached result if the file hasn't changed since it was last probed
+        by this process (default is True).
 
     Returns
     -------
@@ -384,7 +501,8 @@ def get_audio_info(file_path: str) -> Dict[str, Union[str, int]]:
     If 'ffprobe' analysis fails, the function falls back to using 'soundfile' library. 
     The function returns a dictionary with audio information extracted from the chosen analysis method. 
     If the audio channel layout is not recognized, 
-    the function attempts to infer it based on the number of channels. 
+    the function attempts to infer it from the WAV channel mask, then from the number of channels
+    (see `layouts.LayoutRegistry.resolve()`). 
     If all attempts to gather information fail, 
     a ValueError is raised indicating possible file corruption.
     
@@ -403,15 +521,18 @@ def get_audio_info(file_path: str) -> Dict[str, Union[str, int]]:
         'sample_rate': 44100
     }
     """
+    # Return cached info if the file hasn't changed
+    fingerprint = file_fingerprint(file_path) if use_cache else None
+    if fingerprint is not None:
+        with _probe_lock:
+            if fingerprint in _probe_cache:
+                _probe_cache.move_to_end(fingerprint)
+                return dict(_probe_cache[fingerprint])
+
     # Try analyzing with 'ffprobe'
     try:
-        try:
-            # Try bin's ffprobe
-            ffprobe_path = get_bin_path(file="ffprobe")
-            ffprobe_cmd = local[ffprobe_path]
-        except Exception:
-            # Try local ffprobe
-            ffprobe_cmd = local['ffprobe']
+        # Try bin's ffprobe, then local ffprobe
+        ffprobe_cmd = get_ffmpeg("ffprobe")
 
         # ffprobe terminal command
         ffprobe_args = [
@@ -424,7 +545,8 @@ def get_audio_info(file_path: str) -> Dict[str, Union[str, int]]:
 
         # Try to parse data gathered
         try:
-            result = ffprobe_cmd[ffprobe_args]()
+            argv = [str(arg) for arg in ffprobe_cmd[ffprobe_args].formulate()]
+            result = run_supervised(argv, timeout=PROBE_TIMEOUT, capture=True)
             lines = result.splitlines()
 
             audio_info = {}
@@ -449,8 +571,8 @@ def get_audio_info(file_path: str) -> Dict[str, Union[str, int]]:
             except ValueError:
                 raise ValueError("Cannot read file info. 'channels' is not a valid integer value.")
 
-            # If audio_info['channels'] is not between 1 and 8
-            if not 0 < num_channels < 9:
+            # If audio_info['channels'] is not positive
+            if not num_channels > 0:
                 raise ValueError("Cannot read file info.")
         except Exception:
             raise OSError("Could not analyze with ffprobe.")
@@ -477,26 +599,99 @@ def get_audio_info(file_path: str) -> Dict[str, Union[str, int]]:
     ch_layout = audio_info['channel_layout']
     
     # Figure out channel_layout value, if current value is not correct
-    if any(ch_layout in layout for layout in CH_LAYOUT_COMP):
-        pass
-    else:
-        if num_channels == 1:
-            audio_info['channel_layout'] = 'mono'
-        elif num_channels == 2:
-            audio_info['channel_layout'] = 'stereo'
-        elif num_channels == 6:
-            audio_info['channel_layout'] = '5.1'
-        elif num_channels == 7:
-            audio_info['channel_layout'] = '7.0'
-        elif num_channels == 8:
-            audio_info['channel_layout'] = '7.1'
-        else:
-            raise ValueError("Invalid channel_layout")
+    # (reported name, then the WAV header's channel mask, then the default layout for the channel count)
+    layout = LAYOUTS.resolve(num_channels, name=ch_layout, mask=lambda: read_wav_channel_mask(file_path))
+    if layout is None:
+        raise ValueError("Invalid channel_layout")
+    audio_info['channel_layout'] = layout.name
         
-    # Return if no errors found
+    # Cache and return if no errors found
+    if fingerprint is not None:
+        with _probe_lock:
+            _probe_cache[fingerprint] = dict(audio_info)
+            while len(_probe_cache) > PROBE_CACHE_SIZE:
+                _probe_cache.popitem(last=False)
     return audio_info
 
 
+# Read the format of a file from its header only
+def get_header_info(file_path: str, *, use_cache: bool = True) -> Dict[str, Union[str, int]]:
+    """Get the sample format of an audio file from its header, with 'soundfile'.
+
+    Unlike `get_audio_info()`, no subprocess is started and the number of frames is included.
+    Results share the probe cache of `get_audio_info()`.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the audio file.
+    use_cache : bool, optional
+        If True, return the cached result if the file hasn't changed (default is True).
+
+    Returns
+    -------
+    Dict[str, Union[str, int]]
+        A dictionary with 'channels', 'sample_rate', 'frames', 'subtype' (e.g. 'PCM_24') and 'format' (e.g. 'WAV').
+
+    Raises
+    ------
+    ValueError
+        If the header can't be read.
+    """
+    fingerprint = file_fingerprint(file_path) if use_cache else None
+    key = f"header:{fingerprint}"
+    if fingerprint is not None:
+        with _probe_lock:
+            if key in _probe_cache:
+                _probe_cache.move_to_end(key)
+                return dict(_probe_cache[key])
+
+    try:
+        info = sf.info(file_path)
+    except Exception:
+        raise ValueError("Cannot read file header. File possibly corrupted.")
+    header = {
+        'channels': int(info.channels),
+        'sample_rate': int(info.samplerate),
+        'frames': int(info.frames),
+        'subtype': info.subtype,
+        'format': info.format,
+    }
+
+    if fingerprint is not None:
+        with _probe_lock:
+            _probe_cache[key] = dict(header)
+            while len(_probe_cache) > PROBE_CACHE_SIZE:
+                _probe_cache.popitem(last=False)
+    return header
+
+
+# Identify a version of a file without reading it
+def file_fingerprint(file_path: str) -> Optional[str]:
+    """Get a fingerprint that changes whenever the file is replaced or modified.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+
+    Returns
+    -------
+    str or None
+        A hex digest of the file's absolute path, size, and modification time, or None if the file can't be accessed.
+
+    Notes
+    -----
+    Only the file's metadata is read (`os.stat`), so this is cheap even for very large files.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
 # Validate in/out paths
 def validate_paths(input: str, out_dir: str = None, *, isdir: bool = False) -> Tuple[str, str, str]:
     """Validate input and output paths for files or directories.
@@ -612,6 +807,312 @@ def create_outfldr(suffix: str, *, prefix: str = "out_", out_dir: str) -> str:
     return os.path.abspath(folder_path)
 
 
+# Find the format chunk of a WAV file
+def find_wav_fmt_chunk(f) -> Optional[Tuple[int, bytes]]:
+    """Find the 'fmt ' chunk of an open WAV file (RIFF or RF64).
+
+    Only the chunk headers up to the 'fmt ' chunk are read.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The file, opened in binary mode.
+
+    Returns
+    -------
+    Tuple[int, bytes] or None
+        The offset of the chunk's data in the file and its first 40 bytes (all of a
+        WAVE_FORMAT_EXTENSIBLE 'fmt ' chunk), or None if the file is not a WAV file.
+    """
+    f.seek(0)
+    header = f.read(12)
+    if len(header) < 12 or header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+        return None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+        if chunk_id == b'fmt ':
+            offset = f.tell()
+            return offset, f.read(min(size, 40))
+        # Chunks are padded to an even size
+        f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+# Read the channel mask from a WAV file's header
+def read_wav_channel_mask(file_path: str) -> Optional[int]:
+    """Read the dwChannelMask of a WAVE_FORMAT_EXTENSIBLE file (RIFF or RF64).
+
+    Only the chunk headers up to the 'fmt ' chunk are read.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+
+    Returns
+    -------
+    int or None
+        The channel mask, or None if the file is not a WAVE_FORMAT_EXTENSIBLE file.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            found = find_wav_fmt_chunk(f)
+    except OSError:
+        return None
+    if found is None:
+        return None
+    fmt = found[1]
+    if len(fmt) < 24 or int.from_bytes(fmt[:2], 'little') != 0xFFFE:
+        return None
+    return int.from_bytes(fmt[20:24], 'little')
+
+
+# Patch the channel mask of a WAV file in place
+def write_wav_channel_mask(file_path: str, mask: int) -> int:
+    """Overwrite the dwChannelMask of a WAVE_FORMAT_EXTENSIBLE file, without touching the audio.
+
+    Only the 4 bytes of the mask are written, so this takes the same time for any file size.
+    In a WAV file the channel order is the order of the mask's bits, so the mask is all
+    there is to change.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+    mask : int
+        The new channel mask. It must have one bit per channel of the file.
+
+    Returns
+    -------
+    int
+        The previous channel mask.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a WAVE_FORMAT_EXTENSIBLE file, or the mask doesn't match its number of channels.
+    """
+    with open(file_path, 'r+b') as f:
+        found = find_wav_fmt_chunk(f)
+        if found is None or len(found[1]) < 24 or int.from_bytes(found[1][:2], 'little') != 0xFFFE:
+            raise ValueError(f"'{os.path.basename(file_path)}' is not a WAVE_FORMAT_EXTENSIBLE file")
+        offset, fmt = found
+        num_channels = int.from_bytes(fmt[2:4], 'little')
+        if bin(mask).count('1') != num_channels:
+            raise ValueError(f"Channel mask {mask:#x} doesn't match the {num_channels} channels "
+                             f"of '{os.path.basename(file_path)}'")
+
+        f.seek(offset + 20)
+        f.write(int(mask).to_bytes(4, 'little'))
+        f.flush()
+        os.fsync(f.fileno())
+    return int.from_bytes(fmt[20:24], 'little')
+
+
+# Find the format and audio data of a WAV file
+def find_wav_chunks(f) -> Optional[Dict[str, Tuple[int, int]]]:
+    """Find the 'fmt ' and 'data' chunks of an open WAV file (RIFF or RF64).
+
+    Only the chunk headers are read. The sizes of RF64 files are read from their 'ds64' chunk,
+    and a data size that runs past the end of the file (e.g. a file still being written) is cut to the file.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The file, opened in binary mode.
+
+    Returns
+    -------
+    Dict[str, Tuple[int, int]] or None
+        The offset and size of the 'fmt ' and 'data' chunks' contents, or None if the file is
+        not a WAV file or one of the chunks is missing.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(0)
+    header = f.read(12)
+    if len(header) < 12 or header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+        return None
+    chunks, data_size64 = {}, None
+    while 'data' not in chunks:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = chunk[:4].decode('latin-1'), int.from_bytes(chunk[4:], 'little')
+        offset = f.tell()
+        if chunk_id == 'ds64':
+            data_size64 = int.from_bytes(f.read(16)[8:16], 'little')
+        elif chunk_id == 'data':
+            if header[:4] == b'RF64' and size == 0xFFFFFFFF and data_size64 is not None:
+                size = data_size64
+            size = min(size, file_size - offset)
+        chunks.setdefault(chunk_id, (offset, size))
+        # Chunks are padded to an even size
+        f.seek(offset + size + (size & 1))
+    if 'fmt ' not in chunks:
+        return None
+    return {'fmt ': chunks['fmt '], 'data': chunks['data']}
+
+
+# Join the audio of WAV files that have the same sample format
+def concat_wav(parts: List[str], output: str, *, chunk_size: int = 64 * 1024 * 1024) -> str:
+    """Write a WAV file with the audio of `parts`, one after the other, without decoding it.
+
+    The header (the 'fmt ' chunk of the first part) is written once, then the 'data' chunk of
+    every part is appended with `os.copy_file_range` (in-kernel) or a buffered copy, so joining
+    costs one sequential read and write. The output is an RF64 file if it is larger than 4 GB.
+    Other chunks of the parts (e.g. 'LIST', 'bext') are not copied.
+
+    The output is written under its `staging_path()` and renamed into place when complete.
+    The copy stops when the current run is cancelled (see `cancellation.CancelToken`).
+
+    Parameters
+    ----------
+    parts : List[str]
+        The paths to the WAV files, in order. They must all have the sample format of the first one.
+    output : str
+        The path to the output file. It will be overwritten if it exists.
+    chunk_size : int, optional
+        The number of bytes copied between cancellation checks (default is 64 MiB).
+
+    Returns
+    -------
+    str
+        The copy method used: 'copy_file_range' or 'copy'.
+
+    Raises
+    ------
+    ValueError
+        If a part is not a WAV file, or its sample format differs from the first part's.
+    cancellation.CancelledError
+        If the run was cancelled (the partial output is deleted).
+    """
+    from cancellation import current_token
+
+    # Locate the audio data of every part
+    spans, fmt = [], None
+    for part in parts:
+        with open(part, 'rb') as f:
+            chunks = find_wav_chunks(f)
+            if chunks is None:
+                raise ValueError(f"'{os.path.basename(part)}' is not a WAV file")
+            fmt_offset, fmt_size = chunks['fmt ']
+            f.seek(fmt_offset)
+            part_fmt = f.read(fmt_size)
+        # Format tag (or sub-format), channels, sample rate and block align must match
+        if fmt is None:
+            fmt = part_fmt
+        elif _wav_sample_format(part_fmt) != _wav_sample_format(fmt):
+            raise ValueError(f"'{os.path.basename(part)}' doesn't have the sample format of '{os.path.basename(parts[0])}'")
+        spans.append((part, *chunks['data']))
+
+    data_size = sum(size for _, _, size in spans)
+    pad = data_size & 1
+    header = wav_header(fmt, data_size)
+
+    cancel = current_token()
+    temp_path = staging_path(output)
+    method = 'copy_file_range' if hasattr(os, 'copy_file_range') else 'copy'
+    try:
+        # Reserve the output's space up front, so that it is written as one contiguous extent
+        preallocate(temp_path, len(header) + data_size + pad)
+        with open(temp_path, 'r+b', buffering=0) as fdst:
+            fdst.write(header)
+            position = len(header)
+            for part, offset, size in spans:
+                with open(part, 'rb', buffering=0) as fsrc:
+                    done = 0
+                    while done < size:
+                        if cancel is not None:
+                            cancel.check()
+                        count = min(chunk_size, size - done)
+
+                        # In-kernel copy, or a plain copy if the filesystem doesn't support it
+                        copied = 0
+                        if method == 'copy_file_range':
+                            try:
+                                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, offset + done, position)
+                            except OSError:
+                                pass
+                            if copied == 0:
+                                method = 'copy'
+                        if method == 'copy':
+                            fsrc.seek(offset + done)
+                            data = fsrc.read(count)
+                            if not data:
+                                raise ValueError(f"'{os.path.basename(part)}' is shorter than its header says")
+                            fdst.seek(position)
+                            view = memoryview(data)
+                            while view:
+                                view = view[fdst.write(view):]
+                            copied = len(data)
+                        done += copied
+                        position += copied
+            fdst.seek(position)
+            fdst.write(b'\0' * pad)
+        os.replace(temp_path, output)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+    return method
+
+
+def wav_header(fmt: bytes, data_size: int) -> bytes:
+    """Build the header of a WAV file, up to the start of its audio data.
+
+    The header is RIFF, or RF64 with a 'ds64' chunk if the sizes don't fit in 32 bits.
+
+    Parameters
+    ----------
+    fmt : bytes
+        The contents of the 'fmt ' chunk (see `wav_fmt()`).
+    data_size : int
+        The size of the audio data in bytes (the data is padded to an even size after it).
+    """
+    pad = data_size & 1
+    fmt_chunk = b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt + b'\0' * (len(fmt) & 1)
+    riff_size = 4 + len(fmt_chunk) + 8 + data_size + pad
+    if riff_size <= 0xFFFFFFFF:
+        header = b'RIFF' + riff_size.to_bytes(4, 'little') + b'WAVE' + fmt_chunk
+        return header + b'data' + data_size.to_bytes(4, 'little')
+    riff_size += 8 + 28
+    frames = data_size // max(1, int.from_bytes(fmt[12:14], 'little'))
+    ds64 = riff_size.to_bytes(8, 'little') + data_size.to_bytes(8, 'little') + frames.to_bytes(8, 'little') + bytes(4)
+    header = b'RF64' + b'\xff' * 4 + b'WAVE' + b'ds64' + len(ds64).to_bytes(4, 'little') + ds64 + fmt_chunk
+    return header + b'data' + b'\xff' * 4
+
+
+def wav_fmt(channels: int, sample_rate: int, bits: int, *, floating: bool = False) -> bytes:
+    """Build the contents of a plain 'fmt ' chunk (WAVE_FORMAT_PCM, or WAVE_FORMAT_IEEE_FLOAT if `floating`)."""
+    block_align = channels * bits // 8
+    return ((3 if floating else 1).to_bytes(2, 'little') + channels.to_bytes(2, 'little')
+            + sample_rate.to_bytes(4, 'little') + (sample_rate * block_align).to_bytes(4, 'little')
+            + block_align.to_bytes(2, 'little') + bits.to_bytes(2, 'little'))
+
+
+def _wav_sample_format(fmt: bytes) -> Tuple[int, int, int, int]:
+    """Get the (format tag, channels, sample rate, block align) of a 'fmt ' chunk, using the sub-format of WAVE_FORMAT_EXTENSIBLE."""
+    tag = int.from_bytes(fmt[:2], 'little')
+    if tag == 0xFFFE and len(fmt) >= 26:
+        tag = int.from_bytes(fmt[24:26], 'little')
+    return tag, int.from_bytes(fmt[2:4], 'little'), int.from_bytes(fmt[4:8], 'little'), int.from_bytes(fmt[12:14], 'little')
+
+
+# Key for sorting file names the way people number them ('reel2' before 'reel10')
+def natural_key(filename: str) -> List[Union[int, str]]:
+    """Key function that sorts the numbers in file names by value, case-insensitively.
+
+    Example
+    -------
+    >>> sorted(['reel10.wav', 'Reel2.wav', 'reel1.wav'], key=natural_key)
+    ['reel1.wav', 'Reel2.wav', 'reel10.wav']
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', filename)]
+
+
 # Key for sorted() function based on SMPTE_ORDER
 def smpte_order_key(sfilename, *, smpte=SMPTE_ORDER):
     """NEEDS FIXING!!! Key function for sorting sound files based on SMPTE order.
@@ -648,4 +1149,213 @@ def smpte_order_key(sfilename, *, smpte=SMPTE_ORDER):
             pattern = rf"\b{ch_ext}\.wav$"
             if re.search(pattern, sfilename):
                 return int(order)
-    return float('inf')
\ No newline at end of file
+    return float('inf')
+
+# Check if a conversion would leave the audio untouched
+def is_passthrough(audio_info: Dict[str, Union[str, int]], ext: str, *,
+                   conversion: str = "wav", sample_rate: str = "48000",
+                   bit_rate: str = "pcm_s24le") -> bool:
+    """Check if converting a file with the given properties would be a no-op.
+
+    Parameters
+    ----------
+    audio_info : Dict[str, Union[str, int]]
+        The dictionary returned by `get_audio_info()` for the input file.
+    ext : str
+        The extension of the input file (e.g. '.wav').
+    conversion : str, optional
+        The target audio format (default is "wav").
+    sample_rate : str, optional
+        The target sample rate (default is "48000").
+    bit_rate : str, optional
+        The target audio codec (default is "pcm_s24le").
+
+    Returns
+    -------
+    bool
+        True if the input already has the target format, codec and sample rate.
+
+    Notes
+    -----
+    When `get_audio_info()` falls back to 'soundfile', the codec is reported as a
+    soundfile subtype (e.g. 'PCM_24'). `SF_SUBTYPE_CODECS` maps it back to the ffmpeg codec name.
+    """
+    # Container must match
+    if ext.lower().lstrip('.') != conversion.lower():
+        return False
+
+    # Codec must match (ffprobe reports 'codec_name', soundfile reports subtype in 'bit_rate')
+    codec = str(audio_info.get('codec_name', ''))
+    if codec != bit_rate and SF_SUBTYPE_CODECS.get(str(audio_info.get('bit_rate', ''))) != bit_rate:
+        return False
+
+    # Sample rate must match
+    try:
+        return int(audio_info['sample_rate']) == int(sample_rate)
+    except (KeyError, ValueError):
+        return False
+
+
+# Materialise a copy of a file as cheaply as the filesystem allows
+def fast_copy(src: str, dst: str, *, link: bool = False) -> str:
+    """Copy a file using the cheapest method the filesystem supports.
+
+    The methods are tried in the following order:
+
+    1. Hardlink (only if `link` is True).
+    2. Reflink (`FICLONE` ioctl - Btrfs, XFS, etc.), which shares the data blocks copy-on-write.
+    3. `os.copy_file_range`, which copies in-kernel without passing data through user space.
+    4. A plain buffered copy.
+
+    Parameters
+    ----------
+    src : str
+        The path to the source file.
+    dst : str
+        The path to the destination file. It will be overwritten if it exists.
+    link : bool, optional
+        If True, try to hardlink `dst` to `src` first (default is False).
+        .. note:: A hardlink shares the inode, so editing one file in place changes the other.
+
+    Returns
+    -------
+    str
+        The method used: 'hardlink', 'reflink', 'copy_file_range' or 'copy'.
+    """
+    # Remove existing destination (os.link fails otherwise)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    # 1. Hardlink
+    if link:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        # 2. Reflink
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+
+        # 3. In-kernel copy
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return 'copy_file_range'
+            except OSError:
+                pass
+            # Start over with a plain copy
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+        # 4. Plain copy
+        shutil.copyfileobj(fsrc, fdst, length=8 * 1024 * 1024)
+        return 'copy'
+
+
+# Get the hidden name an output is written under until it is complete
+def staging_path(path: str) -> str:
+    """Get the temporary path an output is written to before it is renamed into place.
+
+    The name starts with a dot (hidden from watch folders and `SoundFilesUtils`) and keeps the
+    extension, so that ffmpeg still picks the right format.
+
+    Example
+    -------
+    >>> staging_path('/out/track/track.L.wav')
+    '/out/track/.track.L.partial.wav'
+    """
+    folder, filename = os.path.split(path)
+    base_name, ext = os.path.splitext(filename)
+    return os.path.join(folder, f".{base_name}.partial{ext}")
+
+
+# Reserve contiguous disk space for a file that is about to be written
+def preallocate(path: str, size: int) -> bool:
+    """Create an empty file and reserve `size` bytes of disk space for it.
+
+    The space is reserved with Linux `fallocate(FALLOC_FL_KEEP_SIZE)`: the file's size stays 0,
+    so a writer that appends to it (e.g. ffmpeg with '-truncate 0') fills the reserved extents
+    sequentially instead of interleaving its blocks with other files written at the same time.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file. It will be overwritten if it exists.
+    size : int
+        The number of bytes to reserve.
+
+    Returns
+    -------
+    bool
+        True if the space was reserved, False if the platform or filesystem doesn't support it
+        (the empty file is created anyway).
+    """
+    if os.path.lexists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
+    try:
+        if not sys.platform.startswith('linux') or size <= 0:
+            return False
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+        return libc.fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, int(size)) == 0
+    except (OSError, AttributeError):
+        return False
+    finally:
+        os.close(fd)
+
+
+# Parse optional '--key=value' command-line arguments
+def parse_options(args: List[str]) -> Dict[str, Union[str, bool]]:
+    """Parse optional command-line arguments into keyword arguments.
+
+    Parameters
+    ----------
+    args : List[str]
+        Arguments of the form '--key=value' or '--flag'.
+
+    Returns
+    -------
+    Dict[str, Union[str, bool]]
+        A dictionary of keyword arguments. Dashes in keys are replaced with underscores,
+        bare flags and 'true'/'false' values become booleans.
+
+    Raises
+    ------
+    ValueError
+        If an argument does not start with '--'.
+
+    Example
+    -------
+    >>> parse_options(['--link', '--sample-rate=44100'])
+    {'link': True, 'sample_rate': '44100'}
+    """
+    options = {}
+    for arg in args:
+        if not arg.startswith('--') or len(arg) == 2:
+            raise ValueError(f"Invalid option '{arg}'. Options must look like '--key=value' or '--flag'.")
+
+        key, sep, value = arg[2:].partition('=')
+        key = key.replace('-', '_')
+
+        if not sep:
+            options[key] = True
+        elif value.lower() in ('true', 'false'):
+            options[key] = value.lower() == 'true'
+        else:
+            options[key] = value
+    return options
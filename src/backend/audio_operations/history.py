@@ -0,0 +1,544 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from cache import get_cache_dir
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, List, Dict, Tuple, Union
+
+
+# Bump when the table changes (stored in the database's 'user_version')
+HISTORY_VERSION = 1
+
+# Environment variable that turns recording on for every run (set to a database path, or to '1' for the default one)
+HISTORY_ENV = "AUDIO_OPERATIONS_HISTORY"
+
+# Runs compared on each side by `trend()`, and the slowdown reported as a regression
+TREND_WINDOW = 5
+REGRESSION_THRESHOLD = 0.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    operation TEXT NOT NULL,
+    host TEXT NOT NULL,
+    ffmpeg TEXT,
+    files INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    input_bytes INTEGER NOT NULL,
+    output_bytes INTEGER NOT NULL,
+    elapsed REAL NOT NULL,
+    task_seconds REAL NOT NULL,
+    realtime_factor REAL,
+    failed INTEGER NOT NULL,
+    stages TEXT NOT NULL,
+    failures TEXT NOT NULL,
+    options TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_operation ON runs (operation, host, started);
+"""
+
+# The run being recorded in the current context (set by `recording()`)
+_current_record: ContextVar[Optional['RunRecord']] = ContextVar('_current_record', default=None)
+
+
+# Get the default path of the history database
+def get_history_path() -> str:
+    """Get the default path of the run history ('<cache_dir>/history/runs.sqlite')."""
+    return os.path.join(get_cache_dir(), "history", "runs.sqlite")
+
+
+# Resolve the '--history' option
+def resolve_history_path(value: Union[str, bool, None] = None) -> Optional[str]:
+    """Get the database a run should be recorded in.
+
+    Parameters
+    ----------
+    value : str or bool, optional
+        The '--history' option: a database path, True for the default path, or None/False to
+        fall back on the `AUDIO_OPERATIONS_HISTORY` environment variable (default is None).
+
+    Returns
+    -------
+    str or None
+        The database path, or None if the run should not be recorded.
+    """
+    if not value:
+        value = os.environ.get(HISTORY_ENV)
+        if not value or value == '0':
+            return None
+    if value is True or value == '1':
+        return get_history_path()
+    return os.path.abspath(value)
+
+
+class RunRecord:
+    """The measurements of one run of an operation, as stored in the history.
+
+    Attributes
+    ----------
+    operation : str
+        The operation (a key of `audio_operations.FUNC_TYPE`).
+    host : str
+        The name of the machine that ran it.
+    ffmpeg : str or None
+        The ffmpeg version, e.g. '7.0.2-static'.
+    started : float
+        The time the run started (`time.time()`).
+    files : int
+        The number of input files.
+    duration : float
+        The audio duration of all the input files added together, in seconds (0 for files without an audio header).
+    input_bytes, output_bytes : int
+        The size of the inputs, and of everything written to the output folder.
+    elapsed : float
+        Wall-clock time of the run, in seconds.
+    task_seconds : float
+        Time spent in the operation, added up over concurrent jobs (equals the 'process' stage for serial runs).
+    stages : Dict[str, float]
+        Wall-clock time of each stage of the run (e.g. 'setup', 'list', 'process'), in seconds.
+    failures : Dict[str, str]
+        Maps each failed input file to the reason it failed (see `supervisor.SupervisorError`).
+    options : Dict[str, Any]
+        The options of the operation.
+    """
+
+    def __init__(self, operation: str, *, options: Optional[Dict[str, Any]] = None) -> None:
+        self.operation = operation
+        self.host = socket.gethostname()
+        self.ffmpeg = None
+        self.started = time.time()
+        self.files = 0
+        self.duration = 0.0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.elapsed = 0.0
+        self.task_seconds = 0.0
+        self.stages = {}
+        self.failures = {}
+        self.options = dict(options or {})
+
+    @property
+    def realtime_factor(self) -> Optional[float]:
+        """float or None: Seconds of audio processed per second of run time (None if unknown)."""
+        if not self.duration or not self.elapsed:
+            return None
+        return self.duration / self.elapsed
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Add time to a stage (stages that run several times are added up)."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def measure_inputs(self, paths: List[str]) -> None:
+        """Set `files`, `duration` and `input_bytes` from the input files' headers and sizes."""
+        from helpers import get_header_info
+
+        self.files = len(paths)
+        for path in paths:
+            try:
+                self.input_bytes += os.path.getsize(path)
+            except OSError:
+                continue
+            try:
+                header = get_header_info(path)
+                self.duration += header['frames'] / header['sample_rate']
+            except (ValueError, KeyError, ZeroDivisionError):
+                pass
+
+    def measure_outputs(self, out_dir: Optional[Path]) -> None:
+        """Set `output_bytes` from the files in the output folder."""
+        self.output_bytes = 0
+        if not out_dir or not os.path.isdir(out_dir):
+            return
+        for root, _, names in os.walk(out_dir):
+            for name in names:
+                try:
+                    self.output_bytes += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the record to a JSON-ready dictionary (the columns of the 'runs' table)."""
+        return {
+            "started": self.started,
+            "operation": self.operation,
+            "host": self.host,
+            "ffmpeg": self.ffmpeg,
+            "files": self.files,
+            "duration": self.duration,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+            "elapsed": self.elapsed,
+            "task_seconds": self.task_seconds,
+            "realtime_factor": self.realtime_factor,
+            "failed": len(self.failures),
+            "stages": self.stages,
+            "failures": self.failures,
+            "options": self.options,
+        }
+
+    def __repr__(self) -> str:
+        return f"RunRecord({self.operation!r}, {self.files} file(s), {self.elapsed:.2f}s)"
+
+
+# Get the ffmpeg version, to tell builds apart in the history
+def ffmpeg_version() -> Optional[str]:
+    """Get the version of the ffmpeg that operations run (e.g. '7.0.2-static'), or None."""
+    from helpers import get_ffmpeg
+
+    try:
+        first_line = get_ffmpeg()['-version']().splitlines()[0]
+    except Exception:
+        return None
+    parts = first_line.split()
+    return parts[2] if len(parts) > 2 and parts[:2] == ['ffmpeg', 'version'] else first_line
+
+
+# Record a run in the current context
+@contextmanager
+def recording(operation: str, *, options: Optional[Dict[str, Any]] = None) -> Iterator[RunRecord]:
+    """Make a new `RunRecord` the current record while the block runs, and time the block.
+
+    `stage()` and `current_record()` use the current record, so code deep inside an operation
+    can add its timings without being passed the record.
+
+    Examples
+    --------
+    >>> with recording('split') as record:
+    ...     with stage('process'):
+    ...         ...
+    >>> save_run(record)
+    """
+    record = RunRecord(operation, options=options)
+    token = _current_record.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.elapsed = time.perf_counter() - start
+        _current_record.reset(token)
+
+
+def current_record() -> Optional[RunRecord]:
+    """Get the run being recorded in the current context, or None."""
+    return _current_record.get()
+
+
+# Time a stage of the current run
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Add the time the block takes to a stage of the current run (does nothing if no run is recorded)."""
+    record = _current_record.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record.add_stage(name, time.perf_counter() - start)
+
+
+# Add the outcome of an operation function to the current run
+def record_result(label: str, result: Any = None, error: Optional[Exception] = None) -> None:
+    """Add the failures of an operation's result, or the exception it raised, to the current run.
+
+    Parameters
+    ----------
+    label : str
+        The name of the input (used if the whole call failed).
+    result : Any, optional
+        The value returned by the operation function. Its 'failures' (see `tasks.run_tasks()`) are added.
+        None means the call failed (operation functions print their errors and return None).
+    error : Exception, optional
+        The exception raised by the operation function. Its 'reason' is added (or 'error').
+    """
+    record = _current_record.get()
+    if record is None:
+        return
+    if error is not None:
+        record.failures[label] = getattr(error, 'reason', 'error')
+    elif result is None:
+        record.failures[label] = 'error'
+    elif isinstance(result, dict):
+        record.failures.update(result.get('failures') or {})
+
+
+# DATABASE
+
+def connect(db_path: Optional[Path] = None) -> sqlite3.Connection:
+    """Open the history database, creating it if needed.
+
+    Parameters
+    ----------
+    db_path : Path, optional
+        The path to the database (default is None, which uses `get_history_path()`).
+
+    Returns
+    -------
+    sqlite3.Connection
+        The connection. Rows can be read by column name.
+    """
+    db_path = db_path or get_history_path()
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    conn.execute(f"PRAGMA user_version = {HISTORY_VERSION}")
+    return conn
+
+
+def save_run(record: RunRecord, db_path: Optional[Path] = None) -> int:
+    """Append a run to the history.
+
+    Parameters
+    ----------
+    record : RunRecord
+        The run to save.
+    db_path : Path, optional
+        The path to the database (default is None, which uses `get_history_path()`).
+
+    Returns
+    -------
+    int
+        The id of the new row.
+    """
+    row = record.to_json()
+    for key in ('stages', 'failures', 'options'):
+        row[key] = json.dumps(row[key], sort_keys=True, default=str)
+    columns = ', '.join(row)
+    placeholders = ', '.join(f":{key}" for key in row)
+    conn = connect(db_path)
+    try:
+        with conn:
+            return conn.execute(f"INSERT INTO runs ({columns}) VALUES ({placeholders})", row).lastrowid
+    finally:
+        conn.close()
+
+
+def query_runs(db_path: Optional[Path] = None, *, operation: Optional[str] = None, host: Optional[str] = None,
+               since: Optional[float] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get past runs, newest first.
+
+    Parameters
+    ----------
+    db_path : Path, optional
+        The path to the database (default is None, which uses `get_history_path()`).
+    operation, host : str, optional
+        Only get the runs of this operation / machine (default is None, which gets all of them).
+    since : float, optional
+        Only get the runs started after this time (`time.time()`) (default is None).
+    limit : int, optional
+        The maximum number of runs (default is None, which gets all of them).
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The runs, with the keys of `RunRecord.to_json()` and their 'id'.
+    """
+    where, params = [], []
+    for column, value in (('operation', operation), ('host', host)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("started >= ?")
+        params.append(since)
+
+    sql = "SELECT * FROM runs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY started DESC, id DESC"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+
+    conn = connect(db_path)
+    try:
+        rows = [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+    for row in rows:
+        for key in ('stages', 'failures', 'options'):
+            row[key] = json.loads(row[key])
+    return rows
+
+
+# Compare recent runs with the runs before them
+def trend(db_path: Optional[Path] = None, *, operation: Optional[str] = None, host: Optional[str] = None,
+          window: int = TREND_WINDOW, threshold: float = REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+    """Compare the throughput of the latest runs of each operation with the runs before them.
+
+    Throughput is input bytes per second of `task_seconds`, so that runs with a different
+    number of concurrent jobs can be compared. Runs where every file failed are ignored.
+
+    Parameters
+    ----------
+    db_path : Path, optional
+        The path to the database (default is None, which uses `get_history_path()`).
+    operation, host : str, optional
+        Only compare the runs of this operation / machine (default is None, which compares all of them).
+    window : int, optional
+        The number of runs on each side of the comparison (default is `TREND_WINDOW`).
+    threshold : float, optional
+        The slowdown reported as a regression, e.g. 0.2 for 20% (default is `REGRESSION_THRESHOLD`).
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One dictionary per operation and host, with 'operation', 'host', 'runs', 'recent' and 'previous'
+        (median bytes per second, None if there are no runs), 'change' (recent / previous - 1),
+        'ffmpeg' (the versions of each side) and 'regression' (True if `change` <= -`threshold`).
+    """
+    groups = {}
+    for run in query_runs(db_path, operation=operation, host=host):
+        if run['task_seconds'] > 0 and run['input_bytes'] > 0 and run['failed'] < run['files']:
+            groups.setdefault((run['operation'], run['host']), []).append(run)
+
+    def median(values):
+        values = sorted(values)
+        if not values:
+            return None
+        mid = len(values) // 2
+        return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+    report = []
+    for (op, run_host), runs in sorted(groups.items()):
+        recent, previous = runs[:window], runs[window:2 * window]
+        recent_rate = median([run['input_bytes'] / run['task_seconds'] for run in recent])
+        previous_rate = median([run['input_bytes'] / run['task_seconds'] for run in previous])
+        change = recent_rate / previous_rate - 1 if previous_rate else None
+        report.append({
+            'operation': op,
+            'host': run_host,
+            'runs': len(runs),
+            'recent': recent_rate,
+            'previous': previous_rate,
+            'change': change,
+            'ffmpeg': {
+                'recent': sorted({run['ffmpeg'] or '?' for run in recent}),
+                'previous': sorted({run['ffmpeg'] or '?' for run in previous}),
+            },
+            'regression': change is not None and change <= -threshold,
+        })
+    return report
+
+
+# Fit the planner's throughput model from past runs
+def fit_throughput(db_path: Optional[Path] = None, *, operations: Optional[List[str]] = None,
+                   host: Optional[str] = None, limit: int = 50) -> Dict[str, Dict[str, float]]:
+    """Fit `seconds = overhead + input_bytes / bytes_per_second` per task from past runs.
+
+    Each run gives one equation: `task_seconds = files * overhead + input_bytes / bytes_per_second`,
+    solved by least squares over the latest `limit` runs of each operation. If the runs can't
+    separate the two terms (e.g. they all have the same file size), the overhead is set to 0.
+
+    Parameters
+    ----------
+    db_path : Path, optional
+        The path to the database (default is None, which uses `get_history_path()`).
+    operations : List[str], optional
+        The operations to fit (default is None, which fits every operation in the history).
+    host : str, optional
+        Only use the runs of this machine (default is None, which uses the current machine).
+    limit : int, optional
+        The number of runs used per operation (default is 50).
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        Maps each operation with usable runs to its 'bytes_per_second' and 'overhead'.
+    """
+    import numpy as np      # needs pip install (installed with soundfile)
+
+    host = host or socket.gethostname()
+    runs = [run for run in query_runs(db_path, host=host)
+            if run['task_seconds'] > 0 and run['input_bytes'] > 0 and not run['failed']]
+    operations = operations or sorted({run['operation'] for run in runs})
+
+    fitted = {}
+    for op in operations:
+        op_runs = [run for run in runs if run['operation'] == op][:limit]
+        if not op_runs:
+            continue
+        a = np.array([[run['files'], run['input_bytes']] for run in op_runs], dtype=float)
+        b = np.array([run['task_seconds'] for run in op_runs])
+        (overhead, seconds_per_byte), *_ = np.linalg.lstsq(a, b, rcond=None)
+        if overhead < 0 or seconds_per_byte <= 0:
+            overhead, seconds_per_byte = 0.0, b.sum() / a[:, 1].sum()
+        fitted[op] = {'bytes_per_second': round(1 / seconds_per_byte), 'overhead': round(float(overhead), 3)}
+    return fitted
+
+
+# COMMAND LINE
+
+def _format_rate(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value / 1e6:.1f} MB/s"
+
+
+def main() -> None:
+    """Command-line interface of the run history.
+
+    Runs are recorded with `python audio_operations.py [in] [out] [operation] --history[=runs.sqlite]`,
+    or for every run by setting the `AUDIO_OPERATIONS_HISTORY` environment variable.
+
+    Usage:
+    python history.py list [--op split] [--host name] [--days 30] [--limit 20] [--json]
+    python history.py trend [--op split] [--host name] [--window 5] [--threshold 0.2]
+    """
+    parser = argparse.ArgumentParser(description="Query the history of past runs.")
+    parser.add_argument('--db', help="The history database (default: the AUDIO_OPERATIONS_HISTORY path, or the cache folder's).")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    show = commands.add_parser('list', help="List past runs, newest first.")
+    show.add_argument('--op')
+    show.add_argument('--host')
+    show.add_argument('--days', type=float, help="Only list the runs of the last N days.")
+    show.add_argument('--limit', type=int, default=20)
+    show.add_argument('--json', action='store_true', help="Print the runs as JSON.")
+
+    compare = commands.add_parser('trend', help="Compare the latest runs of each operation with the runs before them.")
+    compare.add_argument('--op')
+    compare.add_argument('--host')
+    compare.add_argument('--window', type=int, default=TREND_WINDOW)
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+
+    args = parser.parse_args()
+    db_path = resolve_history_path(args.db) or get_history_path()
+    if not os.path.exists(db_path):
+        print(f"No run history at '{db_path}'.")
+        sys.exit(1)
+
+    if args.command == 'list':
+        since = time.time() - args.days * 86400 if args.days else None
+        runs = query_runs(db_path, operation=args.op, host=args.host, since=since, limit=args.limit)
+        if args.json:
+            print(json.dumps(runs, indent=4))
+            return
+        for run in runs:
+            started = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started']))
+            factor = f"{run['realtime_factor']:.1f}x" if run['realtime_factor'] else '-'
+            rate = run['input_bytes'] / run['task_seconds'] if run['task_seconds'] else None
+            stages = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in run['stages'].items())
+            print(f"{started}  {run['operation']:<9} {run['host']:<16} {run['files']:>4} file(s)  "
+                  f"{run['duration'] / 60:>7.1f} min  {run['elapsed']:>7.1f}s  {factor:>7}  {_format_rate(rate):>11}  "
+                  f"{run['failed']} failed  ffmpeg {run['ffmpeg'] or '?'}  ({stages})")
+    else:
+        report = trend(db_path, operation=args.op, host=args.host, window=args.window, threshold=args.threshold)
+        regressions = 0
+        for row in report:
+            change = '-' if row['change'] is None else f"{row['change'] * 100:+.0f}%"
+            flag = "  REGRESSION" if row['regression'] else ''
+            builds = '' if row['ffmpeg']['recent'] == row['ffmpeg']['previous'] or not row['previous'] else \
+                f"  (ffmpeg {', '.join(row['ffmpeg']['previous'])} -> {', '.join(row['ffmpeg']['recent'])})"
+            print(f"{row['operation']:<9} {row['host']:<16} {row['runs']:>4} run(s)  "
+                  f"{_format_rate(row['previous']):>11} -> {_format_rate(row['recent']):>11}  {change:>5}{flag}{builds}")
+            regressions += row['regression']
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from helpers import SoundFilesUtils, create_outfldr, parse_options, FFMPEG_THREADS
+from scheduler import estimate_cost
+from supervisor import pop_failures
+from tasks import run_tasks
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Queue folders - a job file lives in exactly one of them
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+# Jobs are renamed to a private name while they are rewritten (claim, renew, requeue). Private
+# files older than this (in seconds) were left by a worker that died in between, and are requeued.
+PRIVATE_GRACE = 60.0
+
+
+# Shared-filesystem job queue
+class JobQueue:
+    """A job queue stored as JSON files in a folder on a shared volume.
+
+    Every job is one JSON file that moves between the `pending`, `claimed`, `done` and `failed`
+    sub-folders. Moving a file with `os.rename()` is atomic on a single filesystem (including NFS/SMB
+    shares), so any number of workers on any number of nodes can claim jobs without a broker.
+    A claimed job holds a lease that its worker renews while it runs. If a worker dies, the lease
+    expires and the job is put back in `pending` (up to `max_attempts` times).
+
+    Parameters
+    ----------
+    queue_dir : Path
+        The path to the queue folder (created if it doesn't exist).
+
+    Notes
+    -----
+    Leases are compared against each node's wall clock, so nodes should be time-synced (NTP).
+    Jobs may run more than once if a worker stalls past its lease, so operations must be safe
+    to repeat (all `FUNC_TYPE` operations overwrite their outputs).
+
+    Examples
+    --------
+    >>> queue = JobQueue("/mnt/nas/queue")
+    >>> batch = queue.enqueue("split", "/mnt/nas/in", "/mnt/nas/out")
+    >>> queue.work(exit_when_empty=True)      # on each node
+    >>> queue.report(batch)
+    """
+
+    def __init__(self, queue_dir: Path) -> None:
+        self.queue_dir = os.path.abspath(queue_dir)
+        for state in STATES:
+            os.makedirs(os.path.join(self.queue_dir, state), exist_ok=True)
+
+    # FILE HANDLING
+
+    def _path(self, state: str, job_id: str) -> str:
+        """Get the path of a job file in the given state folder."""
+        return os.path.join(self.queue_dir, state, f"{job_id}.json")
+
+    def _write(self, path: str, job: Dict[str, Any]) -> None:
+        """Write a job file atomically (readers never see a partial file)."""
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def _private_path(self, job_id: str, kind: str) -> str:
+        """Get a unique private name for a claimed job that is being rewritten ('<id>.json.<time>-<hex>.<kind>')."""
+        return f"{self._path('claimed', job_id)}.{time.time():.0f}-{uuid.uuid4().hex}.{kind}"
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        """Read a job file, or return None if it has been moved in the meantime."""
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def jobs(self, state: str) -> List[Dict[str, Any]]:
+        """Get all the jobs in the given state.
+
+        Parameters
+        ----------
+        state : str
+            One of 'pending', 'claimed', 'done', 'failed'.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            The jobs, sorted by id.
+        """
+        folder = os.path.join(self.queue_dir, state)
+        jobs = []
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.json'):
+                job = self._read(os.path.join(folder, name))
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    # COORDINATOR
+
+    def enqueue(self, operation: str, in_path: Path, out_path: Path, *,
+                options: Optional[Dict[str, Union[str, bool]]] = None, max_attempts: int = 3) -> str:
+        """Create one job per input file for a `FUNC_TYPE` operation.
+
+        Parameters
+        ----------
+        operation : str
+            The operation to run (a key of `audio_operations.FUNC_TYPE`).
+        in_path : Path
+            The path to an audio file or a folder of audio files (on the shared volume).
+        out_path : Path
+            The path to the folder the output folder will be created in (on the shared volume).
+        options : Dict[str, Union[str, bool]], optional
+            Keyword arguments passed to the operation function.
+        max_attempts : int, optional
+            How many times a job is handed out before it is marked as failed (default is 3).
+
+        Returns
+        -------
+        str
+            The id of the batch.
+
+        Raises
+        ------
+        ValueError
+            If the operation is not supported or an option is not accepted by the operation.
+        FileNotFoundError
+            If no appropriate sound files are found.
+        """
+        from audio_operations import FUNC_TYPE, split_options
+
+        if operation not in FUNC_TYPE:
+            raise ValueError(f"Operation Type incorrect: '{operation}'")
+        func, repeat, list_type, job_kind = FUNC_TYPE[operation][:4]
+        options, _ = split_options(options or {}, func)
+
+        # Inputs: one job per file for repeated operations, one job for the whole folder otherwise
+        in_path = os.path.abspath(in_path)
+        if repeat and os.path.isdir(in_path):
+            sfu = SoundFilesUtils(user_path=in_path)
+            inputs = [os.path.join(in_path, sfile) for sfile in sfu.list_by_type(list_type)]
+        else:
+            inputs = [in_path]
+
+        if len(inputs) == 0:
+            raise FileNotFoundError("No appropriate sound files found in dir.")
+
+        # All jobs of the batch write to the same output folder
+        out_dir = create_outfldr(operation, out_dir=os.path.abspath(out_path))
+
+        batch = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        for i, input_file in enumerate(inputs):
+            job = {
+                'id': f"{batch}-{i:05d}",
+                'batch': batch,
+                'operation': operation,
+                'input': input_file,
+                'out_dir': out_dir,
+                'options': options,
+                'kind': job_kind,
+                'cost': estimate_cost(input_file) if os.path.isfile(input_file) else 0.0,
+                'attempts': 0,
+                'max_attempts': max_attempts,
+                'created': time.time(),
+            }
+            self._write(self._path('pending', job['id']), job)
+
+        print(f"Queued {len(inputs)} '{operation}' job(s) as batch '{batch}'. -> Output folder: {out_dir}")
+        return batch
+
+    def requeue_expired(self) -> int:
+        """Put claimed jobs with an expired lease back in the queue.
+
+        Returns
+        -------
+        int
+            The number of jobs requeued (or failed, if they ran out of attempts).
+        """
+        count = 0
+        now = time.time()
+        for job in self.jobs('claimed'):
+            if job.get('lease_expires', 0) > now:
+                continue
+
+            # Rename to a private name first, so only one node wins the requeue
+            private_path = self._private_path(job['id'], 'requeue')
+            try:
+                os.rename(self._path('claimed', job['id']), private_path)
+            except FileNotFoundError:
+                continue
+            count += self._requeue(private_path, job)
+
+        # Jobs left under a private name by a worker that died between its two renames
+        claimed_dir = os.path.join(self.queue_dir, 'claimed')
+        for name in os.listdir(claimed_dir):
+            job_id, _, rest = name.partition('.json.')
+            if not rest.endswith(('.claim', '.renew', '.requeue')):
+                continue
+            try:
+                if now - float(rest.split('-', 1)[0]) < PRIVATE_GRACE:
+                    continue
+            except ValueError:
+                continue
+
+            private_path = self._private_path(job_id, 'requeue')
+            try:
+                os.rename(os.path.join(claimed_dir, name), private_path)
+            except FileNotFoundError:
+                continue
+            job = self._read(private_path)
+
+            # Finished jobs (or unreadable files) are only removed
+            if job is None or any(os.path.exists(self._path(state, job_id)) for state in ('done', 'failed')):
+                os.remove(private_path)
+                continue
+            count += self._requeue(private_path, job)
+        return count
+
+    def _requeue(self, private_path: str, job: Dict[str, Any]) -> int:
+        """Move a job that lost its worker from its private name back to `pending` (or to `failed`)."""
+        state = 'failed' if job.get('attempts', 0) >= job['max_attempts'] else 'pending'
+        job['error'] = f"Lease expired (worker '{job.get('worker')}')"
+        job['reason'] = 'lease_expired'
+        self._write(private_path, job)
+        try:
+            os.rename(private_path, self._path(state, job['id']))
+        except FileNotFoundError:
+            # Swept by another node in the meantime
+            return 0
+        return 1
+
+    # WORKER
+
+    def claim(self, worker: str, *, lease: float = 300.0) -> Optional[Dict[str, Any]]:
+        """Claim the most expensive pending job.
+
+        Parameters
+        ----------
+        worker : str
+            The id of the claiming worker.
+        lease : float, optional
+            How long the claim is valid without renewal, in seconds (default is 300).
+
+        Returns
+        -------
+        Dict[str, Any] or None
+            The claimed job, or None if the queue is empty.
+        """
+        # Longest jobs first, so the batch doesn't end with one long job running alone
+        pending = sorted(self.jobs('pending'), key=lambda job: (-job.get('cost', 0.0), job['id']))
+        for job in pending:
+            # Rename to a private name first, and publish as claimed once the lease is written
+            private_path = self._private_path(job['id'], 'claim')
+            try:
+                os.rename(self._path('pending', job['id']), private_path)
+            except FileNotFoundError:
+                # Another worker got it first
+                continue
+
+            job = self._read(private_path) or job
+            job['attempts'] = job.get('attempts', 0) + 1
+            job['worker'] = worker
+            job['started'] = time.time()
+            job['lease_expires'] = job['started'] + lease
+            self._write(private_path, job)
+            try:
+                os.rename(private_path, self._path('claimed', job['id']))
+            except FileNotFoundError:
+                # Stalled past PRIVATE_GRACE and swept back to pending
+                continue
+            return job
+        return None
+
+    def renew(self, job: Dict[str, Any], *, lease: float = 300.0) -> bool:
+        """Extend the lease of a claimed job.
+
+        Returns
+        -------
+        bool
+            False if the job is no longer claimed by this worker (e.g. its lease expired and it was requeued).
+
+        Notes
+        -----
+        The job is renewed under a private name, like a claim, so that a concurrent requeue can't be
+        undone by rewriting the claimed file. A job that can't be renamed has lost its lease.
+        """
+        claimed_path = self._path('claimed', job['id'])
+        private_path = self._private_path(job['id'], 'renew')
+        try:
+            os.rename(claimed_path, private_path)
+        except FileNotFoundError:
+            return False
+
+        current = self._read(private_path)
+        if current is None:
+            return False
+        if current.get('worker') != job['worker'] or current.get('started') != job.get('started'):
+            # Claimed again (by another worker, or by this one after a requeue): leave it as it was
+            try:
+                os.rename(private_path, claimed_path)
+            except FileNotFoundError:
+                pass
+            return False
+
+        current['lease_expires'] = time.time() + lease
+        self._write(private_path, current)
+        try:
+            os.rename(private_path, claimed_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, job: Dict[str, Any], *, result: Any = None, error: Optional[str] = None,
+                 reason: str = 'error') -> None:
+        """Move a claimed job to `done` (or `failed` if `error` is given, with the failure's `reason`)."""
+        job = dict(job)
+        job['finished'] = time.time()
+        job['elapsed'] = job['finished'] - job.get('started', job['finished'])
+        job.pop('lease_expires', None)
+
+        state = 'failed' if error else 'done'
+        if error:
+            job['error'] = error
+            job['reason'] = reason
+        else:
+            job['result'] = result
+
+        self._write(self._path(state, job['id']), job)
+
+        # Remove every other copy of the job (it may have been requeued while running)
+        for other in ('claimed', 'pending'):
+            try:
+                os.remove(self._path(other, job['id']))
+            except FileNotFoundError:
+                pass
+
+    def work(self, *, worker: Optional[str] = None, lease: float = 300.0, poll: float = 2.0,
+             exit_when_empty: bool = False, threads: Optional[int] = None) -> int:
+        """Claim and run jobs until the queue is empty (or forever).
+
+        Parameters
+        ----------
+        worker : str, optional
+            The id of this worker (default is None, which uses '<hostname>-<pid>').
+        lease : float, optional
+            The lease length in seconds. It is renewed every `lease / 3` seconds while a job runs (default is 300).
+        poll : float, optional
+            How long to wait before checking an empty queue again, in seconds (default is 2).
+        exit_when_empty : bool, optional
+            If True, return once no jobs are pending or claimed (default is False).
+        threads : int, optional
+            The number of threads each ffmpeg process may use (default is None, which uses ffmpeg's default).
+
+        Returns
+        -------
+        int
+            The number of jobs this worker ran.
+        """
+        from audio_operations import FUNC_TYPE
+
+        worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        FFMPEG_THREADS.set(threads)
+        count = 0
+
+        while True:
+            self.requeue_expired()
+            job = self.claim(worker, lease=lease)
+
+            if job is None:
+                if exit_when_empty and not self.jobs('claimed'):
+                    return count
+                time.sleep(poll)
+                continue
+
+            # Keep the lease alive while the job runs
+            stop = threading.Event()
+
+            def heartbeat():
+                while not stop.wait(lease / 3):
+                    if not self.renew(job, lease=lease):
+                        return
+
+            beat = threading.Thread(target=heartbeat, daemon=True)
+            beat.start()
+
+            print(f"[{worker}] {job['operation'].upper()}: {os.path.basename(job['input'])}")
+            label = os.path.abspath(job['input'])
+            try:
+                # Plan and run the tasks directly: operation functions print their errors and return None
+                plan_func = FUNC_TYPE[job['operation']][4]
+                result = run_tasks(plan_func(job['input'], job['out_dir'], **job.get('options', {})))
+                # Supervised ffmpeg failures keep their reason in the failure log
+                failure = pop_failures([label]).get(label)
+                if failure is not None:
+                    self.complete(job, error=failure['error'], reason=failure['reason'])
+                else:
+                    self.complete(job, result=json.loads(json.dumps(result, default=str)))
+            except Exception as e:
+                # `run_tasks()` raises from the error of the task that failed
+                failure = pop_failures([label]).get(label)
+                error = e.__cause__ or e
+                print(f"[{worker}] Error processing '{job['input']}': {error}")
+                if failure is not None:
+                    self.complete(job, error=failure['error'], reason=failure['reason'])
+                else:
+                    self.complete(job, error=str(error), reason=getattr(error, 'reason', 'error'))
+            finally:
+                stop.set()
+                beat.join()
+            count += 1
+
+    # REPORT
+
+    def report(self, batch: Optional[str] = None) -> Dict[str, Any]:
+        """Aggregate the jobs of a batch into a single report.
+
+        Parameters
+        ----------
+        batch : str, optional
+            The batch id (default is None, which reports every job in the queue).
+
+        Returns
+        -------
+        Dict[str, Any]
+            Counts per state, per-worker job counts, total job time and the per-file results and errors.
+        """
+        report = {'batch': batch, 'counts': {}, 'workers': {}, 'job_seconds': 0.0, 'files': []}
+        for state in STATES:
+            jobs = [job for job in self.jobs(state) if batch is None or job['batch'] == batch]
+            report['counts'][state] = len(jobs)
+            for job in jobs:
+                entry = {
+                    'input': job['input'],
+                    'state': state,
+                    'attempts': job.get('attempts', 0),
+                    'worker': job.get('worker'),
+                }
+                if state in ('done', 'failed'):
+                    entry['elapsed'] = job.get('elapsed')
+                    report['job_seconds'] += job.get('elapsed') or 0.0
+                    report['workers'][job.get('worker')] = report['workers'].get(job.get('worker'), 0) + 1
+                if state == 'done':
+                    entry['result'] = job.get('result')
+                if 'error' in job:
+                    entry['error'] = job['error']
+                    entry['reason'] = job.get('reason')
+                report['files'].append(entry)
+        return report
+
+
+def main() -> None:
+    """Command-line interface of the job queue.
+
+    Usage:
+    python job_queue.py enqueue [queue_dir] [input_path] [output_path] [operation_type] [--option=value ...]
+    python job_queue.py work [queue_dir] [--lease SECONDS] [--exit-when-empty]
+    python job_queue.py report [queue_dir] [--batch ID]
+    """
+    parser = argparse.ArgumentParser(description="Shared-filesystem job queue for audio operations.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help="Queue one job per input file.")
+    enqueue.add_argument('queue_dir')
+    enqueue.add_argument('in_path')
+    enqueue.add_argument('out_path')
+    enqueue.add_argument('operation')
+    enqueue.add_argument('--max-attempts', type=int, default=3)
+
+    work = commands.add_parser('work', help="Run jobs from the queue.")
+    work.add_argument('queue_dir')
+    work.add_argument('--worker')
+    work.add_argument('--lease', type=float, default=300.0)
+    work.add_argument('--poll', type=float, default=2.0)
+    work.add_argument('--threads', type=int)
+    work.add_argument('--exit-when-empty', action='store_true')
+
+    report = commands.add_parser('report', help="Print the aggregated report of a batch as JSON.")
+    report.add_argument('queue_dir')
+    report.add_argument('--batch')
+
+    args, extra = parser.parse_known_args()
+    queue = JobQueue(args.queue_dir)
+
+    try:
+        if args.command == 'enqueue':
+            queue.enqueue(args.operation, args.in_path, args.out_path,
+                          options=parse_options(extra), max_attempts=args.max_attempts)
+        elif extra:
+            parser.error(f"unrecognized arguments: {' '.join(extra)}")
+        elif args.command == 'work':
+            count = queue.work(worker=args.worker, lease=args.lease, poll=args.poll,
+                               exit_when_empty=args.exit_when_empty, threads=args.threads)
+            print(f"Worker finished. {count} job(s) processed.")
+        else:
+            print(json.dumps(queue.report(args.batch), indent=4))
+    except (ValueError, FileNotFoundError, OSError) as e:
+        print(e)
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+from constants import CH_LAYOUT_COMP, CH_SMPTE_COMP, CH_MASK_BITS, CUSTOM_LAYOUTS, DEFAULT_LAYOUTS
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union, Iterable
+
+
+class Layout:
+    """A channel layout of the registry.
+
+    Attributes
+    ----------
+    name : str
+        The name of the layout (a key of `CH_LAYOUT_COMP`, e.g. '7.1.4').
+    channels : List[str]
+        The ffmpeg channel names, in file order (e.g. ['FL', 'FR', ...]).
+    suffixes : List[str]
+        The channel extensions of multi-mono files, in file order (e.g. ['L', 'R', ...]).
+    mask : int or None
+        The WAVE_FORMAT_EXTENSIBLE channel mask, or None if a channel has no speaker bit (e.g. 'WL').
+    ffmpeg : str
+        The layout as given to ffmpeg: its name, or its channels joined with '+' for `CUSTOM_LAYOUTS`.
+    """
+
+    def __init__(self, name: str, channels: List[str], suffixes: List[str]) -> None:
+        self.name = name
+        self.channels = list(channels)
+        self.suffixes = list(suffixes)
+        self.ffmpeg = '+'.join(channels) if name in CUSTOM_LAYOUTS else name
+
+        # Masks are only defined if every channel has a speaker bit and the channels are in bit order
+        bits = [CH_MASK_BITS.get(ch) for ch in channels]
+        if None in bits or bits != sorted(bits):
+            self.mask = None
+        else:
+            self.mask = sum(bits)
+
+    @property
+    def num_channels(self) -> int:
+        """int: The number of channels."""
+        return len(self.channels)
+
+    def relabel_filter(self) -> str:
+        """Get an ffmpeg filter that sets this layout on the stream, without remixing it.
+
+        ffmpeg guesses the layout of files without a channel mask from their number of channels
+        (e.g. 'hexadecagonal' for 16 channels). Filters such as 'channelsplit' would then remix
+        the channels to the requested layout instead of just relabelling them.
+
+        Returns
+        -------
+        str
+            The filter, e.g. 'channelmap=channel_layout=7.1.4'.
+        """
+        return f"channelmap=channel_layout={self.ffmpeg}"
+
+    def select(self, channels: Union[str, Iterable[Union[str, int]]]) -> List[int]:
+        """Get the indices of some channels of the layout, from their extensions or their numbers.
+
+        Parameters
+        ----------
+        channels : str or Iterable[str or int]
+            Channel extensions (in any case) or 1-based channel numbers, as a list or separated by commas.
+
+        Returns
+        -------
+        List[int]
+            The 0-based indices of the channels, in file order, without duplicates.
+
+        Raises
+        ------
+        ValueError
+            If a channel is not part of the layout.
+
+        Examples
+        --------
+        >>> LAYOUTS['7.1'].select('C')
+        [2]
+        >>> LAYOUTS['7.1'].select('R,l,7')
+        [0, 1, 6]
+        """
+        if isinstance(channels, str):
+            channels = channels.split(',')
+        lookup = {suffix.lower(): i for i, suffix in enumerate(self.suffixes)}
+        indices = set()
+        for channel in (str(ch).strip() for ch in channels):
+            if channel.isdigit() and 1 <= int(channel) <= self.num_channels:
+                indices.add(int(channel) - 1)
+            elif channel.lower() in lookup:
+                indices.add(lookup[channel.lower()])
+            elif channel:
+                raise ValueError(f"'{channel}' is not a channel of {self.name} "
+                                 f"({', '.join(self.suffixes)}, or 1 to {self.num_channels}).")
+        return sorted(indices)
+
+    def __repr__(self) -> str:
+        return f"Layout({self.name!r}, {'+'.join(self.suffixes)})"
+
+
+class LayoutRegistry:
+    """All known channel layouts, indexed by name, channel mask and set of channel extensions.
+
+    Every lookup is a dictionary access. The registry is built from `CH_LAYOUT_COMP` and
+    `CH_SMPTE_COMP`; when two layouts share a mask or a set of extensions, the first one wins.
+
+    Examples
+    --------
+    >>> LAYOUTS['7.1.4'].suffixes
+    ['L', 'R', 'C', 'LFE', 'Ls', 'Rs', 'Lsr', 'Rsr', 'Ltf', 'Rtf', 'Ltb', 'Rtb']
+    >>> LAYOUTS.from_mask(0x3F).name
+    '5.1'
+    >>> LAYOUTS.from_suffixes(['R', 'L']).name
+    'stereo'
+    """
+
+    def __init__(self) -> None:
+        self.by_name: Dict[str, Layout] = {}
+        self.by_mask: Dict[int, Layout] = {}
+        self.by_suffixes: Dict[frozenset, Layout] = {}
+
+        for name, channels in CH_LAYOUT_COMP.items():
+            layout = Layout(name, channels, CH_SMPTE_COMP[name])
+            self.by_name[name] = layout
+            if layout.mask is not None:
+                self.by_mask.setdefault(layout.mask, layout)
+            self.by_suffixes.setdefault(self._suffix_key(layout.suffixes), layout)
+
+    @staticmethod
+    def _suffix_key(suffixes: Iterable[str]) -> frozenset:
+        return frozenset(suffix.lower() for suffix in suffixes)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name
+
+    def __getitem__(self, name: str) -> Layout:
+        return self.by_name[name]
+
+    def get(self, name: Optional[str]) -> Optional[Layout]:
+        """Get a layout by name, or None."""
+        return self.by_name.get(name)
+
+    def from_mask(self, mask: Optional[int]) -> Optional[Layout]:
+        """Get the layout of a WAVE_FORMAT_EXTENSIBLE channel mask, or None."""
+        return self.by_mask.get(mask) if mask else None
+
+    def from_suffixes(self, suffixes: Iterable[str]) -> Optional[Layout]:
+        """Get the layout of a set of multi-mono channel extensions (in any order and case), or None."""
+        return self.by_suffixes.get(self._suffix_key(suffixes))
+
+    def closest(self, suffixes: Iterable[str]) -> Optional[Layout]:
+        """Get the smallest layout that has all the given channel extensions, or None.
+
+        Used to tell which channels of an incomplete multi-mono group are missing.
+        """
+        key = self._suffix_key(suffixes)
+        matches = [layout for layout in self.by_name.values() if key <= self._suffix_key(layout.suffixes)]
+        return min(matches, key=lambda layout: layout.num_channels, default=None)
+
+    def default(self, num_channels: int) -> Optional[Layout]:
+        """Get the layout assumed for a number of channels (see `DEFAULT_LAYOUTS`), or None."""
+        name = DEFAULT_LAYOUTS.get(num_channels)
+        return self.by_name[name] if name else None
+
+    def resolve(self, num_channels: int, *, name: Optional[str] = None,
+                mask: Optional[Union[int, Callable[[], Optional[int]]]] = None) -> Optional[Layout]:
+        """Find the layout of a file from what is known about it.
+
+        The name is used if it is known and has the right number of channels, then the mask,
+        then the default layout for the number of channels.
+
+        Parameters
+        ----------
+        num_channels : int
+            The number of channels of the file.
+        name : str, optional
+            The layout name reported by the prober (default is None).
+        mask : int or Callable[[], int], optional
+            The file's channel mask, or a function that reads it (only called if the name doesn't match)
+            (default is None).
+
+        Returns
+        -------
+        Layout or None
+            The layout, or None if it can't be determined.
+        """
+        layout = self.get(name)
+        if layout is not None and layout.num_channels == num_channels:
+            return layout
+        if callable(mask):
+            mask = mask()
+        layout = self.from_mask(mask)
+        if layout is not None and layout.num_channels == num_channels:
+            return layout
+        return self.default(num_channels)
+
+
+# The registry used by all operations
+LAYOUTS = LayoutRegistry()
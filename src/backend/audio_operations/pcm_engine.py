@@ -0,0 +1,964 @@
+import argparse
+import ctypes
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from fractions import Fraction
+from functools import lru_cache
+import numpy as np           # needs pip install (installed with soundfile)
+from numpy.lib.stride_tricks import sliding_window_view
+import soundfile as sf      # needs pip install
+from helpers import staging_path, find_wav_chunks, wav_header, wav_fmt, read_wav_channel_mask, write_wav_channel_mask
+from constants import DOWNMIX_MATRICES
+from cancellation import CancelToken, CancelledError, current_token
+from segments import segment_ranges, segments_dir, join_segments
+from peaks import missing_peaks_builder, store_peaks
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, List, Dict, Tuple, Union
+
+
+# Output formats the engine writes, with their soundfile container
+NATIVE_CONTAINERS = {'wav': 'WAV', 'aiff': 'AIFF', 'aif': 'AIFF', 'flac': 'FLAC'}
+
+# Input containers the engine reads (soundfile format names)
+NATIVE_INPUTS = ('WAV', 'WAVEX', 'RF64', 'W64', 'AIFF', 'FLAC')
+
+# ffmpeg PCM codecs -> soundfile subtype (the container sets the byte order)
+CODEC_SUBTYPES = {
+    'pcm_s16le': 'PCM_16', 'pcm_s16be': 'PCM_16',
+    'pcm_s24le': 'PCM_24', 'pcm_s24be': 'PCM_24',
+    'pcm_s32le': 'PCM_32', 'pcm_s32be': 'PCM_32',
+    'pcm_f32le': 'FLOAT', 'pcm_f32be': 'FLOAT',
+    'pcm_f64le': 'DOUBLE', 'pcm_f64be': 'DOUBLE',
+}
+
+# Bits of the integer subtypes (float subtypes are not quantized)
+SUBTYPE_BITS = {'PCM_16': 16, 'PCM_24': 24, 'PCM_32': 32}
+
+# Frames read from disk at a time
+BLOCK_FRAMES = 65536
+
+# Resampling filter: zero crossings on each side of the windowed sinc, Kaiser window beta,
+# and cutoff relative to the lower Nyquist frequency
+ZERO_CROSSINGS = 32
+KAISER_BETA = 8.6
+ROLLOFF = 0.92
+
+# Output frames computed (resampled and dithered) together. Cells start at multiples of this size in
+# every run, so a segment of a file gets exactly the samples of the same frames of a whole-file run
+CELL_FRAMES = 16384
+
+# Sample formats of WAV files 'downmix' decodes and encodes itself: (bytes per sample, float)
+RAW_SUBTYPES = {'PCM_16': (2, False), 'PCM_24': (3, False), 'PCM_32': (4, False), 'FLOAT': (4, True)}
+
+# Largest term of a reduced rate ratio the resampler accepts (44.1k <-> 96k is 320/147)
+MAX_RATIO_TERM = 320
+
+# Worker processes of the shared pool (None = os.cpu_count())
+POOL_WORKERS = None
+
+# Cancel flags shared with the pool's workers: each conversion checks its slot between blocks
+CANCEL_SLOTS = 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+_cancel_flags = None
+_next_slot = itertools.count()
+
+
+# Check whether a conversion can run in-process
+def native_reason(header: Dict[str, Any], *, conversion: str, sample_rate: Union[str, int], bit_rate: str) -> Optional[str]:
+    """Tell why a conversion can't run in the native engine.
+
+    Parameters
+    ----------
+    header : Dict[str, Any]
+        The input's header, from `helpers.get_header_info()`.
+    conversion : str
+        The target format (e.g. 'wav').
+    sample_rate : str or int
+        The target sample rate.
+    bit_rate : str
+        The target ffmpeg codec (e.g. 'pcm_s24le').
+
+    Returns
+    -------
+    str or None
+        The reason, or None if the native engine can do the conversion.
+    """
+    container = NATIVE_CONTAINERS.get(conversion.lower())
+    subtype = CODEC_SUBTYPES.get(bit_rate)
+    if container is None:
+        return f"'{conversion}' outputs are not supported"
+    if subtype is None:
+        return f"codec '{bit_rate}' is not supported"
+    if not sf.check_format(container, subtype):
+        return f"'{conversion}' can't hold {bit_rate}"
+    if header.get('format') not in NATIVE_INPUTS:
+        return f"'{header.get('format')}' inputs are not supported"
+    if not str(header.get('subtype', '')).startswith(('PCM', 'FLOAT', 'DOUBLE')):
+        return f"'{header.get('subtype')}' inputs are not supported"
+    up, down = resample_ratio(int(header['sample_rate']), int(sample_rate))
+    if max(up, down) > MAX_RATIO_TERM:
+        return f"resampling {header['sample_rate']} -> {sample_rate}Hz is not supported"
+    return None
+
+
+def ffmpeg_writes(conversion: str, bit_rate: str) -> bool:
+    """Check whether ffmpeg can write a codec to a format.
+
+    ffmpeg refuses big-endian codecs in WAV, little-endian codecs (except 'pcm_s16le') in AIFF,
+    and PCM codecs in FLAC, which soundfile handles by choosing the byte order (or encoding) itself.
+    """
+    conversion = conversion.lower()
+    if conversion == 'flac':
+        return bit_rate not in CODEC_SUBTYPES
+    if conversion == 'wav':
+        return not bit_rate.endswith('be')
+    if conversion in ('aiff', 'aif'):
+        return not bit_rate.endswith('le') or bit_rate == 'pcm_s16le'
+    return True
+
+
+def resample_ratio(in_rate: int, out_rate: int) -> Tuple[int, int]:
+    """Get the reduced (up, down) factors that turn `in_rate` into `out_rate` (e.g. (160, 147) for 44.1k -> 48k)."""
+    ratio = Fraction(int(out_rate), int(in_rate))
+    return ratio.numerator, ratio.denominator
+
+
+# RESAMPLING
+
+@lru_cache(maxsize=32)
+def design_filter(up: int, down: int) -> np.ndarray:
+    """Design the polyphase low-pass filter of a rate change.
+
+    A Kaiser-windowed sinc is designed at the upsampled rate, with its cutoff just below the
+    lower of the two Nyquist frequencies, then split into `up` phases.
+
+    Returns
+    -------
+    np.ndarray
+        The filter, shaped (taps, up): column `p` holds the taps of phase `p`, newest sample first.
+    """
+    factor = max(up, down)
+    length = 2 * ZERO_CROSSINGS * factor + 1
+    cutoff = ROLLOFF / factor     # relative to the upsampled Nyquist frequency
+    n = np.arange(length) - (length - 1) / 2
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(length, KAISER_BETA) * up
+
+    taps = -(-length // up)
+    h = np.concatenate([h, np.zeros(taps * up - length)])
+    return h.reshape(taps, up)
+
+
+class PolyphaseResampler:
+    """A streaming rational resampler (upsample by `up`, filter, downsample by `down`).
+
+    Only the output samples that are kept are computed: output `n` uses phase `(n * down + delay) % up`
+    of the filter. Outputs `up` apart share a phase and read inputs `down` apart, so each phase of a
+    cell is one NumPy product over a strided view of the input. Memory use depends on the block
+    size, not on the file's length.
+
+    Outputs are computed in cells of `CELL_FRAMES` frames that start at multiples of `CELL_FRAMES`,
+    each from its own copy of the input it needs. A cell is therefore computed the same way whatever
+    the blocks fed in and wherever the run started, which makes segmented runs bit-identical to whole-file runs.
+
+    Parameters
+    ----------
+    in_rate, out_rate : int
+        The sample rates.
+    channels : int
+        The number of channels.
+    start : int, optional
+        The first output frame to compute (default is 0). Input must then be fed from `input_start`.
+
+    Examples
+    --------
+    >>> resampler = PolyphaseResampler(44100, 48000, 2)
+    >>> out = [resampler.process(block) for block in blocks] + [resampler.flush()]
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, channels: int, *, start: int = 0) -> None:
+        self.up, self.down = resample_ratio(in_rate, out_rate)
+        self.filter = design_filter(self.up, self.down)
+        self.taps = self.filter.shape[0]
+        self.weights = np.ascontiguousarray(self.filter[::-1].T)    # (up, taps), oldest sample first
+        self.delay = ZERO_CROSSINGS * max(self.up, self.down)   # centre of the filter, at the upsampled rate
+        self.channels = channels
+
+        # Input not consumed yet, starting with silence before the first sample
+        first = self.input_index(start) - (self.taps - 1)
+        self.input_start = max(0, first)
+        self.buffer = np.zeros((self.input_start - first, channels))
+        self.buffer_start = first    # input index of buffer[0]
+        self.frames_in = self.input_start
+        self.frames_out = start
+
+    def input_index(self, output: int) -> int:
+        """Get the newest input frame that output frame `output` uses (it uses the `taps` frames up to it)."""
+        return (output * self.down + self.delay) // self.up
+
+    def input_range(self, start: int, stop: int) -> Tuple[int, int]:
+        """Get the input frames [first, last) that output frames [start, stop) use (from the file's first frame)."""
+        return max(0, self.input_index(start) - (self.taps - 1)), self.input_index(stop - 1) + 1
+
+    def _produce_cell(self, start: int, stop: int) -> np.ndarray:
+        """Compute output frames [start, stop), which are in the same cell."""
+        count = stop - start
+        first = self.input_index(start) - (self.taps - 1)
+        block = np.ascontiguousarray(self.buffer[first - self.buffer_start:self.input_index(stop - 1) + 1 - self.buffer_start].T)
+        windows = sliding_window_view(block, self.taps, axis=1)
+
+        # Outputs `up` apart use the same phase, and inputs `down` apart: each phase is one strided dot product
+        out = np.empty((self.channels, count))
+        for r in range(min(self.up, count)):
+            t = (start + r) * self.down + self.delay
+            offset = t // self.up - (self.taps - 1) - first
+            n = len(range(r, count, self.up))
+            out[:, r::self.up] = windows[:, offset:offset + (n - 1) * self.down + 1:self.down] @ self.weights[t % self.up]
+        return out.T
+
+    def _produce(self, last: int) -> np.ndarray:
+        """Compute outputs up to (not including) `last`, cell by cell."""
+        cells = []
+        while self.frames_out < last:
+            stop = min(last, (self.frames_out // CELL_FRAMES + 1) * CELL_FRAMES)
+            cells.append(self._produce_cell(self.frames_out, stop))
+            self.frames_out = stop
+        if not cells:
+            return np.zeros((0, self.channels))
+
+        # Drop the input that no later output needs
+        keep_from = max(0, self.input_index(self.frames_out) - (self.taps - 1) - self.buffer_start)
+        self.buffer = self.buffer[keep_from:]
+        self.buffer_start += keep_from
+        return np.concatenate(cells)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Resample a block of input (frames x channels) and return the whole cells it completes."""
+        self.buffer = np.concatenate([self.buffer, block])
+        self.frames_in += len(block)
+        end = self.buffer_start + len(self.buffer)
+        last = (self.up * end - 1 - self.delay) // self.down + 1
+        return self._produce(max(last // CELL_FRAMES * CELL_FRAMES, self.frames_out))
+
+    def flush(self, stop: Optional[int] = None) -> np.ndarray:
+        """Return the last outputs: up to `stop`, or up to the file's length times up / down, rounded up.
+
+        The input fed so far must end at the end of the file, or cover the outputs up to `stop`.
+        """
+        self.buffer = np.concatenate([self.buffer, np.zeros((self.taps, self.channels))])
+        last = -(-self.frames_in * self.up // self.down)
+        return self._produce(last if stop is None else min(stop, last))
+
+
+# QUANTIZATION
+
+def quantize(data: np.ndarray, bits: int, *, dither: bool = False, rng: Optional[np.random.Generator] = None,
+             noise: Optional[np.ndarray] = None) -> np.ndarray:
+    """Round float samples (1.0 = full scale) to `bits`-bit integers, with optional TPDF dither.
+
+    TPDF dither adds the difference of two uniform random values (+-1 LSB, triangular distribution)
+    before rounding, which turns the rounding error into constant, signal-independent noise.
+    The noise is drawn from `rng`, unless it is given as `noise` (see `tpdf_noise()`).
+
+    Returns
+    -------
+    np.ndarray
+        int32 samples, left-justified (the `bits` most significant bits), as soundfile expects.
+    """
+    scale = float(2 ** (bits - 1))
+    scaled = data * scale
+    if dither:
+        if noise is None:
+            rng = rng or np.random.default_rng()
+            noise = rng.random(data.shape) - rng.random(data.shape)
+        scaled += noise
+    quantized = np.clip(np.round(scaled), -scale, scale - 1).astype(np.int64)
+    return (quantized << (32 - bits)).astype(np.int32)
+
+
+def tpdf_noise(seed: int, start: int, count: int, channels: int) -> np.ndarray:
+    """Get the TPDF dither noise of output frames [start, start + count) of a seeded conversion.
+
+    The noise of each cell of `CELL_FRAMES` frames comes from its own generator, seeded with
+    (seed, cell index), so a frame gets the same noise whether it is written by a segment or by a whole-file run.
+    """
+    first, last = start // CELL_FRAMES, (start + count - 1) // CELL_FRAMES
+    cells = []
+    for cell in range(first, last + 1):
+        rng = np.random.default_rng([seed, cell])
+        cells.append(rng.random((CELL_FRAMES, channels)) - rng.random((CELL_FRAMES, channels)))
+    offset = start - first * CELL_FRAMES
+    return np.concatenate(cells)[offset:offset + count]
+
+
+# TRANSCODING
+
+def transcode(input_file: Path, output_path: Path, *, sample_rate: int, subtype: str, container: str,
+              dither: bool = False, seed: Optional[int] = None, block_frames: int = BLOCK_FRAMES,
+              start: int = 0, stop: Optional[int] = None, cancel_slot: Optional[int] = None) -> Dict[str, Any]:
+    """Convert a PCM file with `soundfile` and NumPy, streaming it in blocks.
+
+    - Without resampling or dither, integer samples are copied as integers, so the samples are
+      bit-identical to ffmpeg's (bit depth is reduced by truncation, as ffmpeg does).
+    - Otherwise, samples are processed as float64, resampled with `PolyphaseResampler` and
+      rounded (with TPDF dither if requested) to the target bit depth.
+
+    A WAV input's channel mask is kept: the output is written as WAVE_FORMAT_EXTENSIBLE and its
+    mask patched with `helpers.write_wav_channel_mask()`. Files without a mask (or with a mask
+    that doesn't have one bit per channel) get a plain WAV header, and their layout is guessed
+    from their number of channels, as before. Headers may otherwise differ from ffmpeg's.
+
+    The output is written under a hidden temporary name (see `helpers.staging_path()`)
+    and renamed into place once complete.
+
+    With `start` and `stop`, only those output frames are written (a segment, see `transcode_in_pool()`).
+    They are the same samples as the same frames of a whole-file conversion with the same `seed`.
+
+    A whole-file conversion also builds the input's waveform overview from the blocks it reads,
+    unless it is already cached (see `peaks.missing_peaks_builder()`).
+
+    Parameters
+    ----------
+    input_file : Path
+        The path to the input file.
+    output_path : Path
+        The path to the output file.
+    sample_rate : int
+        The target sample rate.
+    subtype : str
+        The target soundfile subtype (e.g. 'PCM_24').
+    container : str
+        The target soundfile format (e.g. 'WAV').
+    dither : bool, optional
+        If True, TPDF dither is added when samples are rounded to fewer bits than they hold
+        (a smaller bit depth, or any resampled integer output) (default is False).
+    seed : int, optional
+        The seed of the dither noise (default is None, which uses fresh noise). Seeded noise
+        depends on the frames' position only (see `tpdf_noise()`).
+    block_frames : int, optional
+        The number of frames read at a time (default is `BLOCK_FRAMES`).
+    start : int, optional
+        The first output frame to write (default is 0).
+    stop : int, optional
+        The output frame to stop at (default is None, which converts up to the end of the file).
+    cancel_slot : int, optional
+        The pool worker's cancel flag to check between blocks (set by `transcode_in_pool()`) (default is None).
+
+    Returns
+    -------
+    Dict[str, Any]
+        'path' (the output path) and 'mode' ('integer' or 'float').
+
+    Raises
+    ------
+    cancellation.CancelledError
+        If the conversion was cancelled. The partial output is deleted.
+    """
+    sample_rate = int(sample_rate)
+    temp_path = staging_path(output_path)
+
+    with sf.SoundFile(input_file) as src:
+        # libsndfile writes a plain WAV header, so the input's channel mask is restored after writing
+        mask = read_wav_channel_mask(str(input_file)) if container == 'WAV' else None
+        if mask is not None and bin(mask).count('1') != src.channels:
+            mask = None
+
+        in_bits = SUBTYPE_BITS.get(src.subtype, 32)
+        out_bits = SUBTYPE_BITS.get(subtype)
+        resample = src.samplerate != sample_rate
+        dither = bool(dither and out_bits and (resample or out_bits < in_bits))
+        integer = not resample and not dither and src.subtype in SUBTYPE_BITS and out_bits is not None
+
+        # Output frames to write, and the input frames they are made from
+        total = -(-src.frames * sample_rate // src.samplerate)
+        stop = total if stop is None else min(int(stop), total)
+        start = min(int(start), stop)
+        resampler = PolyphaseResampler(src.samplerate, sample_rate, src.channels, start=start) if resample else None
+        first, last = resampler.input_range(start, stop) if resample else (start, stop)
+        last = min(last, src.frames)
+        src.seek(first)
+
+        # A whole-file pass also builds the input's waveform overview, if it isn't cached (segments don't)
+        builder = missing_peaks_builder(input_file) if first == 0 and last == src.frames else None
+
+        rng = np.random.default_rng(seed)
+        position = start
+
+        def write(dst, data):
+            nonlocal position
+            data = data[:stop - position]
+            if len(data):
+                noise = tpdf_noise(seed, position, len(data), src.channels) if dither and seed is not None else None
+                dst.write(quantize(data, out_bits, dither=dither, rng=rng, noise=noise) if out_bits else data)
+                position += len(data)
+
+        try:
+            with sf.SoundFile(temp_path, 'w', samplerate=sample_rate, channels=src.channels,
+                              subtype=subtype, format='WAVEX' if mask is not None else container) as dst:
+                for block in src.blocks(blocksize=block_frames, frames=max(0, last - first),
+                                        dtype='int32' if integer else 'float64', always_2d=True):
+                    if cancel_slot is not None and _cancel_flags is not None and _cancel_flags[cancel_slot]:
+                        raise CancelledError(f"Conversion of '{os.path.basename(input_file)}' was cancelled.")
+                    if builder is not None:
+                        builder.update(block)
+                    if integer:
+                        dst.write(block)
+                    else:
+                        write(dst, resampler.process(block) if resampler else block)
+                if resampler:
+                    write(dst, resampler.flush(stop))
+            if mask is not None:
+                write_wav_channel_mask(temp_path, mask)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    if builder is not None:
+        store_peaks(input_file, builder)
+
+    return {'path': str(output_path), 'mode': 'integer' if integer else 'float'}
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Get the process pool shared by all native conversions (created on first use)."""
+    global _pool, _cancel_flags
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn' works the same on every platform, and doesn't fork the scheduler's threads
+            context = multiprocessing.get_context('spawn')
+            _cancel_flags = context.RawArray(ctypes.c_bool, CANCEL_SLOTS)
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS or os.cpu_count() or 1, mp_context=context,
+                                        initializer=_init_worker, initargs=(_cancel_flags,))
+        return _pool
+
+
+def _init_worker(cancel_flags) -> None:
+    """Give a pool worker the shared cancel flags."""
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+
+
+def transcode_in_pool(input_file: Path, output_path: Path, *, cancel: Optional[CancelToken] = None,
+                      segments: int = 1, **kwargs) -> Dict[str, Any]:
+    """Run `transcode()` in the shared process pool and wait for it.
+
+    Conversions are CPU-bound Python code, so they run in worker processes instead of the
+    scheduler's threads (which would all share one interpreter lock).
+
+    With `segments`, a WAV output is cut into that many time segments (on `CELL_FRAMES` boundaries)
+    that are converted at once by different workers, then joined with `helpers.concat_wav()`.
+    The output is bit-identical to a conversion in one piece: the resampler and the seeded dither
+    depend on the frames' position only (dither without a seed gets a random one shared by all segments).
+
+    Parameters
+    ----------
+    input_file, output_path, **kwargs
+        See `transcode()`.
+    cancel : CancelToken, optional
+        Cancelling it stops the conversion at its next block (default is None, which uses the current token, if any).
+    segments : int, optional
+        The number of segments to convert at once (default is 1).
+    """
+    pool = get_pool()
+    cancel = cancel or current_token()
+    slot = next(_next_slot) % CANCEL_SLOTS
+    _cancel_flags[slot] = False
+
+    # Cut the output into segments
+    ranges = [(0, None)]
+    if segments > 1 and kwargs.get('container') == 'WAV':
+        info = sf.info(str(input_file))
+        total = -(-info.frames * int(kwargs['sample_rate']) // info.samplerate)
+        ranges = segment_ranges(total, segments, align=CELL_FRAMES)
+    if len(ranges) > 1 and kwargs.get('dither') and kwargs.get('seed') is None:
+        kwargs['seed'] = np.random.SeedSequence().entropy
+
+    parts_dir = segments_dir(str(output_path))
+    parts = [os.path.join(parts_dir, f"{index:04d}.wav") for index in range(len(ranges))] if len(ranges) > 1 else [output_path]
+    if len(parts) > 1:
+        os.makedirs(parts_dir, exist_ok=True)
+
+    futures = [pool.submit(transcode, input_file, part, start=start, stop=stop, cancel_slot=slot, **kwargs)
+               for part, (start, stop) in zip(parts, ranges)]
+    remove = cancel.on_cancel(lambda: _cancel_flags.__setitem__(slot, True)) if cancel else None
+    try:
+        try:
+            results = [future.result() for future in futures]
+        except BaseException:
+            # Stop the other segments before their outputs are deleted
+            _cancel_flags[slot] = True
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+            raise
+        if len(parts) > 1:
+            join_segments({str(output_path): parts})
+        return {**results[0], 'path': str(output_path), 'segments': len(parts)}
+    finally:
+        if remove is not None:
+            remove()
+        if len(parts) > 1:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+# DOWNMIX
+
+def read_pcm_blocks(f: Any, *, frames: int, channels: int, subtype: str,
+                    block_frames: int = BLOCK_FRAMES) -> Iterator[np.ndarray]:
+    """Read the audio data of a PCM WAV file in blocks of float32 samples (1.0 = full scale).
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The file, opened in binary mode and positioned at the start of its 'data' chunk (see `helpers.find_wav_chunks()`).
+    frames, channels : int
+        The number of frames to read, and of channels of the file.
+    subtype : str
+        The sample format, a key of `RAW_SUBTYPES`.
+    block_frames : int, optional
+        The number of frames read at a time (default is `BLOCK_FRAMES`).
+    """
+    frame_bytes = RAW_SUBTYPES[subtype][0] * channels
+    # One spare byte, so that the last 24-bit sample can be read as a 4-byte integer
+    buffer = bytearray(block_frames * frame_bytes + 1)
+    while frames > 0:
+        count = f.readinto(memoryview(buffer)[:min(frames, block_frames) * frame_bytes]) // frame_bytes
+        if count == 0:
+            return
+        frames -= count
+        yield decode_pcm(buffer, count * channels, subtype).reshape(count, channels)
+
+
+def decode_pcm(buffer: Any, count: int, subtype: str) -> np.ndarray:
+    """Decode `count` little-endian samples of `buffer` to float32 (1.0 = full scale).
+
+    24-bit samples are read as overlapping 4-byte integers 3 bytes apart, shifted left by a byte:
+    a single strided NumPy pass, instead of assembling them byte by byte.
+    """
+    if subtype == 'FLOAT':
+        return np.frombuffer(buffer, '<f4', count).copy()
+    if subtype == 'PCM_16':
+        return np.multiply(np.frombuffer(buffer, '<i2', count), np.float32(2 ** -15), dtype=np.float32)
+    if subtype == 'PCM_24':
+        samples = np.ndarray((count,), '<i4', buffer=buffer, strides=(3,)) << 8
+    else:
+        samples = np.frombuffer(buffer, '<i4', count)
+    return np.multiply(samples, np.float32(2 ** -31), dtype=np.float32)
+
+
+def to_pcm(samples: np.ndarray, subtype: str) -> np.ndarray:
+    """Round float samples (1.0 = full scale) to the integers of `subtype` (right-justified int32), clipping them to full scale.
+
+    Unlike `quantize()`, which prepares samples for `soundfile`, the integers are meant for `pack_pcm()`. FLOAT samples are returned as float32.
+    """
+    if subtype == 'FLOAT':
+        return samples.astype(np.float32)
+    scale = 2.0 ** (SUBTYPE_BITS[subtype] - 1)
+    # 32-bit samples need more precision than float32 has
+    scaled = np.multiply(samples, scale, dtype=np.float64 if subtype == 'PCM_32' else np.float32)
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, -scale, scale - 1, out=scaled)
+    return scaled.astype(np.int32)
+
+
+def pack_pcm(values: np.ndarray, subtype: str) -> bytes:
+    """Encode the samples of `to_pcm()` (frames x channels) as the little-endian data of a WAV file."""
+    if subtype == 'FLOAT':
+        return values.astype('<f4').tobytes()
+    if subtype == 'PCM_16':
+        return values.astype('<i2').tobytes()
+    if subtype == 'PCM_32':
+        return values.astype('<i4').tobytes()
+    # 24-bit: the low 16 bits and the high byte of every sample (assignment keeps the low bits)
+    values = values.ravel()
+    packed = np.empty(values.shape, dtype=[('low', '<u2'), ('high', 'i1')])
+    packed['low'] = values
+    packed['high'] = values >> 16
+    return packed.tobytes()
+
+
+def load_downmix_matrices(name: str) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Get the coefficients of a downmix for every source layout it supports.
+
+    Parameters
+    ----------
+    name : str
+        A matrix of `DOWNMIX_MATRICES` (e.g. 'loro'), or the path to a JSON file with the same
+        structure ({layout: {output channel: {input channel: gain}}}).
+
+    Raises
+    ------
+    ValueError
+        If the matrix is unknown or its JSON file can't be read.
+    """
+    if name.lower().endswith('.json'):
+        try:
+            with open(name) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Downmix matrix '{name}' could not be read: {e}")
+    if name.lower() in DOWNMIX_MATRICES:
+        return DOWNMIX_MATRICES[name.lower()]
+    raise ValueError(f"Unknown downmix matrix '{name}'. Use {', '.join(DOWNMIX_MATRICES)} or a .json file.")
+
+
+def downmix_matrix(name: str, layout: Any, *, normalize: bool = False) -> Tuple[List[str], np.ndarray]:
+    """Build the coefficient matrix of a downmix for a source layout.
+
+    Parameters
+    ----------
+    name : str
+        A matrix of `DOWNMIX_MATRICES` (e.g. 'loro'), or the path to a JSON file with the same
+        structure ({layout: {output channel: {input channel: gain}}}).
+    layout : layouts.Layout
+        The layout of the source file.
+    normalize : bool, optional
+        If True, the matrix is scaled down so that no output can exceed full scale (the absolute
+        gains of every output channel add up to 1 at most) (default is False).
+
+    Returns
+    -------
+    Tuple[List[str], np.ndarray]
+        The output channels (e.g. ['DL', 'DR']), and the matrix (input channels x output channels).
+
+    Raises
+    ------
+    ValueError
+        If the matrix is unknown, has no entry for the layout, or mixes a channel the layout doesn't have.
+    """
+    matrices = load_downmix_matrices(name)
+    if layout.name not in matrices:
+        raise ValueError(f"Downmix matrix '{name}' has no coefficients for {layout.name} "
+                         f"(only {', '.join(matrices) or 'none'}).")
+
+    outputs = list(matrices[layout.name])
+    matrix = np.zeros((layout.num_channels, len(outputs)))
+    for column, output in enumerate(outputs):
+        for channel, gain in matrices[layout.name][output].items():
+            if channel not in layout.suffixes:
+                raise ValueError(f"Downmix matrix '{name}' mixes '{channel}', which {layout.name} doesn't have.")
+            matrix[layout.suffixes.index(channel), column] = float(gain)
+
+    # Peak-safe: the largest sum of absolute gains of an output is the most it can reach (full scale inputs in phase)
+    if normalize:
+        matrix /= max(1.0, float(np.abs(matrix).sum(axis=0).max()))
+    return outputs, matrix
+
+
+def downmix(input_file: Path, outputs: List[Tuple[str, np.ndarray]], *, block_frames: int = BLOCK_FRAMES,
+            cancel_slot: Optional[int] = None) -> Dict[str, Any]:
+    """Mix a file down through coefficient matrices in one streaming pass.
+
+    Each block is read once and multiplied by every matrix (float32 matrix products, as ffmpeg's
+    'pan' filter mixes in float), so writing Lo/Ro and Lt/Rt costs one read of the file. Samples beyond full scale are clipped, and rounded to the bit depth of the input
+    (other formats are written as 24-bit).
+
+    PCM WAV files are decoded and encoded with NumPy views of their data chunk (see `decode_pcm()` and `pack_pcm()`),
+    which is several times faster than converting samples through `soundfile`. Other inputs and
+    outputs go through `soundfile`. Outputs are written under hidden temporary names (see
+    `helpers.staging_path()`) until complete. The input's waveform overview is built in the same
+    pass, unless it is already cached (see `peaks.missing_peaks_builder()`).
+
+    Parameters
+    ----------
+    input_file : Path
+        The path to the input file.
+    outputs : List[Tuple[str, np.ndarray]]
+        The path of each output and its matrix (input channels x output channels, see `downmix_matrix()`).
+    block_frames : int, optional
+        The number of frames read at a time (default is `BLOCK_FRAMES`).
+    cancel_slot : int, optional
+        The pool worker's cancel flag to check between blocks (set by `run_in_pool()`) (default is None).
+
+    Returns
+    -------
+    Dict[str, Any]
+        'paths' (the output paths), 'mode' ('raw' or 'soundfile') and 'clipped' (the number of
+        samples of each output that were beyond full scale).
+
+    Raises
+    ------
+    ValueError
+        If the number of channels of the file doesn't match the matrices.
+    cancellation.CancelledError
+        If the downmix was cancelled. The partial outputs are deleted.
+    """
+    matrices = [m.astype(np.float32) for _, m in outputs]
+    temp_paths = [staging_path(path) for path, _ in outputs]
+    clipped = [0] * len(outputs)
+
+    info = sf.info(str(input_file))
+    if any(m.shape[0] != info.channels for m in matrices):
+        raise ValueError(f"'{os.path.basename(input_file)}' has {info.channels} channels, the matrices {matrices[0].shape[0]}.")
+    subtype = info.subtype if info.subtype in RAW_SUBTYPES else 'PCM_24'
+    raw = info.format in ('WAV', 'WAVEX', 'RF64') and info.subtype in RAW_SUBTYPES \
+        and all(path.lower().endswith('.wav') for path, _ in outputs)
+    width, floating = RAW_SUBTYPES[subtype]
+    builder = missing_peaks_builder(input_file)
+
+    try:
+        with ExitStack() as stack:
+            # Reader: the data chunk of a PCM WAV file, or a soundfile
+            if raw:
+                src = stack.enter_context(open(input_file, 'rb'))
+                offset, size = find_wav_chunks(src)['data']
+                frames = size // (width * info.channels)
+                src.seek(offset)
+                blocks = read_pcm_blocks(src, frames=frames, channels=info.channels, subtype=subtype,
+                                         block_frames=block_frames)
+            else:
+                src = stack.enter_context(sf.SoundFile(input_file))
+                blocks = src.blocks(blocksize=block_frames, dtype='float32', always_2d=True)
+
+            # Writers: a WAV file whose data size is known up front, or a soundfile
+            writers, pads = [], []
+            for (path, m), temp_path in zip(outputs, temp_paths):
+                if raw:
+                    data_size = frames * m.shape[1] * width
+                    dst = stack.enter_context(open(temp_path, 'wb'))
+                    dst.write(wav_header(wav_fmt(m.shape[1], info.samplerate, width * 8, floating=floating), data_size))
+                    writers.append(lambda out, dst=dst: dst.write(pack_pcm(out, subtype)))
+                    # Data chunks are padded to an even size
+                    pads.append(lambda dst=dst, pad=data_size & 1: dst.write(b'\0' * pad))
+                else:
+                    container = NATIVE_CONTAINERS.get(os.path.splitext(path)[1].lstrip('.').lower(), 'WAV')
+                    dst = stack.enter_context(sf.SoundFile(temp_path, 'w', samplerate=info.samplerate,
+                                                           channels=m.shape[1], subtype=subtype, format=container))
+                    bits = SUBTYPE_BITS.get(subtype)
+                    writers.append(lambda out, dst=dst, bits=bits: dst.write(quantize(out, bits) if bits else out))
+
+            for block in blocks:
+                if cancel_slot is not None and _cancel_flags is not None and _cancel_flags[cancel_slot]:
+                    raise CancelledError(f"Downmix of '{os.path.basename(input_file)}' was cancelled.")
+                if builder is not None:
+                    builder.update(block)
+                for i, (write, m) in enumerate(zip(writers, matrices)):
+                    out = block @ m
+                    # Count clipped samples only in the blocks that have some
+                    if out.max(initial=0) > 1.0 or out.min(initial=0) < -1.0:
+                        clipped[i] += int(np.count_nonzero(np.abs(out) > 1.0))
+                    write(to_pcm(out, subtype) if raw else out)
+            for pad in pads:
+                pad()
+        for (path, _), temp_path in zip(outputs, temp_paths):
+            os.replace(temp_path, path)
+    except BaseException:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    if builder is not None:
+        store_peaks(input_file, builder)
+
+    return {'paths': [path for path, _ in outputs], 'mode': 'raw' if raw else 'soundfile', 'clipped': clipped}
+
+
+def run_in_pool(func: Callable[..., Any], *args, cancel: Optional[CancelToken] = None, **kwargs) -> Any:
+    """Run a function of this module that takes a `cancel_slot` (e.g. `downmix()`) in the shared process pool, and wait for it.
+
+    Cancelling `cancel` (default is None, which uses the current token, if any) sets the function's cancel flag.
+    """
+    pool = get_pool()
+    cancel = cancel or current_token()
+    slot = next(_next_slot) % CANCEL_SLOTS
+    _cancel_flags[slot] = False
+
+    future = pool.submit(func, *args, cancel_slot=slot, **kwargs)
+    remove = cancel.on_cancel(lambda: _cancel_flags.__setitem__(slot, True)) if cancel else None
+    try:
+        return future.result()
+    finally:
+        if remove is not None:
+            remove()
+
+
+# BENCHMARK
+
+def _bench_signal(frames: int, channels: int, rate: int) -> np.ndarray:
+    """Generate a test signal: a few sines per channel, below the passband edge of both engines."""
+    rng = np.random.default_rng(0)
+    t = np.arange(frames) / rate
+    data = np.zeros((frames, channels))
+    for ch in range(channels):
+        for freq in rng.uniform(50, 16000, 4):
+            data[:, ch] += 0.2 * np.sin(2 * np.pi * freq * t + rng.uniform(0, 2 * np.pi))
+    return data
+
+
+def compare(a_path: Path, b_path: Path, *, edge: int = 4096) -> Dict[str, Any]:
+    """Compare the samples of two files (e.g. the native and ffmpeg outputs of the same conversion).
+
+    Returns
+    -------
+    Dict[str, Any]
+        'identical' (bit-identical samples), 'frames' (both lengths), and 'max_diff_db' and 'rms_diff_db'
+        (the largest and RMS difference in dBFS, ignoring `edge` frames at both ends).
+    """
+    a, _ = sf.read(a_path, dtype='float64', always_2d=True)
+    b, _ = sf.read(b_path, dtype='float64', always_2d=True)
+    frames = min(len(a), len(b))
+    identical = len(a) == len(b) and np.array_equal(a, b)
+    body = slice(edge, max(edge, frames - edge)) if frames > 4 * edge else slice(0, frames)
+    diff = a[:frames][body] - b[:frames][body]
+
+    def db(value):
+        return round(20 * np.log10(value), 1) if value > 0 else None
+
+    return {
+        'identical': bool(identical),
+        'frames': [len(a), len(b)],
+        'max_diff_db': db(float(np.abs(diff).max())) if diff.size else None,
+        'rms_diff_db': db(float(np.sqrt(np.mean(diff ** 2)))) if diff.size else None,
+    }
+
+
+def bench(*, duration: float = 30.0, channels: int = 6, cases: Optional[List[Tuple[int, str, int, str]]] = None) -> List[Dict[str, Any]]:
+    """Time the native engine against ffmpeg, and compare their outputs.
+
+    Parameters
+    ----------
+    duration : float, optional
+        The length of the test files, in seconds (default is 30.0).
+    channels : int, optional
+        The number of channels of the test files (default is 6).
+    cases : List[Tuple[int, str, int, str]], optional
+        (input rate, input subtype, output rate, output codec) of each conversion to benchmark
+        (default is None, which runs bit depth changes and the common rate changes).
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One dictionary per case, with 'case', 'native' and 'ffmpeg' (seconds), 'winner',
+        and the result of `compare()`.
+    """
+    from helpers import get_ffmpeg
+
+    cases = cases or [
+        (48000, 'PCM_16', 48000, 'pcm_s24le'),
+        (48000, 'PCM_24', 48000, 'pcm_s16le'),
+        (44100, 'PCM_24', 48000, 'pcm_s24le'),
+        (48000, 'PCM_24', 44100, 'pcm_s24le'),
+        (48000, 'PCM_24', 96000, 'pcm_s24le'),
+        (96000, 'PCM_24', 48000, 'pcm_s24le'),
+    ]
+    ffmpeg = get_ffmpeg()
+    report = []
+
+    with tempfile.TemporaryDirectory(prefix="pcm_bench_") as tmp_dir:
+        for in_rate, in_subtype, out_rate, codec in cases:
+            src = os.path.join(tmp_dir, f"in_{in_rate}_{in_subtype}.wav")
+            if not os.path.exists(src):
+                sf.write(src, _bench_signal(int(duration * in_rate), channels, in_rate), in_rate, subtype=in_subtype)
+            native_out = os.path.join(tmp_dir, "native.wav")
+            ffmpeg_out = os.path.join(tmp_dir, "ffmpeg.wav")
+
+            start = time.perf_counter()
+            transcode(src, native_out, sample_rate=out_rate, subtype=CODEC_SUBTYPES[codec], container='WAV')
+            native_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ffmpeg['-v', 'error', '-y', '-i', src, '-ar', str(out_rate), '-c:a', codec, ffmpeg_out]()
+            ffmpeg_time = time.perf_counter() - start
+
+            case = f"{in_rate // 1000 if in_rate % 1000 == 0 else in_rate / 1000}k {in_subtype} -> " \
+                   f"{out_rate // 1000 if out_rate % 1000 == 0 else out_rate / 1000}k {codec}"
+            result = {
+                'case': case,
+                'native': round(native_time, 3),
+                'ffmpeg': round(ffmpeg_time, 3),
+                'winner': 'native' if native_time < ffmpeg_time else 'ffmpeg',
+                **compare(native_out, ffmpeg_out),
+            }
+            report.append(result)
+            parity = 'bit-identical' if result['identical'] else \
+                f"max diff {result['max_diff_db']} dBFS, rms diff {result['rms_diff_db']} dBFS"
+            print(f"{case:<32} native {native_time:6.2f}s  ffmpeg {ffmpeg_time:6.2f}s  -> {result['winner']:<6}  ({parity})")
+    return report
+
+
+def bench_downmix(*, duration: float = 300.0, matrices: Tuple[str, ...] = ('loro', 'ltrt')) -> Dict[str, Any]:
+    """Time `downmix()` against the equivalent ffmpeg 'pan' filter graph on a generated 24-bit 5.1 file.
+
+    Returns
+    -------
+    Dict[str, Any]
+        'native' and 'ffmpeg' (seconds), and 'max_diff_lsb' (the largest difference of the outputs, in 24-bit steps).
+    """
+    from helpers import get_ffmpeg
+    from layouts import LAYOUTS
+
+    layout = LAYOUTS['5.1']
+    with tempfile.TemporaryDirectory(prefix="pcm_bench_") as tmp_dir:
+        src = os.path.join(tmp_dir, "in.wav")
+        sf.write(src, _bench_signal(int(duration * 48000), layout.num_channels, 48000) * 0.5, 48000, subtype='PCM_24')
+        outputs = [(os.path.join(tmp_dir, f"native_{name}.wav"), downmix_matrix(name, layout)[1]) for name in matrices]
+
+        start = time.perf_counter()
+        downmix(src, outputs)
+        native_time = time.perf_counter() - start
+
+        # One 'pan' per matrix, fed by one decode of the input
+        graph = f"[0:a]asplit={len(outputs)}{''.join(f'[in{i}]' for i in range(len(outputs)))}"
+        cmd = get_ffmpeg()['-v', 'error', '-y', '-i', src]
+        for i, (_, matrix) in enumerate(outputs):
+            mix = "|".join(f"c{column}=" + "+".join(f"{gain:.4f}*{layout.channels[row]}"
+                                                   for row, gain in enumerate(matrix[:, column]) if gain)
+                           for column in range(matrix.shape[1]))
+            graph += f";[in{i}]pan={matrix.shape[1]}c|{mix}[out{i}]"
+            cmd = cmd['-map', f'[out{i}]', '-c:a', 'pcm_s24le', os.path.join(tmp_dir, f"ffmpeg_{i}.wav")]
+        start = time.perf_counter()
+        cmd['-filter_complex', graph]()
+        ffmpeg_time = time.perf_counter() - start
+
+        diff = 0.0
+        for i, (path, _) in enumerate(outputs):
+            a, _ = sf.read(path, dtype='float64')
+            b, _ = sf.read(os.path.join(tmp_dir, f"ffmpeg_{i}.wav"), dtype='float64')
+            diff = max(diff, float(np.abs(a - b).max()) * 2 ** 23)
+
+    print(f"downmix {'+'.join(matrices)} ({duration:g}s of 5.1)  native {native_time:6.2f}s  "
+          f"ffmpeg pan {ffmpeg_time:6.2f}s  (max diff {diff:.0f} LSB)")
+    return {'native': round(native_time, 3), 'ffmpeg': round(ffmpeg_time, 3), 'max_diff_lsb': round(diff)}
+
+
+def main() -> None:
+    """Command-line interface of the native engine.
+
+    Usage:
+    python pcm_engine.py bench [--duration 30] [--channels 6]
+    python pcm_engine.py bench-downmix [--duration 300]
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the native PCM engine against ffmpeg.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('bench', help="Time both engines on generated files and compare their outputs.")
+    run.add_argument('--duration', type=float, default=30.0)
+    run.add_argument('--channels', type=int, default=6)
+    run = commands.add_parser('bench-downmix', help="Time 'downmix' against ffmpeg's 'pan' filter.")
+    run.add_argument('--duration', type=float, default=300.0)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'bench-downmix':
+            bench_downmix(duration=args.duration)
+        else:
+            bench(duration=args.duration, channels=args.channels)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+import numpy as np           # needs pip install (installed with soundfile)
+import soundfile as sf      # needs pip install
+from concurrent.futures import ThreadPoolExecutor
+from plumbum import local   # needs pip install
+from cache import get_cache_dir
+from helpers import SoundFilesUtils, create_outfldr, get_header_info
+from scheduler import Scheduler
+from tasks import Task, run_tasks
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Version of the plan format
+PLAN_VERSION = 1
+
+# Throughput model used until `calibrate()` has been run:
+# input bytes processed per second, and a fixed cost per task (process start-up, probing), in seconds
+DEFAULT_MODEL = {
+    'split': {'bytes_per_second': 300e6, 'overhead': 0.2},
+    'merge': {'bytes_per_second': 150e6, 'overhead': 0.2},
+    'conform': {'bytes_per_second': 150e6, 'overhead': 0.2},
+    'convert': {'bytes_per_second': 60e6, 'overhead': 0.2},
+    'qc': {'bytes_per_second': 200e6, 'overhead': 0.05},
+    'package': {'bytes_per_second': 150e6, 'overhead': 0.2},
+    'qc_video': {'bytes_per_second': 400e6, 'overhead': 0.2},
+    'remap': {'bytes_per_second': 2e9, 'overhead': 0.01},
+    'concat': {'bytes_per_second': 400e6, 'overhead': 0.05},
+    'downmix': {'bytes_per_second': 300e6, 'overhead': 0.3},
+    'normalize': {'bytes_per_second': 80e6, 'overhead': 0.2},
+}
+
+# Bytes per sample of the PCM codecs ffmpeg writes (wav/aiff/mov outputs without '-c:a' are 16-bit)
+PCM_BYTES = {
+    'pcm_u8': 1, 'pcm_s16le': 2, 'pcm_s16be': 2, 'pcm_s24le': 3, 'pcm_s24be': 3,
+    'pcm_s32le': 4, 'pcm_s32be': 4, 'pcm_f32le': 4, 'pcm_f32be': 4, 'pcm_f64le': 8, 'pcm_f64be': 8,
+}
+DEFAULT_PCM_CODEC = {'.wav': 'pcm_s16le', '.aiff': 'pcm_s16be', '.aif': 'pcm_s16be', '.mov': 'pcm_s16le'}
+
+# Header size allowed for each PCM output
+PCM_HEADER_BYTES = 100
+
+
+# Get the path of the calibrated throughput model
+def get_model_path() -> str:
+    """Get the path of the calibrated throughput model ('<cache_dir>/planner/model.json')."""
+    return os.path.join(get_cache_dir(), "planner", "model.json")
+
+
+# Load the throughput model
+def load_model() -> Tuple[Dict[str, Dict[str, float]], bool]:
+    """Load the throughput model.
+
+    Returns
+    -------
+    Tuple[Dict[str, Dict[str, float]], bool]
+        The model (operation -> 'bytes_per_second', 'overhead'), and True if it was calibrated.
+        Operations that were not calibrated use `DEFAULT_MODEL`.
+    """
+    model = {op: dict(values) for op, values in DEFAULT_MODEL.items()}
+    try:
+        with open(get_model_path()) as f:
+            calibrated = json.load(f)
+    except (OSError, ValueError):
+        return model, False
+    for op, values in calibrated.get('operations', {}).items():
+        model[op] = {'bytes_per_second': float(values['bytes_per_second']), 'overhead': float(values['overhead'])}
+    return model, True
+
+
+# Estimate the size of a task's outputs
+def estimate_output_bytes(task: Task, headers: Dict[str, Dict[str, Any]]) -> Dict[str, Optional[int]]:
+    """Estimate the size of each output of a task from its inputs' headers and its ffmpeg arguments.
+
+    Parameters
+    ----------
+    task : Task
+        The task.
+    headers : Dict[str, Dict[str, Any]]
+        The `helpers.get_header_info()` result of each input.
+
+    Returns
+    -------
+    Dict[str, Optional[int]]
+        Maps each output path to its estimated size in bytes, or None if it can't be estimated
+        (compressed formats, reports, inputs that aren't audio files...).
+
+    Notes
+    -----
+    A task with several outputs is assumed to write one channel per output (e.g. 'split'),
+    a task with one output all the channels of its inputs (e.g. 'merge', 'convert', 'conform').
+    """
+    argv = task.argv or []
+    codec = argv[argv.index('-c:a') + 1] if '-c:a' in argv[:-1] else None
+    rate = int(argv[argv.index('-ar') + 1]) if '-ar' in argv[:-1] else None
+
+    known = [headers[path] for path in task.inputs if path in headers]
+    sizes = {}
+    for output in task.outputs:
+        ext = os.path.splitext(output)[1].lower()
+        out_codec = codec or DEFAULT_PCM_CODEC.get(ext)
+        if len(known) != len(task.inputs) or out_codec not in PCM_BYTES or task.action is not None:
+            sizes[output] = None
+            continue
+        in_rate = known[0]['sample_rate']
+        frames = max(header['frames'] for header in known) * (rate or in_rate) / in_rate
+        channels = 1 if len(task.outputs) > 1 else sum(header['channels'] for header in known)
+        sizes[output] = int(frames * channels * PCM_BYTES[out_codec]) + PCM_HEADER_BYTES
+    return sizes
+
+
+# Estimate the wall-clock time of tasks run on a number of slots
+def estimate_wall_time(durations: List[float], slots: int) -> float:
+    """Estimate the wall-clock time of running tasks longest-first on `slots` concurrent workers."""
+    finish = [0.0] * max(1, slots)
+    for duration in sorted(durations, reverse=True):
+        i = finish.index(min(finish))
+        finish[i] += duration
+    return max(finish)
+
+
+# Build the execution plan of an operation
+def build_plan(operation: str, in_path: Path, out_path: Path, *,
+               options: Optional[Dict[str, Any]] = None,
+               batch_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Build the full execution plan of an operation without running anything.
+
+    Parameters
+    ----------
+    operation : str
+        The operation (a key of `audio_operations.FUNC_TYPE`).
+    in_path : Path
+        The path to the input file or folder.
+    out_path : Path
+        The path to the folder the operation's 'out_*' folder will be created in.
+    options : Dict[str, Any], optional
+        Keyword arguments for the operation function.
+    batch_options : Dict[str, Any], optional
+        Keyword arguments for `core_functions.repeat_operation()` ('jobs', 'cores', 'io_jobs', 'job_kind').
+
+    Returns
+    -------
+    Dict[str, Any]
+        A JSON-ready plan with:
+        - 'operation', 'input', 'out_dir', 'options', 'batch_options', 'list_type'.
+        - 'files': The files selected by `list_type` (for folder inputs).
+        - 'groups': The multi-mono groups formed by `SoundFilesUtils.get_monodict()` (for folder inputs).
+        - 'skipped': Maps the files that can't be processed to the reason.
+        - 'tasks': For each task, its 'inputs', 'outputs', 'argv', 'method', 'output_bytes' and 'estimated_seconds'.
+        - 'estimate': Total 'output_bytes', 'task_seconds' and 'wall_seconds', and the throughput 'model' used.
+
+    Notes
+    -----
+    The 'out_*' folder is only reserved while planning (it is created, then removed again if empty),
+    so that the paths in the plan are the ones a real run would use.
+    """
+    from audio_operations import FUNC_TYPE
+
+    if operation not in FUNC_TYPE:
+        raise ValueError(f"Operation Type incorrect: '{operation}'")
+    func, repeat, list_type, job_kind, plan_func = FUNC_TYPE[operation][:5]
+    options = dict(options or {})
+    batch_options = {'job_kind': job_kind, **(batch_options or {})} if repeat else {}
+    in_path = os.path.abspath(in_path)
+
+    plan = {
+        'version': PLAN_VERSION,
+        'operation': operation,
+        'input': in_path,
+        'out_dir': None,
+        'options': options,
+        'batch_options': batch_options,
+        'list_type': list_type,
+        'files': [],
+        'groups': {},
+        'skipped': {},
+        'tasks': [],
+    }
+
+    # Select files
+    if os.path.isdir(in_path):
+        sfu = SoundFilesUtils(user_path=in_path)
+        plan['files'] = list(sfu.list_by_type(list_type))
+        plan['groups'] = sfu.monodict
+        inputs = [os.path.join(in_path, sfile) for sfile in plan['files']] if repeat else [in_path]
+    else:
+        inputs = [in_path]
+
+    # Plan every input into the (temporarily reserved) output folder
+    out_dir = create_outfldr(operation, out_dir=out_path)
+    plan['out_dir'] = out_dir
+    tasks = []
+    try:
+        for path in inputs:
+            try:
+                tasks.extend(plan_func(path, out_dir, **options))
+            except Exception as e:
+                plan['skipped'][os.path.basename(path)] = str(e)
+    finally:
+        try:
+            os.rmdir(out_dir)
+        except OSError:
+            pass
+
+    # Estimate sizes and durations
+    model, calibrated = load_model()
+    rates = model.get(operation, DEFAULT_MODEL['convert'])
+    for task in tasks:
+        headers = {}
+        for path in task.inputs:
+            try:
+                headers[path] = get_header_info(path)
+            except ValueError:
+                pass
+        input_bytes = sum(os.path.getsize(path) for path in task.inputs if os.path.isfile(path))
+        plan['tasks'].append({
+            **task.to_json(),
+            'input_bytes': input_bytes,
+            'output_bytes': estimate_output_bytes(task, headers),
+            'estimated_seconds': round(rates['overhead'] + input_bytes / rates['bytes_per_second'], 3),
+        })
+
+    # Tasks of repeated operations run concurrently (see `scheduler.Scheduler`)
+    slots = plan_slots(plan)
+    durations = [task['estimated_seconds'] for task in plan['tasks']]
+    plan['estimate'] = {
+        'output_bytes': sum(size or 0 for task in plan['tasks'] for size in task['output_bytes'].values()),
+        'task_seconds': round(sum(durations), 3),
+        'wall_seconds': round(estimate_wall_time(durations, slots), 3),
+        'slots': slots,
+        'model': rates,
+        'calibrated': calibrated,
+    }
+    return plan
+
+
+# Number of tasks of a plan that run at once
+def plan_slots(plan: Dict[str, Any]) -> int:
+    """Get the number of tasks of a plan that run concurrently (1 if the operation is not repeated)."""
+    batch = plan.get('batch_options') or {}
+    if not batch:
+        return 1
+    scheduler = Scheduler(cores=batch.get('cores'), max_jobs=batch.get('jobs'), io_jobs=batch.get('io_jobs', 2))
+    return scheduler.io_jobs if batch.get('job_kind') == 'io' else scheduler.max_jobs
+
+
+# Execute a plan exactly as it was written
+def run_plan(plan: Dict[str, Any], *, jobs: Optional[int] = None) -> Dict[str, Any]:
+    """Run the tasks of a plan created by `build_plan()`.
+
+    ffmpeg tasks run with the argument vectors stored in the plan, unchanged. Python tasks
+    (e.g. 'qc', or fast-path copies) have no argument vector, so they are planned again for
+    their input and the task with the same outputs is run.
+
+    Parameters
+    ----------
+    plan : Dict[str, Any]
+        The plan.
+    jobs : int, optional
+        The number of tasks run at once (default is None, which uses the plan's 'slots').
+
+    Returns
+    -------
+    Dict[str, Any]
+        The result of `tasks.run_tasks()` ('outputs', 'method' and, if a task failed, 'errors').
+    """
+    from audio_operations import FUNC_TYPE
+
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version: {plan.get('version')}")
+    plan_func = FUNC_TYPE[plan['operation']][4]
+    os.makedirs(plan['out_dir'], exist_ok=True)
+
+    tasks = []
+    for entry in plan['tasks']:
+        dirs = sorted({os.path.dirname(output) for output in entry['outputs']})
+        if entry['argv']:
+            cmd = local[entry['argv'][0]][entry['argv'][1:]]
+            task = Task(entry['inputs'], entry['outputs'], cmd=cmd, method=entry['method'], dirs=dirs,
+                        message=f"'{os.path.basename(entry['inputs'][0])}' done.")
+            if plan['options'].get('preallocate'):
+                task.stage_outputs(entry['output_bytes'])
+            tasks.append(task)
+        else:
+            replanned = plan_func(entry['inputs'][0], plan['out_dir'], **plan['options'])
+            tasks.extend(task for task in replanned if task.outputs == entry['outputs'])
+
+    # Run tasks, one run_tasks() call per task so that a failure doesn't stop the others
+    results = []
+    def run_one(task):
+        try:
+            results.append(run_tasks([task]))
+        except RuntimeError:
+            results.append({'outputs': [], 'method': None,
+                            'errors': {os.path.basename(task.inputs[0]): "failed"}})
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs or plan_slots(plan))) as pool:
+        list(pool.map(run_one, tasks))
+
+    outputs = [output for result in results for output in result['outputs']]
+    errors = {label: error for result in results for label, error in result.get('errors', {}).items()}
+    methods = {result['method'] for result in results if result['method']}
+    result = {'outputs': outputs, 'method': methods.pop() if len(methods) == 1 else ('mixed' if methods else None)}
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+# Calibrate the throughput model with benchmark runs
+def calibrate(operations: Optional[List[str]] = None, *, durations: Tuple[float, float] = (10.0, 60.0),
+              channels: int = 6) -> Dict[str, Dict[str, float]]:
+    """Benchmark operations on generated files and save the fitted throughput model.
+
+    Every operation is run on a short and a long file (noise, 44.1kHz 24-bit), and a line
+    `seconds = overhead + input_bytes / bytes_per_second` is fitted through the two timings.
+
+    Parameters
+    ----------
+    operations : List[str], optional
+        The operations to calibrate (default is None, which calibrates all the audio operations of `DEFAULT_MODEL`).
+    durations : Tuple[float, float], optional
+        The lengths of the two benchmark files, in seconds (default is (10.0, 60.0)).
+    channels : int, optional
+        The number of channels of the benchmark files (default is 6).
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        The calibrated model (also saved to `get_model_path()`).
+    """
+    from audio_operations import FUNC_TYPE
+
+    operations = operations or [op for op in DEFAULT_MODEL if FUNC_TYPE[op][2] != 'video']
+    for op in operations:
+        if FUNC_TYPE[op][2] == 'video':
+            raise ValueError(f"'{op}' can't be calibrated (it needs video files).")
+    rate, suffixes = 44100, ['L', 'R', 'C', 'LFE', 'Ls', 'Rs'][:channels]
+    fitted = {}
+
+    with tempfile.TemporaryDirectory(prefix="calibrate_") as tmp_dir:
+        for op in operations:
+            plan_func = FUNC_TYPE[op][4]
+            points = []
+            for i, duration in enumerate(durations):
+                in_dir = os.path.join(tmp_dir, f"{op}_{i}")
+                out_dir = os.path.join(tmp_dir, f"{op}_{i}_out")
+                os.makedirs(in_dir)
+                os.makedirs(out_dir)
+                data = (np.random.default_rng(i).standard_normal((int(rate * duration), channels)) * 0.1).astype('float32')
+
+                # 'merge' and 'package' work on a folder of mono files, the others on a multi-channel file
+                if op in ('merge', 'package'):
+                    for ch, suffix in enumerate(suffixes):
+                        sf.write(os.path.join(in_dir, f"bench.{suffix}.wav"), data[:, ch], rate, subtype='PCM_24')
+                    target = in_dir
+                else:
+                    target = os.path.join(in_dir, "bench.wav")
+                    sf.write(target, data, rate, subtype='PCM_24')
+                size = sum(os.path.getsize(os.path.join(in_dir, name)) for name in os.listdir(in_dir))
+
+                # Time planning and running, as a real run does
+                start = time.perf_counter()
+                run_tasks(plan_func(target, out_dir, **({'no_cache': True} if op == 'qc' else {})))
+                points.append((size, time.perf_counter() - start))
+
+            (b1, t1), (b2, t2) = points
+            bytes_per_second = (b2 - b1) / (t2 - t1) if t2 > t1 else b2 / max(t2, 1e-3)
+            overhead = max(0.0, t1 - b1 / bytes_per_second)
+            fitted[op] = {'bytes_per_second': round(bytes_per_second), 'overhead': round(overhead, 3)}
+            print(f"'{op}': {bytes_per_second / 1e6:.1f} MB/s, {overhead:.3f}s per task")
+
+    save_model(fitted)
+    return fitted
+
+
+def calibrate_from_history(operations: Optional[List[str]] = None, *, db_path: Optional[Path] = None) -> Dict[str, Dict[str, float]]:
+    """Fit the throughput model from the runs recorded on this machine, and save it.
+
+    Unlike `calibrate()`, nothing is run: real batches (see `history.fit_throughput()`) are used instead of benchmarks.
+
+    Parameters
+    ----------
+    operations : List[str], optional
+        The operations to calibrate (default is None, which calibrates every operation in the history).
+    db_path : Path, optional
+        The path to the history database (default is None, which uses `history.get_history_path()`).
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        The calibrated operations (also saved to `get_model_path()`).
+
+    Raises
+    ------
+    ValueError
+        If the history has no usable runs.
+    """
+    from history import fit_throughput
+
+    fitted = fit_throughput(db_path, operations=operations)
+    if not fitted:
+        raise ValueError("The run history has no successful runs to calibrate from.")
+    for op, model in fitted.items():
+        print(f"'{op}': {model['bytes_per_second'] / 1e6:.1f} MB/s, {model['overhead']:.3f}s per task")
+    save_model(fitted)
+    return fitted
+
+
+def save_model(fitted: Dict[str, Dict[str, float]]) -> None:
+    """Save calibrated operations to `get_model_path()`, merged with the operations calibrated before."""
+    path = get_model_path()
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    saved.setdefault('operations', {}).update(fitted)
+    saved['calibrated'] = time.time()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(saved, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def main() -> None:
+    """Command-line interface of the planner.
+
+    Plans are created with `python audio_operations.py [in] [out] [operation] --plan[=plan.json]`.
+
+    Usage:
+    python planner.py run [plan.json] [--jobs N]
+    python planner.py calibrate [--ops split,convert] [--durations 10,60]
+    python planner.py calibrate --from-history[=runs.sqlite] [--ops split,convert]
+    """
+    parser = argparse.ArgumentParser(description="Run execution plans and calibrate the planner's throughput model.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Run a plan unchanged.")
+    run.add_argument('plan')
+    run.add_argument('--jobs', type=int)
+
+    cal = commands.add_parser('calibrate', help="Benchmark operations and save the throughput model.")
+    cal.add_argument('--ops', help="Comma-separated operations (default: all).")
+    cal.add_argument('--durations', default="10,60", help="Lengths of the two benchmark files, in seconds.")
+    cal.add_argument('--from-history', nargs='?', const=True, metavar='DB',
+                     help="Fit the model from recorded runs instead of benchmarks (see history.py).")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'run':
+            with open(args.plan) as f:
+                plan = json.load(f)
+            print(f"{plan['operation'].upper()} PLAN STARTED...\n")
+            result = run_plan(plan, jobs=args.jobs)
+            print(f"\n{plan['operation'].upper()} PLAN FINISHED. \n -> Output folder: {plan['out_dir']}")
+            sys.exit(1 if result.get('errors') else 0)
+        else:
+            operations = args.ops.split(',') if args.ops else None
+            if args.from_history:
+                from history import resolve_history_path
+                calibrate_from_history(operations, db_path=resolve_history_path(args.from_history))
+            else:
+                durations = tuple(float(value) for value in args.durations.split(','))
+                calibrate(operations, durations=durations)
+            print(f"\nModel saved to '{get_model_path()}'.")
+    except (OSError, ValueError, KeyError) as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import time
+import soundfile as sf      # needs pip install
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from helpers import FFMPEG_THREADS
+from cancellation import CANCEL_TOKEN, CancelToken, CancelledError
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Bytes per second of a 24-bit/48kHz mono file - used to guess a cost when a file can't be probed
+FALLBACK_BYTES_PER_SECOND = 48000 * 3
+
+
+# Estimate how expensive a file is to process
+def estimate_cost(file_path: Path) -> float:
+    """Estimate the processing cost of an audio file.
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the audio file.
+
+    Returns
+    -------
+    float
+        The estimated cost, in channel-seconds (duration x channels).
+
+    Notes
+    -----
+    The cost is read from the file's header with `soundfile`, so no audio is decoded.
+    If the header can't be read, the cost is guessed from the file size.
+    """
+    try:
+        info = sf.info(file_path)
+        return float(info.duration) * int(info.channels)
+    except Exception:
+        try:
+            return os.path.getsize(file_path) / FALLBACK_BYTES_PER_SECOND
+        except OSError:
+            return 0.0
+
+
+class Job:
+    """A single file to be processed by the `Scheduler`.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the input file.
+    kind : str, optional
+        'cpu' for jobs bound by encoding/filtering, 'io' for jobs bound by disk throughput (default is 'cpu').
+    cost : float, optional
+        The estimated cost of the job (default is None, which uses `estimate_cost()`).
+
+    Attributes
+    ----------
+    threads : int or None
+        The number of threads given to ffmpeg for this job (set when the job starts).
+    result : Any
+        The value returned by the operation function.
+    error : Exception or None
+        The exception raised by the operation function, if any.
+    elapsed : float
+        Wall-clock time the job took, in seconds.
+    """
+
+    def __init__(self, path: Path, *, kind: str = 'cpu', cost: Optional[float] = None) -> None:
+        if kind not in ('cpu', 'io'):
+            raise ValueError(f"Invalid job kind '{kind}'. Use 'cpu' or 'io'.")
+        self.path = path
+        self.kind = kind
+        self.cost = estimate_cost(path) if cost is None else cost
+        self.threads = None
+        self.result = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def __repr__(self) -> str:
+        return f"Job({os.path.basename(self.path)!r}, kind={self.kind!r}, cost={self.cost:.1f})"
+
+
+class Scheduler:
+    """Run batch jobs concurrently within a fixed core budget.
+
+    Jobs are started longest-first (by estimated cost) so that a long file doesn't end up
+    running alone at the end of a batch. The core budget is split between the jobs that are
+    running, and each job passes its share to ffmpeg through `-threads`/`-filter_threads`.
+    I/O-heavy jobs are capped separately, so that they don't compete for the same disk.
+
+    Parameters
+    ----------
+    cores : int, optional
+        The total number of cores the batch may use (default is None, which uses `os.cpu_count()`).
+    max_jobs : int, optional
+        The maximum number of concurrent jobs (default is None, which uses half of `cores`).
+    io_jobs : int, optional
+        The maximum number of concurrent 'io' jobs (default is 2).
+
+    Examples
+    --------
+    >>> jobs = [Job(path) for path in paths]
+    >>> Scheduler(cores=8).run(jobs, lambda path: split_multi_sf(path, out_dir))
+    """
+
+    def __init__(self, *, cores: Optional[int] = None, max_jobs: Optional[int] = None, io_jobs: int = 2) -> None:
+        self.cores = max(1, int(cores or os.cpu_count() or 1))
+        self.max_jobs = max(1, int(max_jobs or max(1, self.cores // 2)))
+        self.io_jobs = max(1, int(io_jobs))
+
+    def thread_share(self, active: int, used: int) -> int:
+        """Get the number of ffmpeg threads for a job that is about to start.
+
+        Parameters
+        ----------
+        active : int
+            The number of jobs that will be running concurrently (including the new one).
+        used : int
+            The number of threads already given to running jobs.
+
+        Returns
+        -------
+        int
+            The job's share of the core budget (at least 1).
+        """
+        share = self.cores // max(1, min(self.max_jobs, active))
+        return max(1, min(share, self.cores - used))
+
+    def run(self, jobs: List[Job], func: Callable[[Path], Any], *, cancel: Optional[CancelToken] = None) -> List[Job]:
+        """Run `func` for every job and wait for all of them to finish.
+
+        Parameters
+        ----------
+        jobs : List[Job]
+            The jobs to run.
+        func : Callable(inPath)
+            The function to run for each job's path. Errors are stored in `Job.error`.
+        cancel : CancelToken, optional
+            Once cancelled, no new job starts (their `Job.error` is a `cancellation.CancelledError`),
+            and the running jobs see the token as their current token (default is None, which uses
+            the current token, if any).
+
+        Returns
+        -------
+        List[Job]
+            The jobs, in the order they were started.
+        """
+        cancel = cancel or CANCEL_TOKEN.get()
+        pending = sorted(jobs, key=lambda job: job.cost, reverse=True)
+        started = []
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as pool:
+            while pending or running:
+
+                # Stop starting jobs once the run is cancelled
+                if cancel is not None and cancel.cancelled and pending:
+                    for job in pending:
+                        job.error = CancelledError("Cancelled before it started.")
+                    pending = []
+
+                # Start as many jobs as slots allow, longest first
+                i = 0
+                while i < len(pending) and len(running) < self.max_jobs:
+                    job = pending[i]
+                    io_running = sum(1 for j in running.values() if j.kind == 'io')
+                    if job.kind == 'io' and io_running >= self.io_jobs:
+                        i += 1
+                        continue
+
+                    pending.pop(i)
+                    used = sum(j.threads for j in running.values())
+                    job.threads = self.thread_share(len(pending) + len(running) + 1, used)
+                    running[pool.submit(self._run_job, job, func, cancel)] = job
+                    started.append(job)
+
+                # Wait for (at least) one job to finish, or for a cancel
+                done, _ = wait(running, timeout=0.2 if cancel is not None else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+
+        return started
+
+    @staticmethod
+    def _run_job(job: Job, func: Callable[[Path], Any], cancel: Optional[CancelToken] = None) -> None:
+        """Run a single job with its thread share and the batch's cancel token (called in a worker thread)."""
+        token = FFMPEG_THREADS.set(job.threads)
+        cancel_token = CANCEL_TOKEN.set(cancel)
+        start = time.perf_counter()
+        try:
+            job.result = func(job.path)
+        except Exception as e:
+            job.error = e
+        finally:
+            job.elapsed = time.perf_counter() - start
+            FFMPEG_THREADS.reset(token)
+            CANCEL_TOKEN.reset(cancel_token)
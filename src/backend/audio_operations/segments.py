@@ -0,0 +1,128 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from math import gcd
+from helpers import concat_wav
+from tasks import Task
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Shortest segment '--segments=auto' cuts a file into (seconds): shorter files run serially
+MIN_SEGMENT_SECONDS = 60.0
+
+# ffmpeg seeks at least this long before a segment, and 'atrim' cuts its exact first sample (seconds)
+SEEK_MARGIN = 1.0
+
+
+# Decide how many segments a file is processed in
+def resolve_segments(value: Union[str, int, None], duration: float) -> int:
+    """Get the number of segments to cut a file into.
+
+    Parameters
+    ----------
+    value : str, int or None
+        The 'segments' option: a number, 'auto' (one segment per core, each at least
+        `MIN_SEGMENT_SECONDS` long), or None/0/1 (no segments).
+    duration : float
+        The length of the file, in seconds.
+
+    Returns
+    -------
+    int
+        The number of segments (1 means the file is processed in one piece).
+
+    Raises
+    ------
+    ValueError
+        If `value` is not a number or 'auto'.
+    """
+    if value in (None, False, '', 0, '0'):
+        return 1
+    if str(value).lower() == 'auto':
+        return max(1, min(os.cpu_count() or 1, int(duration // MIN_SEGMENT_SECONDS)))
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid segments '{value}'. Use a number or 'auto'.")
+
+
+def segment_ranges(frames: int, count: int, *, align: int = 1) -> List[Tuple[int, int]]:
+    """Cut `frames` frames into `count` contiguous [start, stop) ranges, with no gaps or overlaps.
+
+    Every boundary is a multiple of `align` (e.g. `pcm_engine.CELL_FRAMES`), so fewer ranges
+    are returned if the file is too short.
+
+    Example
+    -------
+    >>> segment_ranges(100, 3, align=10)
+    [(0, 40), (40, 80), (80, 100)]
+    """
+    size = -(-frames // max(1, count))
+    size = max(align, -(-size // align) * align)
+    return [(start, min(start + size, frames)) for start in range(0, frames, size)] or [(0, 0)]
+
+
+def seek_frame(start: int, sample_rate: int) -> int:
+    """Get the frame ffmpeg seeks to ('-ss') before a segment that starts at frame `start`.
+
+    The frame is at least `SEEK_MARGIN` seconds earlier, and its time is a whole number of
+    microseconds (ffmpeg's time unit), so that ffmpeg's decoding starts exactly at it and an 'atrim'
+    of `start - seek_frame()` samples starts exactly at `start`.
+
+    Example
+    -------
+    >>> seek_frame(480000, 48000)     # 9 s
+    432000
+    """
+    step = sample_rate // gcd(sample_rate, 1000000)
+    return max(0, int(start - SEEK_MARGIN * sample_rate) // step * step)
+
+
+def segments_dir(output: str) -> str:
+    """Get the hidden folder the segments of `output` are written to (next to it, so joining them is a local copy)."""
+    folder, filename = os.path.split(output)
+    return os.path.join(folder, f".{os.path.splitext(filename)[0]}.segments")
+
+
+# Run the tasks of the segments of a file at once
+def run_segment_tasks(tasks: List[Task], *, workers: Optional[int] = None) -> None:
+    """Run segment tasks concurrently (each is usually one ffmpeg process), and wait for all of them.
+
+    Tasks run in threads that share the caller's context, so that they see its cancel token
+    and ffmpeg thread count.
+
+    Raises
+    ------
+    Exception
+        The first error of a task, once every task has stopped. The outputs of every task are deleted.
+    """
+    with ThreadPoolExecutor(max_workers=workers or len(tasks) or 1, thread_name_prefix='segment') as executor:
+        futures = [executor.submit(copy_context().run, task.run) for task in tasks]
+        errors = [future.exception() for future in futures]
+    errors = [error for error in errors if error is not None]
+    if errors:
+        for task in tasks:
+            task.clean()
+        raise errors[0]
+
+
+def join_segments(parts: Dict[str, List[str]]) -> str:
+    """Join the segments of each output (see `helpers.concat_wav()`) and delete them.
+
+    Parameters
+    ----------
+    parts : Dict[str, List[str]]
+        Maps each output path to the paths of its segments, in order.
+
+    Returns
+    -------
+    str
+        The copy method used by the last join.
+    """
+    method = None
+    for output, segment_paths in parts.items():
+        method = concat_wav(segment_paths, output)
+        for path in segment_paths:
+            os.remove(path)
+    return method
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import api
+from flask import Flask, Response, jsonify, request   # needs pip install
+from helpers import create_outfldr
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Job states - a job ends in one of the last three
+JOB_STATES = ('queued', 'running', 'finished', 'failed', 'cancelled')
+
+
+class ServiceJob:
+    """A job submitted to the HTTP service.
+
+    Attributes
+    ----------
+    id : str
+        The id of the job.
+    operation : str
+        The operation (a key of `audio_operations.FUNC_TYPE`).
+    input : str
+        The path to the input file or folder.
+    output : str
+        The path to the folder the job's 'out_*' folder is created in.
+    options : Dict[str, Any]
+        Keyword arguments for the operation function.
+    status : str
+        One of `JOB_STATES`.
+    events : List[Dict[str, Any]]
+        The per-file events of the job (see `api.run()`), in order.
+    result : api.RunResult or None
+        The result, once the job has finished.
+    finished : float or None
+        When the job ended (finished, failed or cancelled), as a timestamp.
+    """
+
+    def __init__(self, operation: str, input: str, output: str, options: Dict[str, Any]) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.operation = operation
+        self.input = input
+        self.output = output
+        self.options = options
+        self.status = 'queued'
+        self.error = None
+        self.out_dir = None
+        self.events = []
+        self.result = None
+        self.created = time.time()
+        self.finished = None
+        self.task = None
+        self.changed = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        """bool: True once the job has finished, failed or been cancelled."""
+        return self.status in JOB_STATES[2:]
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        """Record an event and wake up the streams waiting for it."""
+        with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+
+    def set_status(self, status: str, error: Optional[str] = None) -> None:
+        """Change the job's status (and record it as an event).
+
+        Both happen under the condition's lock, so a stream that sees the job as done has also seen its last event.
+        """
+        with self.changed:
+            self.status = status
+            self.error = error
+            if self.done:
+                self.finished = time.time()
+            self.events.append({'event': 'status', 'status': status, 'error': error})
+            self.changed.notify_all()
+
+    def to_json(self, *, with_result: bool = True) -> Dict[str, Any]:
+        """Convert the job to a JSON-ready dictionary."""
+        data = {
+            "id": self.id,
+            "operation": self.operation,
+            "input": self.input,
+            "output": self.output,
+            "options": self.options,
+            "status": self.status,
+            "error": self.error,
+            "out_dir": self.out_dir,
+            "created": self.created,
+            "finished": self.finished,
+            "events": len(self.events),
+        }
+        if with_result and self.result is not None:
+            data["result"] = self.result.to_json()
+        return data
+
+
+class JobService:
+    """Runs submitted jobs on one event loop, in a background thread of a single warm process.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The maximum number of tasks (ffmpeg processes) running at once, across all jobs
+        (default is None, which uses `os.cpu_count()`).
+    max_jobs : int, optional
+        The maximum number of jobs running at once. Further jobs wait in the 'queued' state (default is 4).
+    retention : float, optional
+        How long ended jobs (and their events) are kept, in seconds (default is 3600).
+    max_finished : int, optional
+        The maximum number of ended jobs kept. The oldest are forgotten first (default is 100).
+
+    Notes
+    -----
+    Probe results are cached by `helpers.get_audio_info()` in this process, so they are shared
+    by every job the service runs.
+    """
+
+    def __init__(self, *, workers: Optional[int] = None, max_jobs: int = 4,
+                 retention: float = 3600.0, max_finished: int = 100) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.retention = retention
+        self.max_finished = max_finished
+        self.jobs: Dict[str, ServiceJob] = {}
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='job-service', daemon=True)
+        self.thread.start()
+
+        # Semaphores must be created on the loop they are used on
+        async def make_semaphores():
+            return asyncio.Semaphore(self.workers), asyncio.Semaphore(self.max_jobs)
+        self.task_slots, self.job_slots = asyncio.run_coroutine_threadsafe(make_semaphores(), self.loop).result()
+
+    def submit(self, operation: str, input: str, output: str, options: Optional[Dict[str, Any]] = None) -> ServiceJob:
+        """Submit a job.
+
+        Parameters
+        ----------
+        operation : str
+            The operation (a key of `audio_operations.FUNC_TYPE`).
+        input : str
+            The path to the input file or folder.
+        output : str
+            The path to an existing folder. The job's 'out_<operation>' folder is created in it.
+        options : Dict[str, Any], optional
+            Keyword arguments for the operation function.
+
+        Returns
+        -------
+        ServiceJob
+            The submitted job.
+
+        Raises
+        ------
+        ValueError
+            If the operation, an option or a path is invalid.
+        """
+        from audio_operations import FUNC_TYPE, split_options
+
+        if operation not in FUNC_TYPE:
+            raise ValueError(f"Operation Type incorrect: '{operation}'")
+        options, _ = split_options(options or {}, FUNC_TYPE[operation][0])
+        if not os.path.exists(input):
+            raise ValueError(f"'{input}' is not a valid path.")
+        if not os.path.isdir(output):
+            raise ValueError(f"'{output}' is not a valid path.")
+
+        job = ServiceJob(operation, os.path.abspath(input), os.path.abspath(output), options)
+        with self.lock:
+            self.evict()
+            self.jobs[job.id] = job
+        job.task = asyncio.run_coroutine_threadsafe(self._run(job), self.loop)
+        return job
+
+    def evict(self) -> None:
+        """Forget ended jobs older than `retention`, and the oldest ones beyond `max_finished` (call with `lock` held)."""
+        ended = sorted((job for job in self.jobs.values() if job.done), key=lambda job: job.finished or job.created)
+        expired = [job for job in ended if time.time() - (job.finished or job.created) > self.retention]
+        excess = ended[:max(0, len(ended) - self.max_finished)]
+        for job in expired + excess:
+            self.jobs.pop(job.id, None)
+
+    def cancel(self, job: ServiceJob) -> None:
+        """Cancel a job. Running ffmpeg processes are killed and their partial outputs deleted."""
+        if not job.done and job.task is not None:
+            job.task.cancel()
+
+    async def _run(self, job: ServiceJob) -> None:
+        """Run a job on the service's event loop."""
+        try:
+            async with self.job_slots:
+                job.out_dir = create_outfldr(job.operation, out_dir=job.output)
+                job.set_status('running')
+                job.result = await api.run(job.operation, job.input, job.out_dir, semaphore=self.task_slots,
+                                           on_event=job.add_event, **job.options)
+            job.set_status('finished' if job.result.ok else 'failed',
+                           None if job.result.ok else f"{len(job.result.errors)} file(s) failed.")
+        except asyncio.CancelledError:
+            job.set_status('cancelled')
+        except Exception as e:
+            job.set_status('failed', str(e))
+
+
+def create_app(service: Optional[JobService] = None) -> Flask:
+    """Create the Flask app of the HTTP service.
+
+    Endpoints
+    ---------
+    POST /jobs
+        Submit a job. JSON body: {"operation", "input", "output", "options"}. Returns the job (202).
+    GET /jobs
+        List all jobs.
+    GET /jobs/<id>
+        Get a job's status (and its result, once finished).
+    GET /jobs/<id>/events
+        Stream the job's per-file events as Server-Sent Events, until the job ends.
+    DELETE /jobs/<id>
+        Cancel a job.
+
+    Parameters
+    ----------
+    service : JobService, optional
+        The service that runs the jobs (default is None, which creates one).
+
+    Returns
+    -------
+    Flask
+        The app.
+    """
+    app = Flask(__name__)
+    service = service or JobService()
+    app.config['JOB_SERVICE'] = service
+
+    def get_job(job_id: str) -> ServiceJob:
+        job = service.jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    @app.errorhandler(KeyError)
+    def not_found(e):
+        return jsonify({"error": f"Job {e} not found."}), 404
+
+    @app.post('/jobs')
+    def submit_job():
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict) or not isinstance(data.get('options') or {}, dict):
+            return jsonify({"error": "The body and 'options' must be JSON objects."}), 400
+        try:
+            job = service.submit(data['operation'], data['input'], data['output'], data.get('options'))
+        except (KeyError, TypeError) as e:
+            return jsonify({"error": f"Missing field: {e}"}), 400
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(job.to_json()), 202
+
+    @app.get('/jobs')
+    def list_jobs():
+        with service.lock:
+            jobs = list(service.jobs.values())
+        return jsonify([job.to_json(with_result=False) for job in jobs])
+
+    @app.get('/jobs/<job_id>')
+    def job_status(job_id):
+        return jsonify(get_job(job_id).to_json())
+
+    @app.get('/jobs/<job_id>/events')
+    def job_events(job_id):
+        job = get_job(job_id)
+
+        def stream():
+            sent = 0
+            while True:
+                with job.changed:
+                    job.changed.wait_for(lambda: len(job.events) > sent or job.done, timeout=15)
+                    events = job.events[sent:]
+                    done = job.done
+                for event in events:
+                    yield f"data: {json.dumps(event)}\n\n"
+                sent += len(events)
+                if done and sent == len(job.events):
+                    return
+                if not events:
+                    # Keep the connection alive
+                    yield ": keep-alive\n\n"
+
+        return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    @app.delete('/jobs/<job_id>')
+    def cancel_job(job_id):
+        job = get_job(job_id)
+        service.cancel(job)
+        return jsonify(job.to_json(with_result=False))
+
+    return app
+
+
+def main() -> None:
+    """Start the HTTP service.
+
+    Usage:
+    python server.py [--host 127.0.0.1] [--port 5000] [--workers N] [--max-jobs N] [--retention SECONDS] [--max-finished N]
+    """
+    parser = argparse.ArgumentParser(description="Local HTTP job service for audio operations.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, help="Maximum number of ffmpeg processes across all jobs.")
+    parser.add_argument('--max-jobs', type=int, default=4, help="Maximum number of jobs running at once.")
+    parser.add_argument('--retention', type=float, default=3600.0, help="Seconds ended jobs are kept.")
+    parser.add_argument('--max-finished', type=int, default=100, help="Maximum number of ended jobs kept.")
+    args = parser.parse_args()
+
+    app = create_app(JobService(workers=args.workers, max_jobs=args.max_jobs,
+                                retention=args.retention, max_finished=args.max_finished))
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
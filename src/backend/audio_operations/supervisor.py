@@ -0,0 +1,410 @@
+import asyncio
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque, OrderedDict
+from cancellation import current_token
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# Time every ffmpeg job gets, whatever its length (seconds)
+TIMEOUT_BASE = 120.0
+
+# Extra time per second of input audio (ffmpeg usually runs far faster than realtime)
+TIMEOUT_PER_SECOND = 1.0
+
+# A job that reports no progress for this long is stalled (seconds)
+STALL_TIMEOUT = 120.0
+
+# Time an ffprobe call gets (seconds)
+PROBE_TIMEOUT = 60.0
+
+# Retries of jobs that failed for a transient reason, and the wait before the first retry (doubled each time)
+RETRIES = 2
+BACKOFF = 2.0
+
+# Time a process group gets to exit after SIGTERM, before SIGKILL (seconds)
+KILL_GRACE = 5.0
+
+# Time a cancelled process gets to exit before it is killed (seconds)
+CANCEL_GRACE = 0.5
+
+# How much of stderr is kept in an error message
+STDERR_TAIL = 2000
+
+# Bytes per second assumed for inputs that can't be probed (24-bit/48kHz stereo)
+FALLBACK_BYTES_PER_SECOND = 48000 * 3 * 2
+
+# Failure reasons, found in ffmpeg's stderr (first match wins)
+FAILURE_PATTERNS = (
+    ('disk_full', ('No space left on device', 'Disk quota exceeded')),
+    ('permission', ('Permission denied', 'Operation not permitted')),
+    ('io_error', ('Input/output error', 'Connection reset', 'Connection timed out', 'Stale file handle',
+                  'Resource temporarily unavailable', 'Host is down')),
+    ('not_found', ('No such file or directory',)),
+    ('invalid_input', ('Invalid data found when processing input', 'could not find codec parameters',
+                       'moov atom not found', 'Error while decoding', 'Invalid frame')),
+    ('unsupported', ('not supported', 'Unknown encoder', 'Unknown decoder', 'Option not found',
+                     'Invalid argument')),
+)
+
+# Failures worth retrying (the same command may succeed a moment later)
+TRANSIENT_FAILURES = ('timeout', 'stalled', 'io_error')
+
+# Failures of the current process, by label (first input of the task), for batch reports
+FAILURE_LOG_SIZE = 4096
+_failure_log: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_failure_lock = threading.Lock()
+
+
+class SupervisorError(RuntimeError):
+    """A supervised process failed.
+
+    Attributes
+    ----------
+    reason : str
+        Why it failed: 'timeout', 'stalled', 'cancelled', 'launch', 'exit', or a reason of `FAILURE_PATTERNS`.
+    attempts : int
+        How many times the command was run.
+    """
+
+    def __init__(self, reason: str, message: str, *, attempts: int = 1) -> None:
+        super().__init__(message)
+        self.reason = reason
+        self.attempts = attempts
+
+
+# Classify a failed process from its exit code and stderr
+def classify_failure(returncode: Optional[int], stderr: str) -> str:
+    """Get the reason a process failed (see `FAILURE_PATTERNS`), or 'exit' if it is not recognised."""
+    for reason, patterns in FAILURE_PATTERNS:
+        if any(pattern in stderr for pattern in patterns):
+            return reason
+    return 'exit'
+
+
+# Time limit of a job
+def job_timeout(duration: float) -> float:
+    """Get the time limit of a job that processes `duration` seconds of audio."""
+    return TIMEOUT_BASE + TIMEOUT_PER_SECOND * max(0.0, duration)
+
+
+# Duration of the longest input of a job
+def inputs_duration(paths: List[str]) -> float:
+    """Get the duration of the longest input, in seconds, from the files' headers.
+
+    Inputs that can't be probed (e.g. videos) are guessed from their size.
+    """
+    from helpers import get_header_info
+
+    duration = 0.0
+    for path in paths:
+        try:
+            header = get_header_info(path)
+            seconds = header['frames'] / header['sample_rate']
+        except (ValueError, ZeroDivisionError):
+            try:
+                seconds = os.path.getsize(path) / FALLBACK_BYTES_PER_SECOND
+            except OSError:
+                seconds = 0.0
+        duration = max(duration, seconds)
+    return duration
+
+
+# Add '-progress' to ffmpeg commands, so that stalls can be detected
+def with_progress(argv: List[str]) -> Tuple[List[str], bool]:
+    """Add '-progress pipe:1 -nostats' to an ffmpeg argument vector.
+
+    Returns
+    -------
+    Tuple[List[str], bool]
+        The argument vector, and True if it reports progress (ffmpeg), False otherwise (e.g. ffprobe).
+    """
+    if not os.path.basename(argv[0]).lower().startswith('ffmpeg'):
+        return list(argv), False
+    return [argv[0], '-progress', 'pipe:1', '-nostats', *argv[1:]], True
+
+
+# Record a final failure for the batch report
+def record_failure(label: Optional[str], error: SupervisorError) -> None:
+    """Store a failure under its label, so that `pop_failures()` can report it."""
+    if label is None:
+        return
+    with _failure_lock:
+        _failure_log[label] = {'reason': error.reason, 'attempts': error.attempts, 'error': str(error)}
+        _failure_log.move_to_end(label)
+        while len(_failure_log) > FAILURE_LOG_SIZE:
+            _failure_log.popitem(last=False)
+
+
+def pop_failures(labels: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Remove and return the recorded failures of the given labels (e.g. the input paths of a batch).
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Maps each failed label to its 'reason', 'attempts' and 'error'.
+    """
+    with _failure_lock:
+        return {label: _failure_log.pop(label) for label in labels if label in _failure_log}
+
+
+def _kill_group(proc: subprocess.Popen, grace: float = KILL_GRACE) -> None:
+    """Terminate a process and everything it started, then kill them if they don't exit within `grace` seconds."""
+    def send(sig):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(proc.pid, sig)
+            elif sig == signal.SIGTERM:
+                proc.terminate()
+            else:
+                proc.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    send(signal.SIGTERM)
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        send(getattr(signal, 'SIGKILL', signal.SIGTERM))
+        proc.wait()
+
+
+def _run_once(argv: List[str], *, timeout: Optional[float], stall_timeout: Optional[float],
+              capture: bool, cancel: Optional[Callable[[], bool]], capture_stderr: bool = False) -> str:
+    """Run a command once, watching its time, progress and the `cancel` check. See `run_supervised()`."""
+    argv, progress = with_progress(argv)
+    try:
+        proc = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                start_new_session=True)
+    except OSError as e:
+        raise SupervisorError('launch', f"Could not start '{argv[0]}': {e}")
+
+    stdout, stderr = [], deque(maxlen=200)
+    last_seen = [time.monotonic()]
+
+    # Read both pipes in threads (so the process never blocks on a full pipe)
+    def read_stdout():
+        for line in iter(proc.stdout.readline, b''):
+            last_seen[0] = time.monotonic()
+            if capture:
+                stdout.append(line)
+
+    def read_stderr():
+        for line in iter(proc.stderr.readline, b''):
+            stderr.append(line)
+
+    readers = [threading.Thread(target=read_stdout, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    start = time.monotonic()
+    failure = None
+    while proc.poll() is None:
+        now = time.monotonic()
+        if timeout and now - start > timeout:
+            failure = SupervisorError('timeout', f"'{os.path.basename(argv[0])}' timed out after {timeout:.0f}s")
+        elif progress and stall_timeout and now - last_seen[0] > stall_timeout:
+            failure = SupervisorError('stalled', f"'{os.path.basename(argv[0])}' made no progress for {stall_timeout:.0f}s")
+        elif cancel is not None and cancel():
+            failure = SupervisorError('cancelled', f"'{os.path.basename(argv[0])}' was cancelled")
+        if failure is not None:
+            _kill_group(proc, CANCEL_GRACE if failure.reason == 'cancelled' else KILL_GRACE)
+            break
+        time.sleep(0.2)
+
+    for reader in readers:
+        reader.join(timeout=KILL_GRACE)
+    if failure is not None:
+        raise failure
+
+    if proc.returncode != 0:
+        message = b''.join(stderr).decode(errors='replace').strip()[-STDERR_TAIL:]
+        raise SupervisorError(classify_failure(proc.returncode, message),
+                              f"'{os.path.basename(argv[0])}' exited with code {proc.returncode}: {message}")
+    if capture_stderr:
+        return b''.join(stderr).decode(errors='replace')
+    return b''.join(stdout).decode(errors='replace')
+
+
+# Run an ffmpeg/ffprobe command under supervision
+def run_supervised(argv: List[str], *,
+                   timeout: Optional[float] = None,
+                   stall_timeout: Optional[float] = STALL_TIMEOUT,
+                   retries: int = RETRIES,
+                   backoff: float = BACKOFF,
+                   capture: bool = False,
+                   capture_stderr: bool = False,
+                   label: Optional[str] = None,
+                   on_retry: Optional[Callable[[], None]] = None,
+                   cancel: Optional[Callable[[], bool]] = None) -> str:
+    """Run a command, killing it if it hangs, and retrying it if it failed for a transient reason.
+
+    - The process runs in its own process group, and the whole group is killed (SIGTERM, then SIGKILL).
+    - ffmpeg commands get '-progress pipe:1'. If no progress is reported for `stall_timeout`
+      seconds (e.g. a stalled network read), the process is killed as 'stalled'.
+    - Failures are classified (see `classify_failure()`), and 'timeout', 'stalled' and 'io_error'
+      failures are retried up to `retries` times, waiting `backoff` seconds, then twice as long...
+
+    Parameters
+    ----------
+    argv : List[str]
+        The argument vector (e.g. `Task.run_argv`).
+    timeout : float, optional
+        The time limit of each attempt, in seconds (default is None, which has no limit).
+        See `job_timeout()`.
+    stall_timeout : float, optional
+        The longest time without progress, in seconds (default is `STALL_TIMEOUT`). None disables it.
+    retries : int, optional
+        The number of retries after a transient failure (default is `RETRIES`).
+    backoff : float, optional
+        The wait before the first retry, in seconds (default is `BACKOFF`).
+    capture : bool, optional
+        If True, return the command's stdout (default is False). Not used with ffmpeg's progress.
+    capture_stderr : bool, optional
+        If True, return the last 200 lines of the command's stderr instead, e.g. the summary
+        an ffmpeg analysis filter logs (default is False).
+    label : str, optional
+        The name the final failure is recorded under for `pop_failures()` (default is None, which doesn't record it).
+    on_retry : Callable[[], None], optional
+        Called before every retry, e.g. to reset partial outputs (default is None).
+    cancel : Callable[[], bool], optional
+        Checked while the command runs. If it returns True, the process is killed as 'cancelled'
+        (after `CANCEL_GRACE` seconds at most) and not retried
+        (default is None, which uses the current `cancellation.CancelToken`, if any).
+
+    Returns
+    -------
+    str
+        The command's stdout if `capture` is True (its stderr if `capture_stderr` is True), otherwise an empty string.
+
+    Raises
+    ------
+    SupervisorError
+        If the command failed (after all retries), with the failure's `reason`.
+    """
+    cancel = cancel if cancel is not None else current_token()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if cancel is not None and cancel():
+                raise SupervisorError('cancelled', f"'{os.path.basename(argv[0])}' was cancelled before it started")
+            return _run_once(argv, timeout=timeout, stall_timeout=stall_timeout, capture=capture, cancel=cancel,
+                             capture_stderr=capture_stderr)
+        except SupervisorError as e:
+            e.attempts = attempt
+            if e.reason not in TRANSIENT_FAILURES or attempt > retries:
+                record_failure(label, e)
+                raise
+            wait = backoff * 2 ** (attempt - 1)
+            print(f"'{os.path.basename(label or argv[0])}': {e.reason}, retrying in {wait:.0f}s "
+                  f"(attempt {attempt + 1} of {retries + 1}).")
+            deadline = time.monotonic() + wait
+            while time.monotonic() < deadline and not (cancel is not None and cancel()):
+                time.sleep(min(0.2, deadline - time.monotonic()))
+            if on_retry is not None:
+                on_retry()
+
+
+# Asynchronous version, for api.run()
+async def run_supervised_async(argv: List[str], *,
+                               timeout: Optional[float] = None,
+                               stall_timeout: Optional[float] = STALL_TIMEOUT,
+                               retries: int = RETRIES,
+                               backoff: float = BACKOFF,
+                               label: Optional[str] = None,
+                               on_retry: Optional[Callable[[], None]] = None) -> None:
+    """Run a command like `run_supervised()`, as an asyncio subprocess.
+
+    If the awaiting task is cancelled, the process group is killed and `asyncio.CancelledError` is raised.
+
+    Parameters
+    ----------
+    argv, timeout, stall_timeout, retries, backoff, label, on_retry
+        See `run_supervised()`.
+
+    Raises
+    ------
+    SupervisorError
+        If the command failed (after all retries), with the failure's `reason`.
+    """
+    run_argv, progress = with_progress(argv)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *run_argv,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            error = SupervisorError('launch', f"Could not start '{argv[0]}': {e}", attempts=attempt)
+            record_failure(label, error)
+            raise error
+
+        stderr = deque(maxlen=200)
+        last_seen = [time.monotonic()]
+
+        async def read_stdout():
+            async for _ in proc.stdout:
+                last_seen[0] = time.monotonic()
+
+        async def read_stderr():
+            async for line in proc.stderr:
+                stderr.append(line)
+
+        async def watch():
+            start = time.monotonic()
+            while True:
+                await asyncio.sleep(0.2)
+                now = time.monotonic()
+                if timeout and now - start > timeout:
+                    return SupervisorError('timeout', f"'{os.path.basename(argv[0])}' timed out after {timeout:.0f}s")
+                if progress and stall_timeout and now - last_seen[0] > stall_timeout:
+                    return SupervisorError('stalled', f"'{os.path.basename(argv[0])}' made no progress for {stall_timeout:.0f}s")
+
+        def kill():
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(proc.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                else:
+                    proc.kill()
+            except (ProcessLookupError, PermissionError):
+                pass
+
+        readers = asyncio.gather(read_stdout(), read_stderr(), proc.wait())
+        watcher = asyncio.ensure_future(watch())
+        try:
+            done, _ = await asyncio.wait({readers, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            kill()
+            await proc.wait()
+            raise
+        finally:
+            watcher.cancel()
+
+        if watcher in done and watcher.exception() is None and watcher.result() is not None:
+            error = watcher.result()
+            kill()
+            await asyncio.gather(readers, return_exceptions=True)
+        elif proc.returncode != 0:
+            message = b''.join(stderr).decode(errors='replace').strip()[-STDERR_TAIL:]
+            error = SupervisorError(classify_failure(proc.returncode, message),
+                                    f"'{os.path.basename(argv[0])}' exited with code {proc.returncode}: {message}")
+        else:
+            return
+
+        error.attempts = attempt
+        if error.reason not in TRANSIENT_FAILURES or attempt > retries:
+            record_failure(label, error)
+            raise error
+        await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        if on_retry is not None:
+            await asyncio.to_thread(on_retry)
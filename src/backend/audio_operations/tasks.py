@@ -0,0 +1,235 @@
+import os
+import shutil
+from helpers import staging_path, preallocate
+from supervisor import run_supervised, job_timeout, inputs_duration
+from cancellation import CancelledError, current_token
+from pathlib import Path
+from typing import Any, Callable, Optional, List, Dict, Tuple, Union
+
+
+# A single unit of work of an operation
+class Task:
+    """One unit of work of an operation - usually a single ffmpeg command.
+
+    Operations are split in two steps: a `plan_*` function validates the input and returns
+    the tasks (without running anything), and the operation function runs them with `run_tasks()`.
+    This lets other callers (e.g. `api.run()`) run the same commands in a different way.
+
+    Parameters
+    ----------
+    inputs : List[str]
+        The paths to the input files of the task.
+    outputs : List[str]
+        The paths to the files the task writes.
+    cmd : plumbum.commands.base.BoundCommand, optional
+        The command to run (default is None).
+    action : Callable[[], Any], optional
+        A Python function to run instead of a command (default is None). Its return value is
+        used as the task's `method` if it is a string (e.g. 'reflink').
+    method : str, optional
+        How the task produces its outputs (default is 'ffmpeg').
+    dirs : List[str], optional
+        Folders to create before the task runs (default is None).
+    cleanup : List[str], optional
+        Paths to delete if the task fails (default is None, which uses `outputs`).
+    message : str, optional
+        The message printed when the task succeeds (default is None).
+    info : Dict[str, List[Any]], optional
+        Extra lists to add to the operation's result, e.g. {'skipped_channels': [...]} (default is None).
+
+    Notes
+    -----
+    After `stage_outputs()`, a command task writes its outputs under hidden temporary names
+    (see `helpers.staging_path()`) and renames them into place only when it succeeds, so that
+    partial files are never visible under their final names.
+    """
+
+    def __init__(self, inputs: List[str], outputs: List[str], *,
+                 cmd: Any = None,
+                 action: Optional[Callable[[], Any]] = None,
+                 method: str = 'ffmpeg',
+                 dirs: Optional[List[str]] = None,
+                 cleanup: Optional[List[str]] = None,
+                 message: Optional[str] = None,
+                 info: Optional[Dict[str, List[Any]]] = None) -> None:
+        if (cmd is None) == (action is None):
+            raise ValueError("A task needs either a command or an action.")
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cmd = cmd
+        self.action = action
+        self.method = method
+        self.dirs = list(dirs or [])
+        self.cleanup = list(outputs if cleanup is None else cleanup)
+        self.message = message
+        self.info = dict(info or {})
+        self.staging = {}   # output -> (temporary path, bytes to reserve)
+
+    @property
+    def argv(self) -> Optional[List[str]]:
+        """List[str] or None: The argument vector of the command (None for Python actions)."""
+        if self.cmd is None:
+            return None
+        return [str(arg) for arg in self.cmd.formulate()]
+
+    @property
+    def run_argv(self) -> Optional[List[str]]:
+        """List[str] or None: The argument vector actually run - `argv`, writing to the staged paths.
+
+        Staged outputs get '-truncate 0', so that ffmpeg keeps the disk space reserved for them.
+        """
+        argv = self.argv
+        if not argv or not self.staging:
+            return argv
+        run_argv = []
+        for arg in argv:
+            if arg in self.staging:
+                run_argv += ['-truncate', '0', self.staging[arg][0]]
+            else:
+                run_argv.append(arg)
+        return run_argv
+
+    def stage_outputs(self, sizes: Optional[Dict[str, Optional[int]]] = None) -> None:
+        """Write the outputs under temporary names, with their disk space reserved up front.
+
+        Only applies to command tasks (Python actions write their outputs themselves).
+
+        Parameters
+        ----------
+        sizes : Dict[str, Optional[int]], optional
+            The expected size of each output in bytes, e.g. from `planner.estimate_output_bytes()`.
+            Outputs without a size are staged but not preallocated (default is None).
+        """
+        if self.cmd is None:
+            return
+        sizes = sizes or {}
+        self.staging = {output: (staging_path(output), sizes.get(output)) for output in self.outputs}
+
+    def prepare(self) -> None:
+        """Create the folders the task writes into, and reserve space for staged outputs."""
+        for folder in self.dirs:
+            os.makedirs(folder, exist_ok=True)
+        for temp_path, size in self.staging.values():
+            os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+            preallocate(temp_path, size or 0)
+
+    def commit(self) -> None:
+        """Move staged outputs to their final names (called once the command has succeeded)."""
+        for output, (temp_path, _) in self.staging.items():
+            # Give back reserved space that was not used (estimates may be slightly too large)
+            os.truncate(temp_path, os.path.getsize(temp_path))
+            os.replace(temp_path, output)
+
+    @property
+    def timeout(self) -> float:
+        """float: The time limit of the command, scaled to the length of the inputs (see `supervisor.job_timeout()`)."""
+        return job_timeout(inputs_duration(self.inputs))
+
+    def run(self) -> None:
+        """Run the task (blocking).
+
+        Commands run under `supervisor.run_supervised()`: they are killed if they time out or stall,
+        and retried after transient failures.
+        """
+        self.prepare()
+        if self.cmd is not None:
+            run_supervised(self.run_argv, timeout=self.timeout, label=self.inputs[0] if self.inputs else None,
+                           on_retry=self.prepare)
+            self.commit()
+        else:
+            method = self.action()
+            if isinstance(method, str):
+                self.method = method
+
+    def clean(self) -> None:
+        """Delete the (partial) outputs of a failed task."""
+        for path in self.cleanup + [temp_path for temp_path, _ in self.staging.values()]:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Error: {e}")
+
+    def to_json(self) -> Dict[str, Any]:
+        """Convert the task to a JSON-ready dictionary."""
+        return {
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "argv": self.argv,
+            "method": self.method,
+            **self.info,
+        }
+
+    def __repr__(self) -> str:
+        return f"Task({[os.path.basename(path) for path in self.inputs]}, method={self.method!r})"
+
+
+# Run the tasks of an operation
+def run_tasks(tasks: List[Task]) -> Dict[str, Any]:
+    """Run the tasks of an operation one after the other.
+
+    Parameters
+    ----------
+    tasks : List[Task]
+        The tasks returned by a `plan_*` function.
+
+    Returns
+    -------
+    Dict[str, Any]
+        A dictionary with:
+        - 'outputs': The paths of all the files written (List[str]).
+        - 'method': The method used ('ffmpeg', a fast path method, 'mixed', or None if there were no tasks).
+        - 'errors': Maps the first input of each failed task to its error (only if a task failed).
+        - 'failures': Maps the first input of each failed task to the reason it failed, e.g. 'timeout'
+          (see `supervisor.SupervisorError`; 'error' for other exceptions) (only if a task failed).
+        - The lists in each successful task's `info` (e.g. 'skipped_channels'), joined.
+
+    Raises
+    ------
+    RuntimeError
+        If every task failed (so that nothing was written). It is raised from the last task's error.
+    cancellation.CancelledError
+        If the run was cancelled (see `cancellation.CancelToken`). The interrupted task's outputs
+        are deleted, and the remaining tasks don't run.
+
+    Notes
+    -----
+    A failed task's outputs are deleted, and the remaining tasks still run.
+    """
+    outputs, methods, errors, failures, info = [], set(), {}, {}, {}
+    cancel = current_token()
+    last_error = None
+
+    for task in tasks:
+        if cancel is not None:
+            cancel.check()
+        try:
+            task.run()
+            outputs.extend(task.outputs)
+            methods.add(task.method)
+            for key, values in task.info.items():
+                info.setdefault(key, []).extend(values)
+            if task.message:
+                print(task.message)
+        except Exception as e:
+            label = os.path.basename(task.inputs[0]) if task.inputs else '?'
+            errors[label] = str(e)
+            failures[label] = getattr(e, 'reason', 'error')
+            last_error = e
+            task.clean()
+            if cancel is not None and cancel.cancelled:
+                raise CancelledError(f"'{label}' was cancelled.") from e
+            print(f"'{label}' failed.")
+            print(e)
+
+    if tasks and len(errors) == len(tasks):
+        raise RuntimeError(f"All {len(tasks)} task(s) failed.") from last_error
+
+    method = methods.pop() if len(methods) == 1 else ('mixed' if methods else None)
+    result = {'outputs': outputs, 'method': method, **info}
+    if errors:
+        result['errors'] = errors
+        result['failures'] = failures
+    return result
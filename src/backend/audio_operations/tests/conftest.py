@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+# The modules of audio_operations import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import get_ffmpeg  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def ffmpeg():
+    """A plumbum command for ffmpeg (the bundled or the local one). Tests that use it are skipped without one."""
+    try:
+        cmd = get_ffmpeg()
+    except OSError:
+        pytest.skip("ffmpeg is not available")
+    return cmd['-v', 'error', '-nostdin', '-y']
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Keep the on-disk caches of every test in its own folder."""
+    monkeypatch.setenv('AUDIO_OPERATIONS_CACHE', str(tmp_path / 'cache'))
@@ -0,0 +1,104 @@
+"""Output parity of the native engine (`pcm_engine.transcode()`) against ffmpeg, and the overviews it builds."""
+import numpy as np
+import pytest
+import soundfile as sf
+from helpers import read_wav_channel_mask, write_wav_channel_mask
+from layouts import LAYOUTS
+from pcm_engine import transcode, downmix, downmix_matrix, compare, CODEC_SUBTYPES, _bench_signal
+from peaks import compute_peaks, get_peaks, read_peaks
+
+
+# Largest difference allowed between the native and ffmpeg resamplers (both are about -96 dBFS)
+RESAMPLE_MAX_DIFF_DB = -90.0
+
+# Channel mask of 5.1(side): FL FR FC LFE SL SR
+MASK_51_SIDE = 0x60F
+
+
+def make_input(path, *, rate=48000, subtype='PCM_24', channels=6, seconds=2.0, mask=None):
+    """Write a test signal (a few sines per channel), as WAVEX with `mask` if given."""
+    sf.write(str(path), _bench_signal(int(seconds * rate), channels, rate), rate, subtype=subtype,
+             format='WAVEX' if mask is not None else 'WAV')
+    if mask is not None:
+        write_wav_channel_mask(str(path), mask)
+    return str(path)
+
+
+def convert_both(ffmpeg, tmp_path, src, *, rate, codec):
+    """Convert `src` with both engines, and return the (native, ffmpeg) output paths."""
+    native_out, ffmpeg_out = str(tmp_path / "native.wav"), str(tmp_path / "ffmpeg.wav")
+    transcode(src, native_out, sample_rate=rate, subtype=CODEC_SUBTYPES[codec], container='WAV')
+    ffmpeg['-i', src, '-ar', str(rate), '-c:a', codec, ffmpeg_out]()
+    return native_out, ffmpeg_out
+
+
+@pytest.mark.parametrize('in_subtype, codec', [
+    ('PCM_24', 'pcm_s16le'),   # truncation
+    ('PCM_24', 'pcm_s24le'),   # copy
+    ('PCM_16', 'pcm_s24le'),
+])
+def test_same_rate_is_bit_identical(ffmpeg, tmp_path, in_subtype, codec):
+    src = make_input(tmp_path / "in.wav", subtype=in_subtype)
+    result = compare(*convert_both(ffmpeg, tmp_path, src, rate=48000, codec=codec))
+    assert result['identical'], result
+
+
+@pytest.mark.parametrize('in_rate, out_rate', [(44100, 48000), (48000, 44100)])
+def test_resampler_matches_ffmpeg(ffmpeg, tmp_path, in_rate, out_rate):
+    src = make_input(tmp_path / "in.wav", rate=in_rate)
+    result = compare(*convert_both(ffmpeg, tmp_path, src, rate=out_rate, codec='pcm_s24le'))
+    assert result['frames'][0] == result['frames'][1]
+    assert result['max_diff_db'] <= RESAMPLE_MAX_DIFF_DB, result
+
+
+@pytest.mark.parametrize('rate, subtype', [(48000, 'PCM_16'), (48000, 'PCM_24'), (44100, 'PCM_24')])
+def test_channel_mask_is_kept(tmp_path, rate, subtype):
+    src = make_input(tmp_path / "in.wav", mask=MASK_51_SIDE)
+    out = str(tmp_path / "out.wav")
+    transcode(src, out, sample_rate=rate, subtype=subtype, container='WAV')
+    assert read_wav_channel_mask(out) == MASK_51_SIDE
+
+
+def test_channel_mask_matches_ffmpeg(ffmpeg, tmp_path):
+    src = make_input(tmp_path / "in.wav", mask=MASK_51_SIDE)
+    native_out, ffmpeg_out = convert_both(ffmpeg, tmp_path, src, rate=48000, codec='pcm_s16le')
+    assert read_wav_channel_mask(native_out) == read_wav_channel_mask(ffmpeg_out) == MASK_51_SIDE
+    assert compare(native_out, ffmpeg_out)['identical']
+
+
+def test_no_mask_stays_plain_wav(tmp_path):
+    src = make_input(tmp_path / "in.wav")
+    out = str(tmp_path / "out.wav")
+    transcode(src, out, sample_rate=48000, subtype='PCM_16', container='WAV')
+    assert read_wav_channel_mask(out) is None
+    a, _ = sf.read(src, dtype='int32')
+    b, _ = sf.read(out, dtype='int32')
+    assert np.array_equal(a >> 16 << 16, b)
+
+
+def assert_peaks_built(src):
+    """Check that `src` has cached peaks, the same as a separate peaks pass builds."""
+    peaks = get_peaks(src, compute=False)
+    assert peaks is not None
+    assert np.array_equal(read_peaks(peaks), compute_peaks(src).finish()[0])
+
+
+@pytest.mark.parametrize('subtype, rate', [('PCM_24', 48000), ('FLOAT', 48000), ('PCM_24', 44100)])
+def test_transcode_builds_peaks(tmp_path, subtype, rate):
+    src = make_input(tmp_path / "in.wav", subtype=subtype)
+    transcode(src, str(tmp_path / "out.wav"), sample_rate=rate, subtype='PCM_16', container='WAV')
+    assert_peaks_built(src)
+
+
+def test_segment_builds_no_peaks(tmp_path):
+    src = make_input(tmp_path / "in.wav")
+    transcode(src, str(tmp_path / "out.wav"), sample_rate=48000, subtype='PCM_16', container='WAV', stop=48000)
+    assert get_peaks(src, compute=False) is None
+
+
+@pytest.mark.parametrize('subtype, ext', [('PCM_24', 'wav'), ('PCM_24', 'flac')])
+def test_downmix_builds_peaks(tmp_path, subtype, ext):
+    src = str(tmp_path / f"in.{ext}")
+    sf.write(src, _bench_signal(96000, 6, 48000), 48000, subtype=subtype)
+    downmix(src, [(str(tmp_path / f"out.{ext}"), downmix_matrix('loro', LAYOUTS.get('5.1'))[1])])
+    assert_peaks_built(src)